@@ -0,0 +1,89 @@
+import asyncio
+from collections import deque
+
+
+class Mailbox:
+    __slots__ = ('key', 'messages', 'scheduled')
+
+    def __init__(self, key):
+        self.key = key
+        self.messages = deque()
+        self.scheduled = False
+
+
+class ActorPool:
+    """One mailbox per key (a live match's session_id), drained by a fixed set of shard tasks.
+
+    Messages for a key run one at a time and in the order they were posted; different keys run concurrently,
+    on `shards` tasks chosen by key. A shard takes one message from each ready mailbox in turn, so a busy
+    match cannot starve the others on its shard. Mailboxes exist only while they hold messages. Before
+    `start`, and after `stop`, `call` runs the message directly.
+    """
+
+    def __init__(self, shards: int = 64):
+        self.shards = shards
+        self.mailboxes = {}
+        self.processed = 0
+        self._ready = []
+        self._tasks = []
+        self._stopping = False
+
+    def __len__(self):
+        return len(self.mailboxes)
+
+    async def call(self, key, func, *args):
+        """Runs `await func(*args)` in `key`'s mailbox and returns its result."""
+        if not self._tasks:
+            return await func(*args)
+        future = asyncio.get_running_loop().create_future()
+        mailbox = self.mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self.mailboxes[key] = Mailbox(key)
+        mailbox.messages.append((func, args, future))
+        if not mailbox.scheduled:
+            mailbox.scheduled = True
+            self._ready[hash(key) % self.shards].put_nowait(mailbox)
+        return await future
+
+    async def _work(self, ready: asyncio.Queue):
+        while True:
+            mailbox = await ready.get()
+            func, args, future = mailbox.messages.popleft()
+            if not future.cancelled():
+                try:
+                    result = await func(*args)
+                except asyncio.CancelledError:
+                    future.cancel()
+                    # A handler cancelling itself only fails its own call; the shard stops only with the pool.
+                    if self._stopping:
+                        raise
+                except Exception as e:
+                    if not future.cancelled():
+                        future.set_exception(e)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+            self.processed += 1
+            if mailbox.messages:
+                ready.put_nowait(mailbox)
+            else:
+                mailbox.scheduled = False
+                del self.mailboxes[mailbox.key]
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._ready = [asyncio.Queue() for _ in range(self.shards)]
+        self._tasks = [asyncio.create_task(self._work(ready)) for ready in self._ready]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        self._stopping = True
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for mailbox in self.mailboxes.values():
+            for _, _, future in mailbox.messages:
+                future.cancel()
+        self.mailboxes.clear()
@@ -0,0 +1,179 @@
+"""Moves finished game sessions out of game_sessions into gzipped JSON-lines files.
+
+Completed and timed-out sessions that finished more than `older_than` seconds ago are archived in chunks
+ordered by session_id: each chunk is written to `sessions-{first:012d}-{last:012d}.jsonl.gz` and then deleted
+from the table in its own short transaction. Sessions finish out of id order, so a later chunk can hold ids that
+fall inside an earlier chunk's range. If the delete does not commit, the rows stay in the table and are archived
+again by a later run, possibly into a second file. `iter_sessions` reads the archive back lazily, merging
+overlapping files by session_id and skipping duplicates.
+"""
+import asyncio
+import fcntl
+import gzip
+import heapq
+import itertools
+import json
+import math
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, or_, select
+
+from models import GameSession
+
+logger = logging.getLogger(__name__)
+
+FILE_PREFIX = "sessions-"
+COLUMNS = [column.name for column in GameSession.__table__.columns]
+
+
+def _row(session: GameSession):
+    row = {}
+    for name in COLUMNS:
+        value = getattr(session, name)
+        row[name] = value.isoformat() if isinstance(value, datetime) else value
+    return row
+
+
+def _write_chunk(path: str, rows):
+    with gzip.open(path + ".tmp", "wt") as chunk:
+        for row in rows:
+            chunk.write(json.dumps(row, separators=(",", ":")) + "\n")
+    with open(path + ".tmp", "rb") as chunk:
+        os.fsync(chunk.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def archive_files(directory: str):
+    """Returns [(first_session_id, last_session_id, path)] ordered by first_session_id. Files written before
+    names carried the last id have no known end."""
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for name in os.listdir(directory):
+        if name.startswith(FILE_PREFIX) and name.endswith(".jsonl.gz"):
+            ids = name[len(FILE_PREFIX):-len(".jsonl.gz")].split("-")
+            last = int(ids[1]) if len(ids) > 1 else math.inf
+            files.append((int(ids[0]), last, os.path.join(directory, name)))
+    return sorted(files)
+
+
+def _read_chunk(path: str):
+    with gzip.open(path, "rt") as chunk:
+        for line in chunk:
+            yield json.loads(line)
+
+
+def iter_sessions(directory: str, player_id: int = None, after_session_id: int = 0):
+    """Yields archived sessions as dicts in session_id order, optionally only those `player_id` played in.
+    Files ending at or before `after_session_id` are skipped, and a file is only opened once the merge reaches
+    its first session_id."""
+    waiting = [(first, path) for first, last, path in archive_files(directory) if last > after_session_id]
+    waiting.reverse()
+    heap = []
+    order = itertools.count()
+    last_yielded = after_session_id
+    while heap or waiting:
+        while waiting and (not heap or waiting[-1][0] <= heap[0][0]):
+            rows = _read_chunk(waiting.pop()[1])
+            session = next(rows, None)
+            if session is not None:
+                heapq.heappush(heap, (session["session_id"], next(order), session, rows))
+        session_id, _, session, rows = heapq.heappop(heap)
+        following = next(rows, None)
+        if following is not None:
+            heapq.heappush(heap, (following["session_id"], next(order), following, rows))
+        if session_id <= last_yielded:
+            continue
+        last_yielded = session_id
+        if player_id is not None and player_id not in (session["player1_id"], session["player2_id"]):
+            continue
+        yield session
+
+
+class Archiver:
+    def __init__(self, session_factory, directory: str, older_than: float, chunk_size: int = 5000,
+                 interval: float = 3600, pause: float = 0.1):
+        self.session_factory = session_factory
+        self.directory = directory
+        self.older_than = older_than
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.pause = pause
+        self.archived = 0
+        self.runs = 0
+        self._task = None
+
+    def archivable(self, cutoff: datetime):
+        return select(GameSession).where(
+            GameSession.status.in_(('completed', 'timeout')),
+            GameSession.finished_at < cutoff,
+            # A result whose stats are not applied yet stays until the stats aggregator has seen it.
+            or_(GameSession.stats_applied.is_(True), GameSession.player1_move.is_(None),
+                GameSession.player2_move.is_(None)),
+        ).order_by(GameSession.session_id).limit(self.chunk_size)
+
+    async def archive_once(self):
+        """Archives everything that is old enough, a chunk at a time. Returns the number of sessions moved,
+        or None if another worker holds the archive lock."""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_fd = os.open(os.path.join(self.directory, "lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=self.older_than)
+            archived = 0
+            while True:
+                moved = await self._archive_chunk(cutoff)
+                archived += moved
+                if moved < self.chunk_size:
+                    break
+                # Give the hot path a turn at the table between chunks.
+                await asyncio.sleep(self.pause)
+        finally:
+            os.close(lock_fd)
+        self.archived += archived
+        self.runs += 1
+        return archived
+
+    async def _archive_chunk(self, cutoff: datetime):
+        async with self.session_factory() as db:
+            sessions = (await db.execute(self.archivable(cutoff))).scalars().all()
+            if not sessions:
+                return 0
+            rows = [_row(session) for session in sessions]
+            path = os.path.join(self.directory,
+                                f"{FILE_PREFIX}{rows[0]['session_id']:012d}-{rows[-1]['session_id']:012d}.jsonl.gz")
+            await asyncio.get_running_loop().run_in_executor(None, _write_chunk, path, rows)
+            await db.execute(delete(GameSession).where(
+                GameSession.session_id.in_([row['session_id'] for row in rows])
+            ).execution_options(synchronize_session=False))
+            await db.commit()
+            return len(rows)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                archived = await self.archive_once()
+            except Exception:
+                logger.exception("Error archiving game sessions")
+                continue
+            if archived:
+                logger.info("Archived game sessions", extra={"sessions": archived})
+
+    def start(self):
+        if self._task is None and self.interval:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
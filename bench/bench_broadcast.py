@@ -0,0 +1,87 @@
+"""Cost of pushing match updates to many spectators.
+
+    python bench/bench_broadcast.py [--viewers 10000] [--updates 100]
+
+Subscribes `viewers` in-memory sockets to one channel, publishes `updates` batches of two deltas each and
+reports the time per batch (including the sockets' writer tasks) and how many frames were serialized, next to
+sending each delta to each viewer as its own message.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol  # noqa: E402
+from broadcast import BroadcastHub  # noqa: E402
+from connection import Connection  # noqa: E402
+
+
+class NullWebSocket:
+    __slots__ = ()
+
+    async def send_text(self, frame):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+def counting_encoder():
+    counter = {"encoded": 0}
+    encode_message = protocol.JSON.encode_message
+
+    def encode(message):
+        counter["encoded"] += 1
+        return encode_message(message)
+
+    protocol.JSON.encode_message = encode
+    return counter, encode_message
+
+
+async def broadcast(connections, updates):
+    hub = BroadcastHub()
+    for connection in connections:
+        hub.subscribe("final", connection)
+    await asyncio.gather(*(connection.drain() for connection in connections))
+    for update in range(updates):
+        hub.publish("final", {"player1_moved": True})
+        hub.publish("final", {"status": "completed", "winner": str(update)})
+        # The batch goes out on the next tick.
+        await asyncio.sleep(0)
+
+
+async def per_viewer(connections, updates):
+    for update in range(updates):
+        for delta in ({"player1_moved": True}, {"status": "completed", "winner": str(update)}):
+            for connection in connections:
+                connection.send({"action": "spectate_update", "channel": "final", "deltas": [delta]})
+        await asyncio.sleep(0)
+
+
+async def measure(run, viewers, updates):
+    connections = [Connection(NullWebSocket(), max_pending=2 * updates + 1) for _ in range(viewers)]
+    counter, encode_message = counting_encoder()
+    started = time.perf_counter()
+    try:
+        await run(connections, updates)
+        await asyncio.gather(*(connection.drain() for connection in connections))
+    finally:
+        protocol.JSON.encode_message = encode_message
+    return (time.perf_counter() - started) / updates, counter["encoded"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--viewers", type=int, default=10_000)
+    parser.add_argument("--updates", type=int, default=100)
+    args = parser.parse_args()
+    for name, run in (("per-viewer json.dumps", per_viewer), ("broadcast hub", broadcast)):
+        seconds, encoded = asyncio.run(measure(run, args.viewers, args.updates))
+        print(f"{name:<24}{seconds * 1000:>10.2f} ms per update{encoded:>12,} serializations")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Matchmaking queue throughput with a large number of queued players.
+
+    python bench/bench_matchmaking.py [players]
+
+Compares MatchmakingQueue with the list-based queue GameManager used before (append / pop(0) / remove).
+Players arrive with random win rates and RTTs, so the bucketed queue spreads them over every bucket; its
+pair_waiting run is what the widen timers do once everyone has waited long enough to match anyone.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchmaking import MatchmakingQueue  # noqa: E402
+
+
+def timed(label, count, func):
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {count / elapsed:>14,.0f} ops/s")
+
+
+def bench_queue(queue, players, cancelled, profiles):
+    timed("MatchmakingQueue enqueue", len(players), lambda: [queue.enqueue(p, *profiles[p]) for p in players])
+    timed("MatchmakingQueue cancel", len(cancelled), lambda: [queue.cancel(p) for p in cancelled])
+    remaining = len(queue)
+    timed("MatchmakingQueue match", remaining,
+          lambda: [queue.match(f"new{i}", *profiles[players[i]]) for i in range(remaining)])
+    if queue.skill_buckets or queue.rtt_bucket_ms:
+        queue.clock = lambda: time.monotonic() + 100 * queue.widen_after
+        waiting = len(queue)
+        timed("MatchmakingQueue pair_waiting", waiting, queue.pair_waiting)
+
+
+def bench_list(players, cancelled):
+    waiting = []
+    timed("list append", len(players), lambda: [waiting.append(p) for p in players])
+    timed("list remove", len(cancelled), lambda: [waiting.remove(p) for p in cancelled])
+    remaining = len(waiting)
+    timed("list pop(0)", remaining, lambda: [waiting.pop(0) for _ in range(remaining)])
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    players = [str(i) for i in range(count)]
+    rng = random.Random(42)
+    profiles = {p: (rng.random(), rng.uniform(0, 300)) for p in players}
+    cancelled = rng.sample(players, count // 10)
+    print(f"{count:,} queued players, {len(cancelled):,} cancellations")
+
+    bench_queue(MatchmakingQueue(), players, cancelled, profiles)
+    bench_queue(MatchmakingQueue(skill_buckets=10, rtt_bucket_ms=50), players, cancelled, profiles)
+    bench_list(players, cancelled)
+
+
+if __name__ == "__main__":
+    main()
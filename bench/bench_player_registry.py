@@ -0,0 +1,73 @@
+"""Memory held by GameManager per connected player.
+
+    python bench/bench_player_registry.py [--players 100000] [--playing 0.5]
+
+Connects `players` simulated sockets through GameManager.connect, puts a `playing` fraction of them into
+matches and reports the Python heap allocated per player (tracemalloc), excluding the fake sockets themselves.
+No network or database is involved. With separate string-keyed dicts and an always-running writer task per
+connection this was 5,290 bytes per player; with the PlayerRecord registry it is about 1,300.
+"""
+import argparse
+import asyncio
+import gc
+import os
+import sys
+import tempfile
+import tracemalloc
+
+os.environ.setdefault("EVENT_LOG_DIR", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game import GameManager  # noqa: E402
+
+
+class FakeWebSocket:
+    __slots__ = ('scope',)
+
+    def __init__(self):
+        self.scope = {}
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, data):
+        pass
+
+    async def send_bytes(self, data):
+        pass
+
+    async def close(self, code=1000):
+        pass
+
+
+async def measure(players, playing):
+    manager = GameManager()
+    sockets = [FakeWebSocket() for _ in range(players)]
+    user_ids = range(1, players + 1)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for user_id, websocket in zip(user_ids, sockets):
+        await manager.connect(websocket, user_id)
+    for user_id in range(1, int(players * playing) + 1, 2):
+        await manager.register_match(user_id, user_id, user_id + 1)
+    # Let every socket's session message go out.
+    await asyncio.sleep(0)
+    await asyncio.gather(*(manager.players[user_id].connection.drain() for user_id in user_ids))
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / players
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--playing", type=float, default=0.5, help="fraction of players in a match")
+    args = parser.parse_args()
+    per_player = asyncio.run(measure(args.players, args.playing))
+    print(f"{args.players:,} players, {args.playing:.0%} playing: {per_player:,.0f} bytes per player")
+
+
+if __name__ == "__main__":
+    main()
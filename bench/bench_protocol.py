@@ -0,0 +1,53 @@
+"""Encode/decode cost per message type for the JSON and msgpack WebSocket protocols.
+
+    python bench/bench_protocol.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import protocol  # noqa: E402
+
+MESSAGES = {
+    "make_move (in)": {"action": "make_move", "move": "rock"},
+    "game_started": {"message": "Game started with 123456", "session_id": 987654},
+    "game_result": {"action": "game_result", "winner": "123456", "result": "You won!"},
+    "play_again_request": {"action": "play_again_request", "data": "123456", "user_info": "some_nickname"},
+    "timeout": {"action": "timeout", "timed_out_user_id": "123456"},
+}
+CONSTANTS = {
+    "game_over (cached)": protocol.GAME_OVER,
+    "draw result (cached)": protocol.DRAW_RESULT,
+}
+
+
+def per_call_ns(func, iterations):
+    return timeit.timeit(func, number=iterations) / iterations * 1e9
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    codecs = list(protocol.CODECS.values())
+    header = f"{'message':<24}" + "".join(f"{codec.name + ' enc':>18}{codec.name + ' dec':>18}" for codec in codecs)
+    print(f"ns per message, {iterations:,} iterations")
+    print(header)
+    for name, message in MESSAGES.items():
+        row = f"{name:<24}"
+        for codec in codecs:
+            frame = codec.encode(message)
+            row += f"{per_call_ns(lambda: codec.encode(message), iterations):>18.0f}"
+            row += f"{per_call_ns(lambda: codec.decode(frame), iterations):>18.0f}"
+        print(row)
+    for name, message in CONSTANTS.items():
+        row = f"{name:<24}"
+        for codec in codecs:
+            frame = codec.encode(message)
+            row += f"{per_call_ns(lambda: codec.encode(message), iterations):>18.0f}"
+            row += f"{per_call_ns(lambda: codec.decode(frame), iterations):>18.0f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
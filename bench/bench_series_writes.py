@@ -0,0 +1,84 @@
+"""Database writes for N rounds played as rematches versus as one best-of-N series.
+
+    python bench/bench_series_writes.py [--rounds 9]
+
+Plays one best-of-`rounds` series between two players on an in-memory SQLite database, then the same rounds
+as separate games (what the play-again loop does: a new session per round), and counts the INSERT/UPDATE
+statements, the rows they wrote and the commits. Buffered stats are flushed after every game, since players take
+longer than STATS_FLUSH_INTERVAL to play a round.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("EVENT_LOG_DIR", tempfile.mkdtemp())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+import models  # noqa: E402
+from game import GameManager  # noqa: E402
+
+# Player 1 never loses, so a series stops as soon as it is decided; draws keep every round in play.
+MOVES = [("rock", "scissors"), ("paper", "paper")]
+
+
+async def database():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with session_factory() as db:
+        for user_id in (1, 2):
+            db.add(models.User(user_id=user_id, nickname=f"player{user_id}", password="x"))
+            db.add(models.GameStat(user_id=user_id, wins=0, losses=0, draws=0))
+        await db.commit()
+    counts = {"statements": 0, "rows": 0, "commits": 0}
+
+    def count_write(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("INSERT", "UPDATE")):
+            counts["statements"] += 1
+            counts["rows"] += max(cursor.rowcount, 0)
+
+    event.listen(engine.sync_engine, "after_cursor_execute", count_write)
+    event.listen(engine.sync_engine, "commit", lambda conn: counts.__setitem__("commits", counts["commits"] + 1))
+    return engine, session_factory, counts
+
+
+async def play(rounds, best_of):
+    engine, session_factory, counts = await database()
+    manager = GameManager(session_factory)
+    async with session_factory() as db:
+        played = 0
+        while played < rounds:
+            await manager.create_session(1, 2, db, best_of)
+            while manager.player_match(1) is not None:
+                move1, move2 = MOVES[played % len(MOVES)]
+                await manager.make_move(1, move1, db)
+                await manager.make_move(2, move2, db)
+                played += 1
+            await manager.stats.flush()
+            if best_of > 1:
+                break
+    await manager.events.stop()
+    await engine.dispose()
+    return played, counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=9)
+    args = parser.parse_args()
+    played, series = asyncio.run(play(args.rounds, args.rounds))
+    _, games = asyncio.run(play(played, 1))
+    for name, counts in ((f"best-of-{args.rounds} series", series), ("separate games", games)):
+        print(f"{name:<22}{played:>3} rounds{counts['statements']:>5} writes{counts['rows']:>5} rows"
+              f"{counts['commits']:>5} commits")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Latest-session lookup latency before and after the composite game_sessions indexes.
+
+    python bench/bench_session_lookup.py [--sessions 10000000] [--players 100000] [--url DATABASE_URL]
+
+Seeds a local database (a SQLite file by default; pass a mysql+aiomysql URL to use MySQL) and compares
+the old OR-filtered query on the foreign-key indexes with crud.get_latest_game_session on the composite
+indexes. Seeding 10M sessions takes several minutes.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert, select, text  # noqa: E402
+from sqlalchemy.engine import make_url  # noqa: E402
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+import crud  # noqa: E402
+import models  # noqa: E402
+
+SYNC_DRIVERS = {"sqlite+aiosqlite": "sqlite", "mysql+aiomysql": "mysql+pymysql"}
+STATUSES = ['completed'] * 8 + ['timeout', 'waiting']
+CHUNK = 50_000
+game_sessions = models.GameSession.__table__
+composite_indexes = [index for index in game_sessions.indexes if index.name.endswith('_status')]
+# What MySQL creates implicitly for the player foreign keys.
+foreign_key_indexes = ["CREATE INDEX ix_bench_player1 ON game_sessions (player1_id)",
+                       "CREATE INDEX ix_bench_player2 ON game_sessions (player2_id)"]
+
+
+def seed(sync_url, sessions, players):
+    engine = create_engine(sync_url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    rng = random.Random(42)
+    with engine.begin() as conn:
+        for index in composite_indexes:
+            index.drop(conn)
+        conn.execute(insert(models.User.__table__), [
+            {"user_id": user_id, "nickname": f"player{user_id}", "password": "x"} for user_id in range(1, players + 1)
+        ])
+    for start in range(0, sessions, CHUNK):
+        rows = []
+        for _ in range(min(CHUNK, sessions - start)):
+            player1_id, player2_id = rng.sample(range(1, players + 1), 2)
+            rows.append({"player1_id": player1_id, "player2_id": player2_id, "status": rng.choice(STATUSES),
+                         "player1_move": "rock", "player2_move": "paper", "stats_applied": True})
+        with engine.begin() as conn:
+            conn.execute(insert(game_sessions), rows)
+        print(f"\rseeded {start + len(rows):,} sessions", end="", flush=True)
+    print()
+    with engine.begin() as conn:
+        if engine.dialect.name == "sqlite":
+            for index in foreign_key_indexes:
+                conn.execute(text(index))
+            conn.execute(text("ANALYZE"))
+    return engine
+
+
+async def old_lookup(db, user_id, status):
+    query = select(models.GameSession).filter(
+        (models.GameSession.player1_id == user_id) | (models.GameSession.player2_id == user_id),
+        models.GameSession.status == status,
+    ).order_by(models.GameSession.session_id.desc()).limit(1)
+    return (await db.execute(query)).scalars().first()
+
+
+async def new_lookup(db, user_id, status):
+    return await crud.get_latest_game_session(db, user_id, status=status)
+
+
+async def measure(url, lookup, user_ids):
+    engine = create_async_engine(url)
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+    timings = []
+    async with session_factory() as db:
+        for user_id in user_ids:
+            started = time.perf_counter()
+            await lookup(db, user_id, 'completed')
+            timings.append((time.perf_counter() - started) * 1000)
+            db.expunge_all()
+    await engine.dispose()
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=10_000_000)
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--url", default=f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_sessions.db")
+    args = parser.parse_args()
+
+    url = make_url(args.url)
+    sync_engine = seed(url.set(drivername=SYNC_DRIVERS[url.drivername]), args.sessions, args.players)
+    user_ids = random.Random(7).sample(range(1, args.players + 1), min(args.queries, args.players))
+
+    print(f"{'query':<46} {'p50 ms':>10} {'p99 ms':>10}")
+    before = await measure(args.url, old_lookup, user_ids)
+    print(f"{'before: OR filter, foreign-key indexes':<46} {before[0]:>10.3f} {before[1]:>10.3f}")
+
+    with sync_engine.begin() as conn:
+        for index in composite_indexes:
+            index.create(conn)
+        if sync_engine.dialect.name == "sqlite":
+            conn.execute(text("ANALYZE"))
+    after_or = await measure(args.url, old_lookup, user_ids)
+    print(f"{'OR filter, composite indexes':<46} {after_or[0]:>10.3f} {after_or[1]:>10.3f}")
+    after = await measure(args.url, new_lookup, user_ids)
+    print(f"{'after: UNION lookup, composite indexes':<46} {after[0]:>10.3f} {after[1]:>10.3f}")
+    sync_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""Per-game GameStat updates versus the write-behind StatsAggregator.
+
+    python bench/bench_stats.py [games] [database_url]
+
+Defaults to 5,000 games against a temporary SQLite file.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine  # noqa: E402
+
+import models  # noqa: E402
+from stats import StatsAggregator  # noqa: E402
+
+PLAYERS = 200
+
+
+async def setup(url):
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.drop_all)
+        await conn.run_sync(models.Base.metadata.create_all)
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with session_factory() as db:
+        for user_id in range(1, PLAYERS + 1):
+            db.add(models.User(user_id=user_id, nickname=f"player{user_id}", password="password"))
+            db.add(models.GameStat(user_id=user_id, wins=0, losses=0, draws=0))
+        await db.commit()
+    return engine, session_factory
+
+
+async def create_sessions(session_factory, games):
+    rng = random.Random(42)
+    sessions = []
+    async with session_factory() as db:
+        for _ in range(games):
+            player1_id, player2_id = rng.sample(range(1, PLAYERS + 1), 2)
+            session = models.GameSession(player1_id=player1_id, player2_id=player2_id, status='completed')
+            db.add(session)
+            sessions.append(session)
+        await db.commit()
+    return [(s.session_id, s.player1_id, s.player2_id, rng.choice([s.player1_id, s.player2_id, None]))
+            for s in sessions]
+
+
+async def per_game(session_factory, results):
+    async with session_factory() as db:
+        for session_id, player1_id, player2_id, winner_id in results:
+            player1_stats = await db.get(models.GameStat, player1_id)
+            player2_stats = await db.get(models.GameStat, player2_id)
+            if winner_id:
+                winner_stats = player1_stats if winner_id == player1_id else player2_stats
+                loser_stats = player2_stats if winner_id == player1_id else player1_stats
+                winner_stats.wins += 1
+                loser_stats.losses += 1
+            else:
+                player1_stats.draws += 1
+                player2_stats.draws += 1
+            await db.commit()
+
+
+async def write_behind(session_factory, results, max_pending):
+    aggregator = StatsAggregator(session_factory, max_pending=max_pending)
+    for result in results:
+        aggregator.add(*result)
+        if len(aggregator.pending) >= max_pending:
+            await aggregator.flush()
+    await aggregator.flush()
+
+
+async def main():
+    games = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    url = sys.argv[2] if len(sys.argv) > 2 else f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/bench_stats.db"
+    print(f"{games:,} games on {url}")
+
+    for label, run in [
+        ("per-game read-modify-write", per_game),
+        ("write-behind, flush every 100", lambda factory, results: write_behind(factory, results, 100)),
+        ("write-behind, flush every 1000", lambda factory, results: write_behind(factory, results, 1000)),
+    ]:
+        engine, session_factory = await setup(url)
+        results = await create_sessions(session_factory, games)
+        started = time.perf_counter()
+        await run(session_factory, results)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<34} {games / elapsed:>12,.0f} games/s")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""Per-pair GameManager.determine_winner versus vectorized tournament resolution.
+
+    python bench/bench_tournament.py [pairings] [players]
+
+Defaults to 1,000,000 random pairings between 10,000 players.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tournament  # noqa: E402
+from game import MOVES, GameManager  # noqa: E402
+from stats import result_deltas  # noqa: E402
+
+
+def per_pair(player1_ids, player2_ids, moves1, moves2):
+    determine_winner = GameManager.determine_winner
+    totals = {}
+    for player1_id, player2_id, move1, move2 in zip(player1_ids, player2_ids, moves1, moves2):
+        result = determine_winner(player1_id, move1, player2_id, move2)
+        tournament.merge(totals, result_deltas(player1_id, player2_id, result['winner']))
+    return totals
+
+
+def vectorized(player1_ids, player2_ids, codes1, codes2):
+    return tournament.tally(player1_ids, player2_ids, tournament.resolve(codes1, codes2))
+
+
+def main():
+    pairings = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    rng = random.Random(42)
+    player1_ids = [rng.randrange(players) for _ in range(pairings)]
+    player2_ids = [(player1_id + rng.randrange(1, players)) % players for player1_id in player1_ids]
+    moves1 = [rng.choice(MOVES) for _ in range(pairings)]
+    moves2 = [rng.choice(MOVES) for _ in range(pairings)]
+
+    started = time.perf_counter()
+    expected = per_pair(player1_ids, player2_ids, moves1, moves2)
+    per_pair_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    codes1, codes2 = tournament.encode_moves(moves1), tournament.encode_moves(moves2)
+    encode_seconds = time.perf_counter() - started
+    if tournament.np is not None:
+        player1_ids = tournament.np.asarray(player1_ids)
+        player2_ids = tournament.np.asarray(player2_ids)
+    started = time.perf_counter()
+    totals = vectorized(player1_ids, player2_ids, codes1, codes2)
+    vectorized_seconds = time.perf_counter() - started
+    assert totals == expected
+
+    backend = "numpy" if tournament.np is not None else "python"
+    print(f"{pairings} pairings, {players} players")
+    print(f"determine_winner per pair:  {per_pair_seconds:8.3f}s")
+    print(f"encode moves:               {encode_seconds:8.3f}s")
+    print(f"resolve + tally ({backend}): {vectorized_seconds:8.3f}s  "
+          f"({per_pair_seconds / vectorized_seconds:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
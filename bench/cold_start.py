@@ -0,0 +1,80 @@
+"""Cold-start time of a server process, up to the first accepted WebSocket.
+
+    python bench/cold_start.py [--players 100000] [--runs 3] [--url DATABASE_URL]
+
+Seeds a temporary SQLite file (or --url) with `players` users and stats, then starts uvicorn `runs` times and
+reports, from process start, when /healthz first answers, when /readyz reports ready and when a player's
+/ws/{user_id} is first accepted (its session message received). The warm-up in between is the pool prewarm,
+the leaderboard load and the cache preload; the old entrypoint slept 30 s on top of the database wait.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import websockets  # noqa: E402
+
+from load_game import ROOT, free_port, get_status, seed  # noqa: E402
+
+INTERVAL = 0.01
+
+
+async def first_accepted_websocket(port, user_id):
+    while True:
+        try:
+            async with websockets.connect(f"ws://127.0.0.1:{port}/ws/{user_id}") as websocket:
+                assert json.loads(await websocket.recv())["action"] == "session"
+                return
+        except (OSError, websockets.InvalidHandshake):
+            await asyncio.sleep(INTERVAL)
+
+
+async def wait_for(port, path, status=200):
+    while await get_status(port, path) != status:
+        await asyncio.sleep(INTERVAL)
+
+
+async def cold_start(url, timeout):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=url, LOG_LEVEL="WARNING", EVENT_LOG_DIR=tempfile.mkdtemp())
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        timings = {}
+        for name, waiting in (("healthz", wait_for(port, "/healthz")), ("readyz", wait_for(port, "/readyz")),
+                              ("websocket", first_accepted_websocket(port, 1))):
+            await asyncio.wait_for(waiting, timeout)
+            timings[name] = time.perf_counter() - started
+        return timings
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--url")
+    parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+    url = args.url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/cold_start.db"
+    seed(url, args.players)
+    runs = [asyncio.run(cold_start(url, args.timeout)) for _ in range(args.runs)]
+    for name in ("healthz", "readyz", "websocket"):
+        print(f"{name:<10} median {statistics.median(run[name] for run in runs) * 1000:>8.0f} ms"
+              f"   max {max(run[name] for run in runs) * 1000:>8.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""Load generator that plays full games through /ws/{user_id} against a real server process.
+
+    python bench/load_game.py [--players 2000] [--url DATABASE_URL] [--timeout 300] [--save] [--compare]
+
+Starts uvicorn in a subprocess against a temporary SQLite file (or --url), seeds the players and pairs them with
+start_game, then has every pair run make_move, play_again, make_move and exit_game concurrently. Reports matches
+per second, p50/p99 move-to-result latency (from the deciding move being sent to its result arriving) and server
+memory per connection. SQLite only allows one writer, so against it the server gets a single pooled connection.
+--save writes the numbers to bench/baselines/load_game.json; --compare prints the change against it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import websockets  # noqa: E402
+from sqlalchemy import create_engine, insert  # noqa: E402
+from sqlalchemy.engine import make_url  # noqa: E402
+
+import models  # noqa: E402
+
+SYNC_DRIVERS = {"sqlite+aiosqlite": "sqlite", "mysql+aiomysql": "mysql+pymysql"}
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "load_game.json")
+MOVES = {"rock": "scissors", "paper": "rock", "scissors": "paper"}
+
+
+def seed(url, players):
+    engine = create_engine(make_url(url).set(drivername=SYNC_DRIVERS[make_url(url).drivername]))
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User.__table__), [
+            {"user_id": user_id, "nickname": f"player{user_id}", "password": "password"}
+            for user_id in range(1, players + 1)
+        ])
+        conn.execute(insert(models.GameStat.__table__), [
+            {"user_id": user_id, "wins": 0, "losses": 0, "draws": 0} for user_id in range(1, players + 1)
+        ])
+    engine.dispose()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_kib(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+async def get_status(port, path):
+    """The HTTP status of GET `path`, or None while nothing is listening."""
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    except OSError:
+        return None
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode())
+    status_line = await reader.readline()
+    writer.close()
+    return int(status_line.split()[1]) if status_line else None
+
+
+async def wait_for_server(port, timeout=30, path="/readyz", interval=0.1):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await get_status(port, path) == 200:
+            return
+        await asyncio.sleep(interval)
+    raise RuntimeError("server did not become ready")
+
+
+async def expect(websocket, predicate):
+    while True:
+        message = await websocket.recv()
+        try:
+            message = json.loads(message)
+        except ValueError:
+            pass
+        if predicate(message):
+            return message
+
+
+def is_result(message):
+    return isinstance(message, dict) and message.get("action") == "game_result"
+
+
+async def play_round(first, second, latencies):
+    await first.send(json.dumps({"action": "make_move", "move": "rock"}))
+    sent = time.perf_counter()
+    await second.send(json.dumps({"action": "make_move", "move": MOVES["rock"]}))
+    await asyncio.gather(expect(first, is_result), expect(second, is_result))
+    latencies.append(time.perf_counter() - sent)
+
+
+async def run(args):
+    url = args.url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/load.db"
+    seed(url, args.players)
+    port = free_port()
+    # Every player connects from 127.0.0.1 at once, so the per-IP limit is off and everyone may queue for admission.
+    env = dict(os.environ, DATABASE_URL=url, LOG_LEVEL="WARNING", EVENT_LOG_DIR=tempfile.mkdtemp(),
+               IP_ACTION_RATE="0", MAX_QUEUED_ACTIONS=str(args.players * 2))
+    if url.startswith("sqlite"):
+        env.update(DB_POOL_SIZE="1", DB_MAX_OVERFLOW="0")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    try:
+        await wait_for_server(port)
+        return await asyncio.wait_for(drive(port, server.pid, args.players), timeout=args.timeout)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def drive(port, pid, players):
+    rss_before = rss_kib(pid)
+    sockets = {}
+    for start in range(1, players + 1, 500):
+        user_ids = range(start, min(start + 500, players + 1))
+        connected = await asyncio.gather(
+            *(websockets.connect(f"ws://127.0.0.1:{port}/ws/{user_id}", max_queue=None) for user_id in user_ids)
+        )
+        sockets.update(zip(user_ids, connected))
+    await asyncio.sleep(0.5)
+    memory_per_connection = (rss_kib(pid) - rss_before) * 1024 / players
+
+    # Pairs join the queue one at a time, so the server always matches 1 with 2, 3 with 4 and so on.
+    has_session = lambda message: isinstance(message, dict) and "session_id" in message  # noqa: E731
+    for user_id in range(1, players, 2):
+        await sockets[user_id].send(json.dumps({"action": "start_game"}))
+        await sockets[user_id + 1].send(json.dumps({"action": "start_game"}))
+        started = await asyncio.gather(expect(sockets[user_id], has_session),
+                                       expect(sockets[user_id + 1], has_session))
+        assert started[0]["session_id"] == started[1]["session_id"], started
+
+    latencies = []
+    started = time.perf_counter()
+    await asyncio.gather(*(flow(sockets[user_id], sockets[user_id + 1], latencies)
+                           for user_id in range(1, players, 2)))
+    elapsed = time.perf_counter() - started
+
+    await asyncio.gather(*(websocket.close() for websocket in sockets.values()))
+    latencies.sort()
+    return {
+        "players": players,
+        "matches": len(latencies),
+        "seconds": round(elapsed, 3),
+        "matches_per_second": round(len(latencies) / elapsed, 1),
+        "p50_move_to_result_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_move_to_result_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "memory_per_connection_bytes": round(memory_per_connection),
+    }
+
+
+async def flow(first, second, latencies):
+    await play_round(first, second, latencies)
+
+    await first.send(json.dumps({"action": "play_again"}))
+    await expect(second, lambda message: isinstance(message, dict) and message.get("action") == "play_again_request")
+    await second.send(json.dumps({"action": "accepted_play_again"}))
+    await expect(first, lambda message: isinstance(message, dict) and message.get("action") == "play_again_accepted")
+    await play_round(first, second, latencies)
+
+    await first.send(json.dumps({"action": "exit_game"}))
+    await expect(second, lambda message: isinstance(message, dict) and message.get("action") == "game_over")
+
+
+def compare(results):
+    with open(BASELINE) as baseline_file:
+        baseline = json.load(baseline_file)
+    for key, value in results.items():
+        if key in baseline and isinstance(value, (int, float)) and baseline[key]:
+            change = (value - baseline[key]) / baseline[key] * 100
+            print(f"{key:<30}{baseline[key]:>14}{value:>14}{change:>+10.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=2000)
+    parser.add_argument("--url", help="async database URL; defaults to a temporary SQLite file")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds before the run is abandoned")
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare the results with the saved baseline")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results)
+    if args.save:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+            baseline_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Thousands of idle WebSocket players served by a small connection pool.
+
+    python bench/load_idle_sockets.py [sockets] [active_pairs] [pool_size]
+
+Starts the app with uvicorn against a temporary SQLite file with DB_POOL_SIZE=pool_size and no overflow, opens
+`sockets` idle connections (5,000 by default), then has `active_pairs` pairs of them (100 by default) search and
+play a game at the same time. Prints the pool gauges; max_in_use never exceeds the pool size. Needs an open file
+limit of at least twice the number of sockets.
+"""
+import asyncio
+import json
+import os
+import resource
+import socket
+import sys
+import tempfile
+import time
+
+SOCKETS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+ACTIVE_PAIRS = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+POOL_SIZE = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/load.db"
+os.environ["DB_POOL_SIZE"] = str(POOL_SIZE)
+os.environ["DB_MAX_OVERFLOW"] = "0"
+os.environ["EVENT_LOG_DIR"] = tempfile.mkdtemp()
+os.environ["IP_ACTION_RATE"] = "0"
+os.environ["SCHEMA_CHECK"] = "create"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+import websockets  # noqa: E402
+
+import database  # noqa: E402
+from main import app, readiness  # noqa: E402
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def open_sockets(url, user_ids, batch_size=500):
+    sockets = []
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        connected = await asyncio.gather(
+            *(websockets.connect(f"{url}/ws/{user_id}", max_queue=None) for user_id in batch)
+        )
+        # Every socket opens with its session message.
+        await asyncio.gather(*(websocket.recv() for websocket in connected))
+        sockets.extend(connected)
+    return sockets
+
+
+async def play(websocket, move):
+    await websocket.send(json.dumps({"action": "start_game"}))
+    started = json.loads(await websocket.recv())
+    assert started["message"].startswith("Game started"), started
+    await websocket.send(json.dumps({"action": "make_move", "move": move}))
+    return json.loads(await websocket.recv())
+
+
+async def main():
+    _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, port=port, log_level="warning", ws_max_queue=32))
+    serving = asyncio.create_task(server.serve())
+    while not (server.started and readiness.ready):
+        await asyncio.sleep(0.05)
+    url = f"ws://127.0.0.1:{port}"
+
+    started = time.perf_counter()
+    sockets = await open_sockets(url, list(range(1, SOCKETS + 1)))
+    print(f"{len(sockets)} sockets open in {time.perf_counter() - started:.1f}s, "
+          f"pool in use: {database.pool_status()['in_use']}")
+
+    started = time.perf_counter()
+    players = sockets[:ACTIVE_PAIRS * 2]
+    games = [play(websocket, "rock" if index % 2 else "scissors") for index, websocket in enumerate(players)]
+    results = await asyncio.gather(*games)
+    print(f"{len(results) // 2} games played in {time.perf_counter() - started:.2f}s "
+          f"while {SOCKETS - len(players)} sockets stayed idle")
+
+    print(json.dumps(database.pool_status(), indent=2))
+    assert database.pool_status()["max_in_use"] <= POOL_SIZE
+
+    await asyncio.gather(*(websocket.close() for websocket in sockets))
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
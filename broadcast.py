@@ -0,0 +1,89 @@
+import asyncio
+
+import protocol
+
+
+class Channel:
+    __slots__ = ('name', 'subscribers', 'state', 'version', 'pending', 'snapshot')
+
+    def __init__(self, name: str, state: dict):
+        self.name = name
+        self.subscribers = set()
+        self.state = state
+        self.version = 0
+        self.pending = []
+        self.snapshot = None
+
+
+class BroadcastHub:
+    """Spectator channels: a snapshot for each new subscriber, then batches of deltas shared by everyone.
+
+    Deltas published during one event-loop tick are sent as a single update on the next one, and every
+    snapshot and update is a protocol.Constant, so it is serialized once per codec however many sockets
+    receive it. A channel's state is a flat dict that each delta updates; it only exists while someone is
+    subscribed and is rebuilt with `snapshot(name)` for the next subscriber. `snapshot` returns None for a
+    channel that cannot be watched.
+    """
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.channels = {}
+        self.updates = 0
+        self._dirty = []
+        self._scheduled = False
+
+    def subscribers(self):
+        return sum(len(channel.subscribers) for channel in self.channels.values())
+
+    def subscribe(self, name: str, connection):
+        """Sends the channel's snapshot to `connection` and adds it to the channel. Returns False if the
+        channel cannot be watched."""
+        channel = self.channels.get(name)
+        if channel is None:
+            state = self.snapshot(name) if self.snapshot is not None else {}
+            if state is None:
+                return False
+            channel = self.channels[name] = Channel(name, state)
+        if channel.snapshot is None:
+            # Shared by everyone who joins before the next update.
+            channel.snapshot = protocol.Constant({"action": "spectate_snapshot", "channel": name,
+                                                  "version": channel.version, "state": dict(channel.state)})
+        connection.send(channel.snapshot)
+        channel.subscribers.add(connection)
+        return True
+
+    def unsubscribe(self, name: str, connection):
+        channel = self.channels.get(name)
+        if channel is None:
+            return
+        channel.subscribers.discard(connection)
+        if not channel.subscribers:
+            del self.channels[name]
+
+    def publish(self, name: str, delta: dict):
+        channel = self.channels.get(name)
+        if channel is None:
+            return
+        if not channel.pending:
+            self._dirty.append(channel)
+        channel.pending.append(delta)
+        if not self._scheduled:
+            self._scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self._scheduled = False
+        dirty, self._dirty = self._dirty, []
+        for channel in dirty:
+            deltas, channel.pending = channel.pending, []
+            for delta in deltas:
+                channel.state.update(delta)
+            channel.version += 1
+            channel.snapshot = None
+            if self.channels.get(channel.name) is not channel:
+                continue
+            update = protocol.Constant({"action": "spectate_update", "channel": channel.name,
+                                        "version": channel.version, "deltas": deltas})
+            self.updates += 1
+            for connection in channel.subscribers:
+                connection.send(update)
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+
+import config
+from bus import SharedState, create_matchmaking_queue
+from logs import queue_logging
+
+logger = logging.getLogger(__name__)
+
+
+class Broker:
+    """Message broker and shared state for UnixSocketBus. Runs as a single asyncio process, so every
+    operation on the shared state is atomic."""
+
+    def __init__(self):
+        self.state = SharedState(create_matchmaking_queue())
+        self.workers = {}
+
+    def forward(self, worker_id: str, message: dict):
+        writer = self.workers.get(worker_id)
+        if writer is not None:
+            writer.write(json.dumps(message).encode('utf-8') + b"\n")
+
+    def handle(self, worker_id: str, op: str, message: dict):
+        state = self.state
+        if op == "register":
+            state.register(message["user_id"], worker_id)
+        elif op == "unregister":
+            state.unregister(message["user_id"], worker_id)
+        elif op == "deliver":
+            target = state.players.get(message["user_id"])
+            if target is not None:
+                self.forward(target, {"type": "deliver", "user_id": message["user_id"], "message": message["message"]})
+        elif op == "send":
+            self.forward(message["worker_id"], message["message"])
+        elif op == "broadcast":
+            for other_id in list(self.workers):
+                if other_id != worker_id:
+                    self.forward(other_id, message["message"])
+        elif op == "match":
+            return state.matchmaking.match(message["user_id"], message.get("win_rate"), message.get("rtt_ms"),
+                                           message.get("best_of", 1))
+        elif op == "cancel_search":
+            return state.matchmaking.cancel(message["user_id"])
+        elif op == "pair_waiting":
+            return state.pair_waiting(message["user_ids"])
+        elif op == "set_match_worker":
+            state.set_match_worker(message["user_ids"], worker_id)
+        elif op == "clear_match_worker":
+            state.clear_match_worker(message["user_ids"], worker_id)
+        elif op == "get_match_worker":
+            return state.match_workers.get(message["user_id"])
+        elif op == "put":
+            state.values[message["key"]] = message["value"]
+        elif op == "pop":
+            return state.values.pop(message["key"], None)
+        return None
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        worker_id = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                op = message.pop("op")
+                request_id = message.pop("id", None)
+                if op == "hello":
+                    worker_id = message["worker_id"]
+                    self.workers[worker_id] = writer
+                    result = None
+                else:
+                    result = self.handle(worker_id, op, message)
+                if request_id is not None:
+                    writer.write(json.dumps({"id": request_id, "result": result}).encode('utf-8') + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            if worker_id is not None and self.workers.get(worker_id) is writer:
+                del self.workers[worker_id]
+                self.state.drop_worker(worker_id)
+            writer.close()
+
+
+async def serve(path: str):
+    if os.path.exists(path):
+        os.unlink(path)
+    broker = Broker()
+    return await asyncio.start_unix_server(broker.handle_connection, path)
+
+
+async def main(path: str):
+    queue_logging.start()
+    server = await serve(path)
+    logger.info("Message bus broker listening", extra={"path": path})
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else config.BUS_SOCKET_PATH))
@@ -0,0 +1,231 @@
+import asyncio
+import itertools
+import json
+import os
+import socket
+
+import config
+from matchmaking import MatchmakingQueue
+
+
+def create_matchmaking_queue():
+    return MatchmakingQueue(
+        skill_buckets=config.MATCHMAKING_SKILL_BUCKETS,
+        rtt_bucket_ms=config.MATCHMAKING_RTT_BUCKET_MS,
+        widen_after=config.MATCHMAKING_WIDEN_AFTER,
+    )
+
+
+class SharedState:
+    """State every worker must agree on: where each player's socket lives, which worker owns each live
+    match, the matchmaking queue and small shared values such as pending play-again offers."""
+
+    def __init__(self, matchmaking: MatchmakingQueue):
+        self.matchmaking = matchmaking
+        self.players = {}
+        self.match_workers = {}
+        self.values = {}
+
+    def register(self, user_id: int, worker_id: str):
+        self.players[user_id] = worker_id
+
+    def unregister(self, user_id: int, worker_id: str):
+        if self.players.get(user_id) == worker_id:
+            del self.players[user_id]
+            self.matchmaking.cancel(user_id)
+
+    def set_match_worker(self, user_ids, worker_id: str):
+        for user_id in user_ids:
+            self.match_workers[user_id] = worker_id
+
+    def clear_match_worker(self, user_ids, worker_id: str):
+        for user_id in user_ids:
+            if self.match_workers.get(user_id) == worker_id:
+                del self.match_workers[user_id]
+
+    def pair_waiting(self, user_ids):
+        """Pairs waiting players whose widened buckets now overlap. Returns the pairs and which of `user_ids`
+        are still waiting."""
+        pairs = self.matchmaking.pair_waiting()
+        return pairs, [user_id for user_id in user_ids if user_id in self.matchmaking]
+
+    def drop_worker(self, worker_id: str):
+        for user_id in [user_id for user_id, owner in self.players.items() if owner == worker_id]:
+            self.unregister(user_id, worker_id)
+        for user_id in [user_id for user_id, owner in self.match_workers.items() if owner == worker_id]:
+            del self.match_workers[user_id]
+
+
+class InProcessBus:
+    def __init__(self, matchmaking: MatchmakingQueue = None, worker_id: str = "local"):
+        self.worker_id = worker_id
+        self.state = SharedState(create_matchmaking_queue() if matchmaking is None else matchmaking)
+        self.handler = None
+
+    async def start(self, handler):
+        self.handler = handler
+
+    async def stop(self):
+        self.handler = None
+
+    def queue_length(self):
+        return len(self.state.matchmaking)
+
+    async def register(self, user_id: int):
+        self.state.register(user_id, self.worker_id)
+
+    async def unregister(self, user_id: int):
+        self.state.unregister(user_id, self.worker_id)
+
+    async def deliver(self, user_id: int, message):
+        # Every socket lives in this process, so a player missing locally is not connected anywhere.
+        pass
+
+    async def send(self, worker_id: str, message: dict):
+        if self.handler is not None:
+            await self.handler(message)
+
+    async def broadcast(self, message: dict):
+        # There are no other workers to tell.
+        pass
+
+    async def match(self, user_id: int, win_rate=None, rtt_ms=None, best_of: int = 1):
+        return self.state.matchmaking.match(user_id, win_rate, rtt_ms, best_of)
+
+    async def cancel_search(self, user_id: int):
+        return self.state.matchmaking.cancel(user_id)
+
+    async def pair_waiting(self, user_ids):
+        return self.state.pair_waiting(user_ids)
+
+    async def set_match_worker(self, user_ids):
+        self.state.set_match_worker(user_ids, self.worker_id)
+
+    async def clear_match_worker(self, user_ids):
+        self.state.clear_match_worker(user_ids, self.worker_id)
+
+    async def get_match_worker(self, user_id: int):
+        return self.state.match_workers.get(user_id)
+
+    async def put(self, key: str, value):
+        self.state.values[key] = value
+
+    async def pop(self, key: str):
+        return self.state.values.pop(key, None)
+
+
+class UnixSocketBus:
+    """Client for broker.py. Requests are newline-delimited JSON; those carrying an "id" get a reply, and
+    frames without one are messages addressed to this worker."""
+
+    def __init__(self, path: str, worker_id: str = None):
+        self.path = path
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.handler = None
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.ids = itertools.count()
+        self._read_task = None
+        self._tasks = set()
+
+    def queue_length(self):
+        # The matchmaking queue lives in the broker.
+        return None
+
+    async def start(self, handler):
+        self.handler = handler
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+        self._read_task = asyncio.create_task(self._read())
+        await self._request("hello", worker_id=self.worker_id)
+
+    async def stop(self):
+        if self._read_task is not None:
+            self._read_task.cancel()
+            self._read_task = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def _write(self, message: dict):
+        self.writer.write(json.dumps(message).encode('utf-8') + b"\n")
+
+    async def _request(self, op: str, **params):
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self._write({"op": op, "id": request_id, **params})
+        try:
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _notify(self, op: str, **params):
+        self._write({"op": op, **params})
+        await self.writer.drain()
+
+    async def _read(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if "id" in message:
+                future = self.pending.get(message["id"])
+                if future is not None and not future.done():
+                    future.set_result(message.get("result"))
+            elif self.handler is not None:
+                # Handlers may issue their own requests, so they must not block this reader.
+                task = asyncio.create_task(self.handler(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Message bus connection lost"))
+
+    async def register(self, user_id: int):
+        await self._request("register", user_id=user_id)
+
+    async def unregister(self, user_id: int):
+        await self._notify("unregister", user_id=user_id)
+
+    async def deliver(self, user_id: int, message):
+        await self._notify("deliver", user_id=user_id, message=message)
+
+    async def send(self, worker_id: str, message: dict):
+        await self._notify("send", worker_id=worker_id, message=message)
+
+    async def broadcast(self, message: dict):
+        """Sends `message` to every other worker."""
+        await self._notify("broadcast", message=message)
+
+    async def match(self, user_id: int, win_rate=None, rtt_ms=None, best_of: int = 1):
+        return await self._request("match", user_id=user_id, win_rate=win_rate, rtt_ms=rtt_ms, best_of=best_of)
+
+    async def cancel_search(self, user_id: int):
+        return await self._request("cancel_search", user_id=user_id)
+
+    async def pair_waiting(self, user_ids):
+        pairs, waiting = await self._request("pair_waiting", user_ids=list(user_ids))
+        return [tuple(pair) for pair in pairs], waiting
+
+    async def set_match_worker(self, user_ids):
+        await self._request("set_match_worker", user_ids=list(user_ids))
+
+    async def clear_match_worker(self, user_ids):
+        await self._notify("clear_match_worker", user_ids=list(user_ids))
+
+    async def get_match_worker(self, user_id: int):
+        return await self._request("get_match_worker", user_id=user_id)
+
+    async def put(self, key: str, value):
+        await self._request("put", key=key, value=value)
+
+    async def pop(self, key: str):
+        return await self._request("pop", key=key)
+
+
+def create_bus():
+    if config.BUS_BACKEND == "unix":
+        return UnixSocketBus(config.BUS_SOCKET_PATH)
+    return InProcessBus()
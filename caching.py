@@ -0,0 +1,150 @@
+import json
+import time
+from collections import OrderedDict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+import crud
+import models
+
+
+class InProcessBackend:
+    def __init__(self, max_size: int, clock=time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.entries = OrderedDict()
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= self.clock():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value, ttl: float):
+        self.entries[key] = (self.clock() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.entries.pop(key, None)
+
+
+class RedisBackend:
+    """Stores entries in Redis as JSON. Eviction is left to the server's maxmemory-policy (allkeys-lru)."""
+
+    def __init__(self, client, prefix: str = "rps:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def get(self, key: str):
+        value = await self.client.get(self.prefix + key)
+        return None if value is None else json.loads(value)
+
+    async def set(self, key: str, value, ttl: float):
+        await self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(ttl)))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self.client.delete(*(self.prefix + key for key in keys))
+
+
+class Cache:
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, key: str, loader):
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = await loader()
+        if value is not None:
+            await self.backend.set(key, value, self.ttl)
+        return value
+
+    async def put(self, key: str, value):
+        await self.backend.set(key, value, self.ttl)
+
+    async def invalidate(self, *keys: str):
+        await self.backend.delete(*keys)
+
+    def metrics(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def create_backend():
+    if config.CACHE_BACKEND == "redis":
+        import redis.asyncio
+        return RedisBackend(redis.asyncio.from_url(config.REDIS_URL))
+    return InProcessBackend(config.CACHE_MAX_SIZE)
+
+
+cache = Cache(create_backend(), ttl=config.CACHE_TTL)
+
+
+def user_to_dict(user: models.User):
+    # The password hash stays out of the cache, which may be a shared Redis; login reads it from the database.
+    if user is None:
+        return None
+    return {"user_id": user.user_id, "nickname": user.nickname}
+
+
+def stats_to_dict(stats: models.GameStat):
+    if stats is None:
+        return None
+    return {"user_id": stats.user_id, "wins": stats.wins, "losses": stats.losses, "draws": stats.draws}
+
+
+async def get_user(db: AsyncSession, user_id: int):
+    data = await cache.get_or_load(f"user:{user_id}", lambda: _load(crud.get_user(db, user_id), user_to_dict))
+    return models.User(**data) if data else None
+
+
+async def get_user_by_nickname(db: AsyncSession, nickname: str):
+    data = await cache.get_or_load(
+        f"nickname:{nickname}", lambda: _load(crud.get_user_by_nickname(db, nickname), user_to_dict)
+    )
+    return models.User(**data) if data else None
+
+
+async def get_user_stats(db: AsyncSession, user_id: int):
+    data = await cache.get_or_load(f"stats:{user_id}", lambda: _load(crud.get_user_stats(db, user_id), stats_to_dict))
+    return models.GameStat(**data) if data else None
+
+
+async def _load(query, to_dict):
+    return to_dict(await query)
+
+
+async def preload(db: AsyncSession, entries):
+    """Caches the stats in leaderboard `entries` and their players' users, read in one query, so the most active
+    players' first lookups after a restart are hits. Returns the number of players cached."""
+    for entry in entries:
+        stats = {key: entry[key] for key in ("user_id", "wins", "losses", "draws")}
+        await cache.put(f"stats:{entry['user_id']}", stats)
+    users = await crud.get_users(db, [entry['user_id'] for entry in entries]) if entries else []
+    for user in users:
+        data = user_to_dict(user)
+        await cache.put(f"user:{user.user_id}", data)
+        await cache.put(f"nickname:{user.nickname}", data)
+    return len(entries)
+
+
+async def invalidate_user(user_id: int, nickname: str):
+    await cache.invalidate(f"user:{user_id}", f"nickname:{nickname}", f"stats:{user_id}")
+
+
+async def invalidate_stats(user_ids):
+    await cache.invalidate(*(f"stats:{user_id}" for user_id in user_ids))
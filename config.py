@@ -0,0 +1,127 @@
+import os
+
+# mysql+aiomysql://... in docker-compose, sqlite+aiosqlite:///./rps.db for local runs and tests
+DATABASE_URL = os.getenv("DATABASE_URL", "mysql+aiomysql://root:password@db/rock_paper_scissors")
+
+# Logs are written as JSON lines from a background thread.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+# /debug/profiler/start and /debug/profiler/stop are only served when PROFILER_ENABLED is set.
+# PROFILER_INTERVAL is the sampling interval in seconds.
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", "0.005"))
+
+# Connection pool. Sessions are opened per request and per WebSocket action, so the pool only needs to cover
+# concurrent queries, not connected players. DB_POOL_RECYCLE is in seconds; -1 never recycles.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Startup. The server retries the database for up to DB_CONNECT_TIMEOUT seconds, opens DB_POOL_PREWARM pooled
+# connections, loads the leaderboard and caches the users and stats of the CACHE_PRELOAD top-ranked players, and
+# only then reports ready on /readyz. SCHEMA_CHECK is "off", "verify" (refuse to start if a table or column is
+# missing) or "create" (create missing tables first, for local SQLite runs and tests).
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "60"))
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", str(DB_POOL_SIZE)))
+CACHE_PRELOAD = int(os.getenv("CACHE_PRELOAD", "1000"))
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "off")
+
+# Password hashing pool. HASH_POOL_KIND is "thread" or "process"; requests beyond
+# HASH_POOL_WORKERS + HASH_POOL_QUEUE_SIZE are rejected with 503 and Retry-After.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_POOL_KIND = os.getenv("HASH_POOL_KIND", "thread")
+HASH_POOL_WORKERS = int(os.getenv("HASH_POOL_WORKERS", str(os.cpu_count() or 2)))
+HASH_POOL_QUEUE_SIZE = int(os.getenv("HASH_POOL_QUEUE_SIZE", "64"))
+HASH_RETRY_AFTER = int(os.getenv("HASH_RETRY_AFTER", "1"))
+
+# Matchmaking buckets. 0 disables bucketing by win rate / RTT; bucket constraints widen by one
+# bucket for every MATCHMAKING_WIDEN_AFTER seconds a player has been waiting.
+MATCHMAKING_SKILL_BUCKETS = int(os.getenv("MATCHMAKING_SKILL_BUCKETS", "0"))
+MATCHMAKING_RTT_BUCKET_MS = int(os.getenv("MATCHMAKING_RTT_BUCKET_MS", "0"))
+MATCHMAKING_WIDEN_AFTER = float(os.getenv("MATCHMAKING_WIDEN_AFTER", "5"))
+
+# Write-behind GameStat updates: buffered deltas are flushed every STATS_FLUSH_INTERVAL seconds
+# or as soon as STATS_FLUSH_MAX_PENDING finished games are buffered.
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "1"))
+STATS_FLUSH_MAX_PENDING = int(os.getenv("STATS_FLUSH_MAX_PENDING", "500"))
+
+# Read-through cache for users and stats. CACHE_BACKEND is "memory" or "redis" (needs the redis package).
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "60"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Cross-worker message bus. "local" keeps everything in this process; "unix" connects to the broker
+# started with `python broker.py`, so players on different uvicorn workers can be matched.
+BUS_BACKEND = os.getenv("BUS_BACKEND", "local")
+BUS_SOCKET_PATH = os.getenv("BUS_SOCKET_PATH", "/tmp/rps-bus.sock")
+
+# Server-side deadlines in seconds (0 disables): both moves of a match, time spent in the
+# matchmaking queue and how long a play-again offer stays open.
+MOVE_TIMEOUT = float(os.getenv("MOVE_TIMEOUT", "30"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "120"))
+PLAY_AGAIN_TIMEOUT = float(os.getenv("PLAY_AGAIN_TIMEOUT", "30"))
+
+# Longest best-of-N series a player may ask for in start_game (N must be odd).
+MAX_SERIES_LENGTH = int(os.getenv("MAX_SERIES_LENGTH", "9"))
+
+# Outbound frames are queued per connection. Once SEND_QUEUE_SIZE frames are pending the
+# SLOW_CONSUMER_POLICY applies: "drop" new frames, "coalesce" them with a pending frame of the
+# same action, or "disconnect" the client.
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "64"))
+SLOW_CONSUMER_POLICY = os.getenv("SLOW_CONSUMER_POLICY", "disconnect")
+
+# Spectators on /ws/spectate/{channel} are disconnected once SPECTATOR_QUEUE_SIZE updates are pending.
+# POST /channels/{channel}/feature/{session_id} is only served when CHANNEL_ADMIN_ENABLED is set.
+SPECTATOR_QUEUE_SIZE = int(os.getenv("SPECTATOR_QUEUE_SIZE", "256"))
+CHANNEL_ADMIN_ENABLED = os.getenv("CHANNEL_ADMIN_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Reconnect-and-resume. Every socket gets a resume token; a player who drops keeps their match for
+# RESUME_GRACE_PERIOD seconds (0 disables) and the last REPLAY_BUFFER_SIZE messages sent to them are
+# replayed when they reconnect with ?resume_token=. After the grace period their match times out.
+RESUME_GRACE_PERIOD = float(os.getenv("RESUME_GRACE_PERIOD", "30"))
+REPLAY_BUFFER_SIZE = int(os.getenv("REPLAY_BUFFER_SIZE", "32"))
+
+# Moves, exits and timeouts for a match run in order in its mailbox; the mailboxes are drained by
+# MATCH_ACTOR_SHARDS tasks per worker.
+MATCH_ACTOR_SHARDS = int(os.getenv("MATCH_ACTOR_SHARDS", "64"))
+
+# Token-bucket rate limits: WebSocket actions per connection (ACTION_RATE per second, bursts of
+# ACTION_BURST) and per client IP across all its sockets (IP_ACTION_RATE / IP_ACTION_BURST), and
+# /login/ and /users/ per client IP (AUTH_RATE / AUTH_BURST). A rate of 0 disables that limit.
+ACTION_RATE = float(os.getenv("ACTION_RATE", "10"))
+ACTION_BURST = float(os.getenv("ACTION_BURST", "20"))
+IP_ACTION_RATE = float(os.getenv("IP_ACTION_RATE", "200"))
+IP_ACTION_BURST = float(os.getenv("IP_ACTION_BURST", "400"))
+AUTH_RATE = float(os.getenv("AUTH_RATE", "1"))
+AUTH_BURST = float(os.getenv("AUTH_BURST", "5"))
+
+# Admission control: at most MAX_INFLIGHT_ACTIONS WebSocket actions that use the database run at once
+# (0 disables the cap) and MAX_QUEUED_ACTIONS more wait for a slot; anything beyond that is answered
+# with a busy error.
+MAX_INFLIGHT_ACTIONS = int(os.getenv("MAX_INFLIGHT_ACTIONS", "64"))
+MAX_QUEUED_ACTIONS = int(os.getenv("MAX_QUEUED_ACTIONS", "1024"))
+
+# Archiving: every ARCHIVE_INTERVAL seconds (0 disables) completed and timed-out sessions that
+# finished more than ARCHIVE_AFTER seconds ago are moved from game_sessions to gzipped JSON-lines
+# files in ARCHIVE_DIR, ARCHIVE_CHUNK_SIZE sessions per file and transaction.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "./archive")
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_AFTER = float(os.getenv("ARCHIVE_AFTER", "86400"))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "5000"))
+
+# The leaderboard is rebuilt from game_stats at startup LEADERBOARD_LOAD_CHUNK rows at a time.
+# LEADERBOARD_MAX_LIMIT caps the page size of /leaderboard.
+LEADERBOARD_LOAD_CHUNK = int(os.getenv("LEADERBOARD_LOAD_CHUNK", "1000"))
+LEADERBOARD_MAX_LIMIT = int(os.getenv("LEADERBOARD_MAX_LIMIT", "100"))
+
+# Append-only match event log. Each worker writes JSON-lines segments of up to EVENT_LOG_SEGMENT_BYTES
+# to its own shard under EVENT_LOG_DIR, in batches every EVENT_LOG_FLUSH_INTERVAL seconds (fsynced
+# unless EVENT_LOG_FSYNC is false), and snapshots its projection every EVENT_LOG_SNAPSHOT_EVERY events.
+EVENT_LOG_DIR = os.getenv("EVENT_LOG_DIR", "./events")
+EVENT_LOG_SEGMENT_BYTES = int(os.getenv("EVENT_LOG_SEGMENT_BYTES", str(64 << 20)))
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", "0.05"))
+EVENT_LOG_FSYNC = os.getenv("EVENT_LOG_FSYNC", "true").lower() in ("1", "true", "yes")
+EVENT_LOG_SNAPSHOT_EVERY = int(os.getenv("EVENT_LOG_SNAPSHOT_EVERY", "10000"))
@@ -0,0 +1,143 @@
+import asyncio
+import time
+from collections import deque
+
+import protocol
+
+SLOW_CONSUMER_POLICIES = ('drop', 'coalesce', 'disconnect')
+# What an idle connection holds instead of a queue; a deque is only allocated while frames are pending.
+IDLE = ()
+
+
+class Connection:
+    """A client socket with a bounded outbound queue drained by its own writer task.
+
+    `send` never waits for the network, so one slow client cannot delay messages to anybody else. A frame
+    leaves the queue only once it has been sent, so `undelivered` still returns it if the socket fails, and
+    messages sent after a failure are kept for `undelivered` too, until the player is parked.
+    The queue and the writer task exist only while there is something to send, so an idle connection is
+    a single small object.
+    """
+    __slots__ = ('websocket', 'codec', 'max_pending', 'policy', 'pending', 'closed', '_socket_closed', '_sending',
+                 '_writer', 'sent', 'dropped', 'coalesced', 'total_latency', 'max_latency')
+
+    def __init__(self, websocket, codec=protocol.JSON, max_pending: int = 64, policy: str = 'disconnect'):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.codec = codec
+        self.max_pending = max_pending
+        self.policy = policy
+        self.pending = IDLE
+        self.closed = False
+        self._socket_closed = False
+        self._sending = False
+        self._writer = None
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def send(self, message):
+        payload = protocol.raw(message)
+        key = payload.get('action') if isinstance(payload, dict) else None
+        if self.closed:
+            # Kept unsent for `undelivered`, so a resume still delivers it.
+            if self.pending is IDLE:
+                self.pending = deque()
+            if len(self.pending) >= self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append((key, message, None, None))
+            return False
+        frame = self.codec.encode(message)
+        # A frame being sent no longer counts against the limit.
+        if len(self.pending) - self._sending >= self.max_pending:
+            if self.policy == 'drop':
+                self.dropped += 1
+                return False
+            if self.policy == 'coalesce' and key is not None:
+                for index, (pending_key, _, _, enqueued_at) in enumerate(self.pending):
+                    # The head of the queue may be on the wire already.
+                    if pending_key == key and not (index == 0 and self._sending):
+                        self.pending[index] = (key, message, frame, enqueued_at)
+                        self.coalesced += 1
+                        return True
+            if self.policy == 'coalesce':
+                del self.pending[1 if self._sending else 0]
+                self.dropped += 1
+            else:
+                self.dropped += len(self.pending)
+                self.pending.clear()
+                self.closed = True
+                self._socket_closed = True
+                asyncio.create_task(self._close(code=1008))
+                return False
+        if self.pending is IDLE:
+            self.pending = deque()
+        self.pending.append((key, message, frame, time.perf_counter()))
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write())
+        return True
+
+    async def _write(self):
+        try:
+            while self.pending:
+                _, _, frame, enqueued_at = self.pending[0]
+                self._sending = True
+                try:
+                    await protocol.send_frame(self.websocket, self.codec, frame)
+                except Exception:
+                    self.closed = True
+                    return
+                finally:
+                    self._sending = False
+                self.pending.popleft()
+                latency = time.perf_counter() - enqueued_at
+                self.sent += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+            self.pending = IDLE
+        finally:
+            self._writer = None
+
+    def undelivered(self):
+        """Messages still queued, oldest first, e.g. to replay them when the client resumes."""
+        return [message for _, message, _, _ in self.pending]
+
+    async def drain(self):
+        while self._writer is not None:
+            await asyncio.wait((self._writer,))
+
+    async def close(self, code: int = 1000):
+        """Closes the socket once, also after a failed write already marked the connection closed."""
+        self.closed = True
+        if self._socket_closed:
+            return
+        self._socket_closed = True
+        await self._close(code)
+
+    async def _close(self, code: int):
+        writer = self._writer
+        if writer is not None:
+            writer.cancel()
+            try:
+                await writer
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.websocket.close(code=code)
+        except (RuntimeError, OSError):
+            # The socket is already gone, e.g. after a failed write.
+            pass
+
+    def metrics(self):
+        return {
+            "pending": len(self.pending),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "avg_send_latency_ms": self.total_latency / self.sent * 1000 if self.sent else 0.0,
+            "max_send_latency_ms": self.max_latency * 1000,
+        }
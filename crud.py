@@ -1,34 +1,81 @@
-import bcrypt
-from sqlalchemy.orm import Session
+from sqlalchemy import bindparam, func, select, union_all, update
+from sqlalchemy.ext.asyncio import AsyncSession
 import schemas
 import models
+from hashing import hasher
 
 
-def get_user_by_nickname(db: Session, nickname: str):
-    return db.query(models.User).filter(models.User.nickname == nickname).first()
+async def get_user_by_nickname(db: AsyncSession, nickname: str):
+    result = await db.execute(select(models.User).filter(models.User.nickname == nickname))
+    return result.scalars().first()
 
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())
-    db_user = models.User(nickname=user.nickname, password=hashed_password.decode('utf-8'))
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_password = await hasher.hash(user.password)
+    db_user = models.User(nickname=user.nickname, password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
     initial_stats = models.GameStat(user_id=db_user.user_id, wins=0, losses=0, draws=0)
     db.add(initial_stats)
-    db.commit()
+    await db.commit()
 
     return db_user
 
 
-def check_password(user_password, stored_password):
-    return bcrypt.checkpw(user_password.encode('utf-8'), stored_password.encode('utf-8'))
+async def check_password(user_password, stored_password):
+    return await hasher.verify(user_password, stored_password)
 
 
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.user_id == user_id).first()
+async def rehash_password_if_needed(db: AsyncSession, user: models.User, user_password: str):
+    if not hasher.needs_rehash(user.password):
+        return False
+    user.password = await hasher.hash(user_password)
+    await db.execute(update(models.User).where(models.User.user_id == user.user_id).values(password=user.password))
+    await db.commit()
+    return True
 
 
-def get_user_stats(db: Session, user_id: int):
-    return db.query(models.GameStat).filter(models.GameStat.user_id == user_id).first()
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).filter(models.User.user_id == user_id))
+    return result.scalars().first()
+
+
+async def get_users(db: AsyncSession, user_ids):
+    result = await db.execute(select(models.User).filter(models.User.user_id.in_(user_ids)))
+    return result.scalars().all()
+
+
+async def get_user_stats(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.GameStat).filter(models.GameStat.user_id == user_id))
+    return result.scalars().first()
+
+
+def _latest_game_session_statement(with_status: bool):
+    # One index range scan per player column instead of an OR filter that cannot use either index.
+    latest = []
+    for player_column in (models.GameSession.player1_id, models.GameSession.player2_id):
+        query = select(models.GameSession.session_id).where(player_column == bindparam('user_id'))
+        if with_status:
+            query = query.where(models.GameSession.status == bindparam('status'))
+        latest_for_column = query.order_by(models.GameSession.session_id.desc()).limit(1).subquery()
+        latest.append(select(latest_for_column.c.session_id))
+    candidates = union_all(*latest).subquery()
+    return select(models.GameSession).where(
+        models.GameSession.session_id == select(func.max(candidates.c.session_id)).scalar_subquery()
+    )
+
+
+latest_game_session_statements = {
+    False: _latest_game_session_statement(with_status=False),
+    True: _latest_game_session_statement(with_status=True),
+}
+
+
+async def get_latest_game_session(db: AsyncSession, user_id: int, status: str = None):
+    params = {'user_id': user_id}
+    if status is not None:
+        params['status'] = status
+    result = await db.execute(latest_game_session_statements[status is not None], params)
+    return result.scalars().first()
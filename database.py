@@ -1,14 +1,107 @@
-from sqlalchemy import create_engine
+import time
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import config
+import metrics
+
+SQLALCHEMY_DATABASE_URL = config.DATABASE_URL
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.in_use = 0
+        self.max_in_use = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def snapshot(self, pool):
+        return {
+            "size": pool.size() if hasattr(pool, "size") else 1,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else 0,
+            "in_use": self.in_use,
+            "max_in_use": self.max_in_use,
+            "waiting": self.waiting,
+            "checkouts": self.checkouts,
+            "avg_checkout_wait_ms": self.total_wait / self.checkouts * 1000 if self.checkouts else 0.0,
+            "max_checkout_wait_ms": self.max_wait * 1000,
+        }
 
-SQLALCHEMY_DATABASE_URL = "mysql+pymysql://root:password@db/rock_paper_scissors"
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    isolation_level="READ UNCOMMITTED",
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for a connection."""
+
+    def _do_get(self):
+        pool_metrics.waiting += 1
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            waited = time.perf_counter() - started
+            pool_metrics.waiting -= 1
+            pool_metrics.checkouts += 1
+            pool_metrics.total_wait += waited
+            pool_metrics.max_wait = max(pool_metrics.max_wait, waited)
+
+
+engine_options = {}
+# In-memory SQLite needs its single shared connection; every other database gets the sized, metered pool.
+in_memory_sqlite = SQLALCHEMY_DATABASE_URL.startswith("sqlite") and (
+    ":memory:" in SQLALCHEMY_DATABASE_URL or SQLALCHEMY_DATABASE_URL.endswith("://")
 )
+if not in_memory_sqlite:
+    engine_options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=config.DB_POOL_SIZE,
+        max_overflow=config.DB_MAX_OVERFLOW,
+        pool_timeout=config.DB_POOL_TIMEOUT,
+        pool_pre_ping=config.DB_POOL_PRE_PING,
+        pool_recycle=config.DB_POOL_RECYCLE,
+    )
+
+engine = create_async_engine(SQLALCHEMY_DATABASE_URL, **engine_options)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@event.listens_for(engine.sync_engine, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.in_use += 1
+    pool_metrics.max_in_use = max(pool_metrics.max_in_use, pool_metrics.in_use)
+
+
+@event.listens_for(engine.sync_engine, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.in_use -= 1
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    metrics.DB_QUERY.labels(statement.lstrip().split(None, 1)[0].upper()).observe(elapsed)
+
+
+def pool_status():
+    return pool_metrics.snapshot(engine.pool)
+
+
+SessionLocal = async_sessionmaker(
+    bind=engine,
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+)
 
 Base = declarative_base()
@@ -1,9 +1,3 @@
 #!/bin/bash
-
-until nc -z -v -w30 $CFG_MYSQL_HOST 3306
-do
-  echo "Waiting for database connection..."
-  # wait for 5 seconds before check again
-  sleep 5
-done
-sleep 30
\ No newline at end of file
+# The server waits for the database itself (DB_CONNECT_TIMEOUT) and reports on /readyz once it can take players.
+exec "$@"
@@ -0,0 +1,469 @@
+"""Append-only match event log, its projection, and replay.
+
+Every match state change (queued, matched, move, result, timeout, exit) and every batch of tournament results is
+appended to a log of numbered JSON-lines segments. game_sessions and game_stats are projections of the log:
+StatsAggregator applies them in batches, and `python events.py rebuild` recomputes them from each shard's latest
+snapshot plus the events after it, e.g. after fixing a bug in the rules. Each worker writes to its own shard
+directory under EVENT_LOG_DIR.
+
+    python events.py seed      # save the current game_stats as the base the logged results are added to
+    python events.py rebuild   # overwrite game_stats and the logged sessions from the base and the log
+"""
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import bindparam, select, update
+
+from stats import encode_rounds, game_sessions, game_stats, result_deltas, series_winner
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_PREFIX = "events-"
+SNAPSHOT_PREFIX = "snapshot-"
+BASE_FILE = "base.json"
+
+
+def lock_shard(root: str):
+    """Returns (directory, lock_fd) for the first shard under `root` that no other log has open."""
+    for index in itertools.count():
+        directory = os.path.join(root, f"shard-{index}")
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, "lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            continue
+        return directory, fd
+
+
+def shard_directories(root: str):
+    if not os.path.isdir(root):
+        return []
+    return sorted(os.path.join(root, name) for name in os.listdir(root) if name.startswith("shard-"))
+
+
+def _numbered(directory: str, prefix: str):
+    """Returns [(number, path)] for files named {prefix}{number}.{ext}, in order."""
+    files = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and not name.endswith(".tmp"):
+            files.append((int(name[len(prefix):].split(".")[0]), os.path.join(directory, name)))
+    return sorted(files)
+
+
+def _write_atomically(path: str, data: str):
+    with open(path + ".tmp", "w") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+ID_FIELDS = ("user_id", "player1_id", "player2_id")
+
+
+def _int_ids(event: dict):
+    """Makes an event's user ids ints, as they are when appended. Logs written before user ids were ints carry
+    them as strings, and JSON object keys, like a tournament's totals, are always strings."""
+    for field in ID_FIELDS:
+        if isinstance(event.get(field), str):
+            event[field] = int(event[field])
+    if "totals" in event:
+        event["totals"] = {int(user_id): totals for user_id, totals in event["totals"].items()}
+    return event
+
+
+def read_events(directory: str, after_seq: int = 0):
+    segments = _numbered(directory, SEGMENT_PREFIX)
+    last_seq = after_seq
+    for index, (first_seq, path) in enumerate(segments):
+        if index + 1 < len(segments) and segments[index + 1][0] <= after_seq + 1:
+            continue
+        with open(path) as segment:
+            for line in segment:
+                if not line.endswith("\n"):
+                    # A batch cut short by a crash; everything before it is intact.
+                    break
+                event = json.loads(line)
+                # A batch retried after a failed write may repeat events already on disk.
+                if event["seq"] > last_seq:
+                    last_seq = event["seq"]
+                    yield _int_ids(event)
+
+
+def latest_snapshot(directory: str):
+    """Returns (seq, state) of the newest snapshot, or (0, None)."""
+    snapshots = _numbered(directory, SNAPSHOT_PREFIX)
+    if not snapshots:
+        return 0, None
+    with open(snapshots[-1][1]) as snapshot:
+        data = json.load(snapshot)
+    return data["seq"], data["state"]
+
+
+def read_checkpoint(directory: str):
+    try:
+        with open(os.path.join(directory, "checkpoint")) as checkpoint:
+            return int(checkpoint.read())
+    except FileNotFoundError:
+        return 0
+
+
+class EventLog:
+    """One shard of the log. `append` only numbers the event and queues it; a writer task writes the queue in
+    batches with one write and fsync each, starting a new segment once the current one reaches segment_bytes.
+    `sync` waits for the events appended so far to be written, sharing the fsync with everything queued
+    alongside them.
+
+    Snapshots of the projection are written once the events they cover are on disk. Segments are deleted when
+    every event in them is covered both by a snapshot and by the checkpoint, the last sequence number applied
+    to the database.
+    """
+
+    def __init__(self, root: str, segment_bytes: int = 64 << 20, flush_interval: float = 0.05,
+                 fsync: bool = True, snapshot_every: int = 10000, max_batch: int = 1000):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.snapshot_every = snapshot_every
+        self.max_batch = max_batch
+        self.directory = None
+        self.seq = 0
+        self.written_seq = 0
+        self.checkpoint_seq = 0
+        self.snapshot_seq = 0
+        self.pending = []
+        self.batches = 0
+        self._snapshot = None
+        self._snapshot_requested_seq = 0
+        self._lock_fd = None
+        self._segment = None
+        self._segment_size = 0
+        self._write_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._waiters = []
+        self._stopping = False
+        self._compacted_seq = 0
+        self._task = None
+
+    def open(self):
+        if self.directory is not None:
+            return
+        self.directory, self._lock_fd = lock_shard(self.root)
+        self.checkpoint_seq = read_checkpoint(self.directory)
+        self.snapshot_seq, _ = latest_snapshot(self.directory)
+        last_seq = max(self.checkpoint_seq, self.snapshot_seq)
+        segments = _numbered(self.directory, SEGMENT_PREFIX)
+        if segments:
+            for event in read_events(self.directory, after_seq=segments[-1][0] - 1):
+                last_seq = max(last_seq, event["seq"])
+        # Events appended before the log was opened are renumbered after what is already on disk.
+        for offset, event in enumerate(self.pending, start=1):
+            event["seq"] = last_seq + offset
+        self.written_seq = last_seq
+        self.seq = last_seq + len(self.pending)
+        self._snapshot_requested_seq = self.snapshot_seq
+
+    def append(self, event_type: str, **fields):
+        self.seq += 1
+        event = {"seq": self.seq, "ts": round(time.time(), 3), "type": event_type, **fields}
+        self.pending.append(event)
+        if len(self.pending) >= self.max_batch:
+            self._wakeup.set()
+        return event
+
+    async def sync(self):
+        seq = self.seq
+        if seq <= self.written_seq or self.directory is None:
+            return
+        if self._task is None:
+            await self.flush()
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((seq, waiter))
+        self._wakeup.set()
+        await waiter
+
+    def needs_snapshot(self):
+        return self.seq - self._snapshot_requested_seq >= self.snapshot_every
+
+    def request_snapshot(self, state):
+        """Snapshots `state`, the projection as of the last appended event, once that event is written."""
+        self._snapshot = (self.seq, state)
+        self._snapshot_requested_seq = self.seq
+
+    def read(self, after_seq: int = 0):
+        return read_events(self.directory, after_seq)
+
+    def latest_snapshot(self):
+        return latest_snapshot(self.directory)
+
+    async def checkpoint(self, seq: int):
+        if seq <= self.checkpoint_seq or self.directory is None:
+            return
+        self.checkpoint_seq = seq
+        path = os.path.join(self.directory, "checkpoint")
+        await asyncio.get_running_loop().run_in_executor(None, _write_atomically, path, str(seq))
+
+    async def flush(self):
+        async with self._write_lock:
+            if self.directory is None:
+                return 0
+            loop = asyncio.get_running_loop()
+            written = 0
+            if self.pending:
+                batch, self.pending = self.pending, []
+                lines = "".join(json.dumps(event, separators=(",", ":")) + "\n" for event in batch)
+                try:
+                    await loop.run_in_executor(None, self._write, batch[0]["seq"], lines)
+                except Exception:
+                    self.pending = batch + self.pending
+                    raise
+                self.written_seq = batch[-1]["seq"]
+                self.batches += 1
+                written = len(batch)
+                self._release_waiters()
+            if self._snapshot is not None and self._snapshot[0] <= self.written_seq:
+                seq, state = self._snapshot
+                self._snapshot = None
+                await loop.run_in_executor(None, self._write_snapshot, seq, state)
+                self.snapshot_seq = seq
+            await loop.run_in_executor(None, self._compact)
+            return written
+
+    def _release_waiters(self):
+        waiting = []
+        for seq, waiter in self._waiters:
+            if seq <= self.written_seq:
+                if not waiter.done():
+                    waiter.set_result(None)
+            else:
+                waiting.append((seq, waiter))
+        self._waiters = waiting
+
+    def _write(self, first_seq: int, lines: str):
+        if self._segment is None or self._segment_size >= self.segment_bytes:
+            if self._segment is not None:
+                self._segment.close()
+            path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{first_seq:012d}.jsonl")
+            self._segment = open(path, "a")
+            self._segment_size = self._segment.tell()
+        self._segment.write(lines)
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+        self._segment_size += len(lines)
+
+    def _write_snapshot(self, seq: int, state):
+        path = os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{seq:012d}.json")
+        _write_atomically(path, json.dumps({"seq": seq, "state": state}))
+
+    def _compact(self):
+        covered = min(self.snapshot_seq, self.checkpoint_seq)
+        if covered <= self._compacted_seq:
+            return
+        self._compacted_seq = covered
+        segments = _numbered(self.directory, SEGMENT_PREFIX)
+        # The last segment is still being written; earlier ones are whole once the next one has started.
+        for (_, path), (next_first_seq, _) in zip(segments, segments[1:]):
+            if next_first_seq - 1 <= covered:
+                os.unlink(path)
+        for _, path in _numbered(self.directory, SNAPSHOT_PREFIX)[:-1]:
+            os.unlink(path)
+
+    async def run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error writing match events", extra={"pending": len(self.pending)})
+
+    def start(self):
+        self.open()
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Let the writer finish its batch rather than cancelling it halfway through a write.
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._stopping = False
+        await self.flush()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+            self.directory = None
+
+
+def logged_winner(determine_winner, event: dict):
+    """The winner of a logged result: of its only round, or of most rounds of a series."""
+    if event.get("rounds"):
+        return series_winner(determine_winner, event["player1_id"], event["player2_id"], event["rounds"])
+    return determine_winner(event["player1_id"], event["player1_move"],
+                            event["player2_id"], event["player2_move"])['winner']
+
+
+class MatchProjection:
+    """State derived only from match events: every player's win/loss/draw totals and their latest session.
+
+    Results are re-decided from the logged moves with `determine_winner`, so replaying the log with fixed rules
+    also fixes the stats. With `track_sessions`, the final values of every replayed session are kept too.
+    """
+
+    def __init__(self, determine_winner, track_sessions: bool = False):
+        self.determine_winner = determine_winner
+        self.stats = {}
+        self.last_sessions = {}
+        self.sessions = {} if track_sessions else None
+
+    def apply(self, event: dict):
+        event_type = event["type"]
+        if event_type == "matched":
+            player1_id, player2_id = event["player1_id"], event["player2_id"]
+            self.last_sessions[player1_id] = [event["session_id"], player2_id, 'waiting']
+            self.last_sessions[player2_id] = [event["session_id"], player1_id, 'waiting']
+        elif event_type == "result":
+            winner = logged_winner(self.determine_winner, event)
+            deltas = result_deltas(event["player1_id"], event["player2_id"], winner)
+            for user_id, (wins, losses, draws) in deltas.items():
+                total = self.stats.setdefault(user_id, [0, 0, 0])
+                total[0] += wins
+                total[1] += losses
+                total[2] += draws
+            self._end(event, 'completed', player1_move=event["player1_move"], player2_move=event["player2_move"],
+                      rounds=event.get("rounds"))
+        elif event_type == "tournament":
+            # Already in game_stats; only rebuilds add it from here.
+            for user_id, deltas in event["totals"].items():
+                total = self.stats.setdefault(user_id, [0, 0, 0])
+                for index, delta in enumerate(deltas):
+                    total[index] += delta
+        elif event_type == "timeout":
+            self._end(event, 'timeout')
+        elif event_type == "exit":
+            self._end(event, 'completed')
+
+    def open_sessions(self):
+        """{session_id: (player1_id, player2_id)} of the matched sessions with no end event yet."""
+        sessions = {}
+        for user_id, (session_id, opponent_id, status) in self.last_sessions.items():
+            if status == 'waiting':
+                sessions.setdefault(session_id, (user_id, opponent_id))
+        return sessions
+
+    def _end(self, event: dict, status: str, **values):
+        for player_id in (event["player1_id"], event["player2_id"]):
+            last_session = self.last_sessions.get(player_id)
+            if last_session is not None and last_session[0] == event["session_id"]:
+                last_session[2] = status
+        if self.sessions is not None:
+            self.sessions.setdefault(event["session_id"], {}).update(status=status, **values)
+
+    def state(self):
+        return {
+            "stats": {str(user_id): list(totals) for user_id, totals in self.stats.items()},
+            "last_sessions": {str(user_id): list(last) for user_id, last in self.last_sessions.items()},
+        }
+
+    def load(self, state):
+        self.stats = {int(user_id): list(totals) for user_id, totals in state["stats"].items()}
+        self.last_sessions = {int(user_id): [session_id, int(opponent_id), status]
+                              for user_id, (session_id, opponent_id, status) in state["last_sessions"].items()}
+
+
+async def seed(session_factory, root: str):
+    """Saves the current game_stats as the base that rebuilds add the logged results to."""
+    async with session_factory() as db:
+        result = await db.execute(select(game_stats.c.user_id, game_stats.c.wins, game_stats.c.losses,
+                                         game_stats.c.draws))
+        stats = {str(user_id): [wins, losses, draws] for user_id, wins, losses, draws in result}
+    os.makedirs(root, exist_ok=True)
+    _write_atomically(os.path.join(root, BASE_FILE), json.dumps(stats))
+    return len(stats)
+
+
+async def rebuild(session_factory, root: str, determine_winner):
+    """Overwrites game_stats with the base plus every shard's results, and the logged sessions' final values.
+
+    Run it with the servers stopped, so no shard is still being written and no stats are waiting to be flushed.
+    """
+    try:
+        with open(os.path.join(root, BASE_FILE)) as base:
+            totals = {int(user_id): totals for user_id, totals in json.load(base).items()}
+    except FileNotFoundError:
+        raise SystemExit(f"No {BASE_FILE} in {root}; run `python events.py seed` before the log starts") from None
+    sessions = {}
+    for directory in shard_directories(root):
+        projection = MatchProjection(determine_winner, track_sessions=True)
+        snapshot_seq, state = latest_snapshot(directory)
+        if state is not None:
+            projection.load(state)
+        for event in read_events(directory, after_seq=snapshot_seq):
+            projection.apply(event)
+        for user_id, deltas in projection.stats.items():
+            total = totals.setdefault(user_id, [0, 0, 0])
+            for index, delta in enumerate(deltas):
+                total[index] += delta
+        sessions.update(projection.sessions)
+
+    set_stats = update(game_stats).where(game_stats.c.user_id == bindparam('b_user_id')).values(
+        wins=bindparam('b_wins'), losses=bindparam('b_losses'), draws=bindparam('b_draws'),
+    )
+    set_session = update(game_sessions).where(game_sessions.c.session_id == bindparam('b_session_id')).values(
+        player1_move=bindparam('b_player1_move'), player2_move=bindparam('b_player2_move'),
+        rounds=bindparam('b_rounds'), status=bindparam('b_status'), stats_applied=True,
+    )
+    async with session_factory() as db:
+        if totals:
+            await db.execute(set_stats, [
+                {'b_user_id': user_id, 'b_wins': wins, 'b_losses': losses, 'b_draws': draws}
+                for user_id, (wins, losses, draws) in totals.items()
+            ])
+        if sessions:
+            await db.execute(set_session, [
+                {'b_session_id': session_id, 'b_player1_move': values.get('player1_move'),
+                 'b_player2_move': values.get('player2_move'), 'b_rounds': encode_rounds(values.get('rounds')),
+                 'b_status': values['status']}
+                for session_id, values in sessions.items()
+            ])
+        await db.commit()
+    return len(totals), len(sessions)
+
+
+def main(command: str):
+    import config
+    from database import SessionLocal
+    from game import GameManager
+
+    if command == "seed":
+        count = asyncio.run(seed(SessionLocal, config.EVENT_LOG_DIR))
+        print(f"Saved stats for {count} players as the rebuild base")
+    elif command == "rebuild":
+        players, sessions = asyncio.run(rebuild(SessionLocal, config.EVENT_LOG_DIR, GameManager.determine_winner))
+        print(f"Rebuilt stats for {players} players and {sessions} sessions")
+    else:
+        raise SystemExit("usage: python events.py seed|rebuild")
+
+
+if __name__ == "__main__":
+    import sys
+
+    main(sys.argv[1] if len(sys.argv) > 1 else "")
@@ -1,197 +1,838 @@
-import json
+import asyncio
+import logging
+import secrets
 import time
+from collections import deque
 
 from fastapi import WebSocket
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
+import caching
+import config
 import crud
-from models import GameSession, GameStat
+import metrics
+import protocol
+from actors import ActorPool
+from broadcast import BroadcastHub
+from bus import create_bus
+from connection import Connection
+from events import EventLog, MatchProjection, logged_winner
+from leaderboard import Leaderboard
+from database import SessionLocal
+from models import GameSession
+from stats import StatsAggregator, result_deltas
+from timers import TimerScheduler
+
+logger = logging.getLogger(__name__)
+
+MOVES = ('rock', 'paper', 'scissors')
+
+
+def widening_buckets():
+    return bool(config.MATCHMAKING_WIDEN_AFTER
+                and (config.MATCHMAKING_SKILL_BUCKETS or config.MATCHMAKING_RTT_BUCKET_MS))
+
+
+class Match:
+    def __init__(self, session_id: int, player1_id: int, player2_id: int, best_of: int = 1):
+        self.session_id = session_id
+        self.player1_id = player1_id
+        self.player2_id = player2_id
+        self.player1_move = None
+        self.player2_move = None
+        self.status = 'playing'
+        # Spectator channels other than its own that are showing this match.
+        self.channels = ()
+        # A best-of-N series keeps its finished rounds and each player's round wins in memory until it is decided.
+        self.best_of = best_of
+        self.rounds = []
+        self.wins = [0, 0]
+
+    def set_move(self, user_id: int, move: str):
+        if user_id == self.player1_id:
+            self.player1_move = move
+        else:
+            self.player2_move = move
 
+    def is_complete(self):
+        return self.player1_move is not None and self.player2_move is not None
 
-class GameManager:
-    def __init__(self):
-        self.active_websockets = {}
-        self.waiting_players = []
-        self.play_again_requests = {}
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.active_websockets[user_id] = websocket
-
-    async def disconnect(self, user_id: str):
-        if user_id in self.waiting_players:
-            self.waiting_players.remove(user_id)
-        websocket = self.active_websockets.pop(user_id, None)
-        if websocket:
-            try:
-                await websocket.close()
-            except RuntimeError as e:
-                print(f"Error closing websocket for user {user_id}: {e}")
+    def opponent_of(self, user_id: int):
+        return self.player2_id if user_id == self.player1_id else self.player1_id
 
-    async def start_game(self, user_id: str, websocket: WebSocket, db: Session):
-        if not self.waiting_players:
-            self.waiting_players.append(user_id)
-        else:
-            opponent_id = self.waiting_players.pop(0)
-
-            new_game_session = GameSession(
-                player1_id=user_id,
-                player2_id=opponent_id,
-                status='waiting'
-            )
-            db.add(new_game_session)
-            db.commit()
-
-            await self.active_websockets[opponent_id].send_text(
-                json.dumps({"message": f"Game started with {user_id}", "session_id": new_game_session.session_id})
-            )
-            await websocket.send_text(
-                json.dumps({"message": f"Game started with {opponent_id}", "session_id": new_game_session.session_id})
-            )
-
-    async def cancel_search(self, user_id: str, websocket: WebSocket):
-        if user_id in self.waiting_players:
-            self.waiting_players.remove(user_id)
-        await websocket.send_text("Search cancelled")
-
-    async def make_move(self, user_id: str, move: str, db: Session):
-
-        print("IN MAKE MOVE user id: ", int(user_id), move)
-        db.expire_all()
-        db.expunge_all()
-
-        current_session = db.query(GameSession).filter(
-            (GameSession.player1_id == int(user_id)) | (GameSession.player2_id == int(user_id)),
-            GameSession.status == 'waiting'
-        ).order_by(GameSession.session_id.desc()).first()
-
-        if current_session is None:
-            await self.active_websockets[user_id].send_text(json.dumps({"error": "No active game session"}))
-            return
+    def end_round(self, winner_id):
+        """Records the round both players just moved in. Returns whether that decided the series."""
+        self.rounds.append((self.player1_move, self.player2_move))
+        if winner_id is not None:
+            self.wins[0 if winner_id == self.player1_id else 1] += 1
+        remaining = self.best_of - len(self.rounds)
+        return remaining == 0 or abs(self.wins[0] - self.wins[1]) > remaining
 
-        if str(current_session.player2_id) == user_id:
-            current_session.player2_move = move
-            db.commit()
+    def series_winner(self):
+        if self.wins[0] == self.wins[1]:
+            return None
+        return self.player1_id if self.wins[0] > self.wins[1] else self.player2_id
 
-        if str(current_session.player1_id) == user_id:
-            current_session.player1_move = move
-        else:
-            current_session.player2_move = move
-        db.commit()
 
-        current_session = db.query(GameSession).filter(
-            GameSession.session_id == current_session.session_id
-        ).order_by(GameSession.session_id.desc()).first()
+class ParkedPlayer:
+    """A dropped player's resume token and the latest messages sent to them while they were away."""
+    __slots__ = ('token', 'messages', 'dropped')
 
-        if current_session is None:
-            await self.active_websockets[user_id].send_text(json.dumps({"error": "No active game session"}))
-            return
+    def __init__(self, token, messages, max_messages: int):
+        self.token = token
+        self.messages = deque(messages, maxlen=max_messages)
+        self.dropped = max(0, len(messages) - max_messages)
 
-        if current_session.player1_move and current_session.player2_move:
-            result = self.determine_winner(
-                str(current_session.player1_id),
-                current_session.player1_move,
-                str(current_session.player2_id),
-                current_session.player2_move)
-            current_session.status = 'completed'
-            db.commit()
-
-            player1_stats = db.query(GameStat).filter_by(user_id=current_session.player1_id).first()
-            player2_stats = db.query(GameStat).filter_by(user_id=current_session.player2_id).first()
-
-            if player1_stats.last_game_session_id != current_session.session_id and player2_stats.last_game_session_id != current_session.session_id:
-                if result['winner']:
-                    winner_stats = player1_stats if result['winner'] == current_session.player1_id else player2_stats
-                    loser_stats = player2_stats if result['winner'] == current_session.player1_id else player1_stats
-                    winner_stats.wins += 1
-                    loser_stats.losses += 1
-                else:
-                    player1_stats.draws += 1
-                    player2_stats.draws += 1
-                player1_stats.last_game_session_id = current_session.session_id
-                player2_stats.last_game_session_id = current_session.session_id
-                db.commit()
-
-            await self.notify_players_result(str(current_session.player1_id), str(current_session.player2_id), result)
-
-    async def timeout_game(self, user_id: str, db: Session):
-        current_session = db.query(GameSession).filter(
-            (GameSession.player1_id == user_id) | (GameSession.player2_id == user_id),
-            GameSession.status == 'waiting'
-        ).first()
-
-        if current_session:
-            current_session.status = 'timeout'
-            db.commit()
-            await self.notify_players_timeout(str(current_session.player1_id), str(current_session.player2_id), user_id)
-
-    async def exit_game(self, user_id: str, db: Session):
-        current_session = db.query(GameSession).filter(
-            (GameSession.player1_id == user_id) | (GameSession.player2_id == user_id)
-        ).order_by(GameSession.session_id.desc()).first()
-        if current_session.status not in ['completed', 'timeout']:
-            current_session.status = 'completed'
-            db.commit()
-
-        opponent_id = str(current_session.player1_id)
-        if str(current_session.player1_id) == user_id:
-            opponent_id = str(current_session.player2_id)
-        if opponent_id in self.active_websockets:
-            await self.active_websockets[opponent_id].send_text(json.dumps({
-                "action": "game_over",
-            }))
+    def add(self, message):
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped += 1
+        self.messages.append(message)
 
-    async def notify_players_timeout(self, player1_id: str, player2_id: str, timed_out_user_id: str):
-        timeout_message = json.dumps({
-            "action": "timeout",
-            "timed_out_user_id": timed_out_user_id
-        })
 
-        if player1_id in self.active_websockets:
-            await self.active_websockets[player1_id].send_text(timeout_message)
+class PlayerRecord:
+    """What this worker holds for one player: their socket, or while they are away their parked messages, their
+    live match and a play-again offer made to them. A record without any of these is dropped."""
+    __slots__ = ('connection', 'parked', 'resume_token', 'rtt', 'match', 'play_again_from', 'last_active')
+
+    def __init__(self, connection: Connection = None):
+        self.connection = connection
+        self.parked = None
+        self.resume_token = None
+        self.rtt = None
+        self.match = None
+        self.play_again_from = None
+        self.last_active = time.monotonic()
 
-        if player2_id in self.active_websockets:
-            await self.active_websockets[player2_id].send_text(timeout_message)
+    def is_here(self):
+        return self.connection is not None or self.parked is not None
 
-    def play_again(self, user_id: str, opponent_id: str, db: Session):
+    def is_unused(self):
+        return (self.connection is None and self.parked is None and self.match is None
+                and self.play_again_from is None)
+
+
+class GameManager:
+    def __init__(self, session_factory=SessionLocal, bus=None):
+        self.session_factory = session_factory
+        # Matchmaking, match ownership and play-again offers are shared with other workers through the bus.
+        self.bus = bus or create_bus()
+        # One record per player this worker knows about, keyed by int user_id: connected players, players who
+        # dropped less than RESUME_GRACE_PERIOD ago and players in a match owned by this worker.
+        self.players = {}
+        # Players whose socket is being closed. It stays attached meanwhile, so what is sent to them queues on it.
+        self.closing = set()
+        # Live matches owned by this worker, keyed by session_id.
+        self.matches = {}
+        # Everything that changes a live match runs in that match's mailbox, one message at a time.
+        self.actors = ActorPool(config.MATCH_ACTOR_SHARDS)
+        self.rematches = set()
+        # Spectators watch a match on match-{session_id}, or whichever match a named channel is featuring.
+        self.broadcasts = BroadcastHub(self.channel_snapshot)
+        self.featured = {}
+        # Match state changes are appended to the event log; sessions and stats are written behind it.
+        self.events = EventLog(
+            config.EVENT_LOG_DIR,
+            segment_bytes=config.EVENT_LOG_SEGMENT_BYTES,
+            flush_interval=config.EVENT_LOG_FLUSH_INTERVAL,
+            fsync=config.EVENT_LOG_FSYNC,
+            snapshot_every=config.EVENT_LOG_SNAPSHOT_EVERY,
+        )
+        self.projection = MatchProjection(self.determine_winner)
+        self.stats = StatsAggregator(
+            session_factory,
+            flush_interval=config.STATS_FLUSH_INTERVAL,
+            max_pending=config.STATS_FLUSH_MAX_PENDING,
+            on_applied=caching.invalidate_stats,
+            on_flushed=self.events.checkpoint,
+        )
+        # Rankings loaded from game_stats at startup and kept current by every worker's results and new users.
+        self.leaderboard = Leaderboard()
+        self.timers = TimerScheduler({
+            "move": self.expire_matches,
+            "search": self.expire_searches,
+            "widen": self.widen_searches,
+            "play_again": self.expire_play_again_offers,
+            "resume": self.expire_parked_players,
+        })
+
+    async def start(self):
+        self.events.start()
+        self.actors.start()
+        await self.bus.start(self.handle_bus_message)
+        self.stats.start()
+        self.timers.start()
+
+    async def stop(self):
+        await self.timers.stop()
+        # Move deadlines only live in memory, so a match still in play would otherwise stay 'waiting' for good.
+        await self.expire_matches(list(self.matches))
+        await self.bus.stop()
+        await self.actors.stop()
+        await self.stats.stop()
+        await self.events.stop()
+
+    def replay_events(self):
+        """Restores the projection from this shard's snapshot and events, and re-buffers every session change
+        logged after the last flush. Returns the number of events replayed.
+
+        The snapshot and the stats checkpoint move independently, so reading starts at the older of the two:
+        events the snapshot already covers are only re-buffered, and flushed ones only re-projected. Matches
+        left in play by a crash have lost their deadlines with the process, so they are timed out."""
+        self.events.open()
+        snapshot_seq, state = self.events.latest_snapshot()
+        if state is not None:
+            self.projection.load(state)
+        replayed = 0
+        for event in self.events.read(after_seq=min(snapshot_seq, self.events.checkpoint_seq)):
+            if event["seq"] > snapshot_seq:
+                self.projection.apply(event)
+            if event["seq"] <= self.events.checkpoint_seq:
+                continue
+            replayed += 1
+            if event["type"] == "result":
+                winner = logged_winner(self.determine_winner, event)
+                self.stats.add(event["session_id"], event["player1_id"], event["player2_id"], winner,
+                               moves=(event["player1_move"], event["player2_move"]), seq=event["seq"],
+                               rounds=event.get("rounds"))
+            elif event["type"] in ("timeout", "exit"):
+                status = 'timeout' if event["type"] == "timeout" else 'completed'
+                self.stats.update_session(event["session_id"], status, seq=event["seq"])
+        for session_id, (player1_id, player2_id) in self.projection.open_sessions().items():
+            event = self.record_event("timeout", session_id=session_id, player1_id=player1_id,
+                                      player2_id=player2_id)
+            self.stats.update_session(session_id, 'timeout', seq=event["seq"])
+        return replayed
+
+    def record_event(self, event_type: str, **fields):
+        event = self.events.append(event_type, **fields)
+        self.projection.apply(event)
+        if self.events.needs_snapshot():
+            self.events.request_snapshot(self.projection.state())
+        return event
+
+    async def handle_bus_message(self, message: dict):
+        if message["type"] == "deliver":
+            record = self.players.get(message["user_id"])
+            if record is not None and record.is_here():
+                await self.send(message["user_id"], message["message"])
+        elif message["type"] == "action":
+            async with self.session_factory() as db:
+                if message["action"] == "make_move":
+                    await self.make_move(message["user_id"], message["move"], db)
+                elif message["action"] == "timeout":
+                    await self.timeout_game(message["user_id"], db)
+                elif message["action"] == "exit_game":
+                    await self.exit_game(message["user_id"], db)
+        elif message["type"] == "leaderboard":
+            self.leaderboard.apply({int(user_id): deltas for user_id, deltas in message["deltas"].items()})
+
+    async def update_leaderboard(self, deltas):
+        """Adds {user_id: [wins, losses, draws]} to this worker's ranking and to every other worker's."""
+        self.leaderboard.apply(deltas)
+        await self.bus.broadcast({"type": "leaderboard",
+                                  "deltas": {str(user_id): list(counts) for user_id, counts in deltas.items()}})
+
+    def record(self, user_id: int):
+        record = self.players.get(user_id)
+        if record is None:
+            record = self.players[user_id] = PlayerRecord()
+        return record
+
+    def forget(self, user_id: int):
+        record = self.players.get(user_id)
+        if record is not None and record.is_unused():
+            del self.players[user_id]
+
+    def player_match(self, user_id: int):
+        record = self.players.get(user_id)
+        return record.match if record is not None else None
+
+    def connections(self):
+        return [record.connection for record in self.players.values() if record.connection is not None]
+
+    def parked_count(self):
+        return sum(1 for record in self.players.values() if record.parked is not None)
+
+    def touch(self, user_id: int):
+        record = self.players.get(user_id)
+        if record is not None:
+            record.last_active = time.monotonic()
+
+    async def send(self, user_id: int, message):
+        record = self.players.get(user_id)
+        if record is not None:
+            if record.connection is not None:
+                record.connection.send(message)
+                return
+            if record.parked is not None:
+                record.parked.add(message)
+                return
+        await self.bus.deliver(user_id, protocol.raw(message))
+
+    async def send_many(self, messages):
+        """Sends (user_id, message) pairs concurrently so remote deliveries do not queue behind each other."""
+        await asyncio.gather(*(self.send(user_id, message) for user_id, message in messages))
+
+    def connection_metrics(self):
+        """Send statistics over this worker's open sockets, for the /metrics gauges."""
+        now = time.monotonic()
+        frames = {"sent": 0, "dropped": 0, "coalesced": 0}
+        total_latency = max_latency = max_idle = 0.0
+        for record in self.players.values():
+            connection = record.connection
+            if connection is None:
+                continue
+            frames["sent"] += connection.sent
+            frames["dropped"] += connection.dropped
+            frames["coalesced"] += connection.coalesced
+            total_latency += connection.total_latency
+            max_latency = max(max_latency, connection.max_latency)
+            max_idle = max(max_idle, now - record.last_active)
+        mean_latency = total_latency / frames["sent"] if frames["sent"] else 0.0
+        return {"frames": frames, "send_latency": {"mean": mean_latency, "max": max_latency}, "max_idle": max_idle}
+
+    async def forward_to_match_owner(self, user_id: int, action: str, **params):
+        """Hands a match action to the worker owning the player's match. Returns False if that is this worker."""
+        worker_id = await self.bus.get_match_worker(user_id)
+        if worker_id is None or worker_id == self.bus.worker_id:
+            return False
+        await self.bus.send(worker_id, {"type": "action", "user_id": user_id, "action": action, **params})
+        return True
+
+    def attach(self, user_id: int, connection: Connection):
+        record = self.record(user_id)
+        record.connection = connection
+        record.last_active = time.monotonic()
+        return record
+
+    async def connect(self, websocket: WebSocket, user_id: int, resume_token: str = None):
+        codec = await protocol.accept(websocket)
+        parked = await self.take_over(user_id)
+        connection = Connection(websocket, codec, max_pending=config.SEND_QUEUE_SIZE,
+                                policy=config.SLOW_CONSUMER_POLICY)
+        record = self.attach(user_id, connection)
+        if parked is None:
+            await self.bus.register(user_id)
+        if config.RESUME_GRACE_PERIOD:
+            resumed = (parked is not None and parked.token is not None and resume_token is not None
+                       and secrets.compare_digest(parked.token, resume_token))
+            record.resume_token = secrets.token_urlsafe(16)
+            connection.send(self.session_message(user_id, record, parked if resumed else None))
+            if resumed:
+                for message in parked.messages:
+                    connection.send(message)
+        if config.MATCHMAKING_RTT_BUCKET_MS:
+            await self.send(user_id, {"action": "ping", "ts": time.monotonic()})
+        return codec
+
+    async def take_over(self, user_id: int):
+        """Detaches what this worker still holds for a reconnecting player: a parked session, or a previous
+        socket that has not noticed it is gone. Returns it as a ParkedPlayer, or None."""
+        record = self.players.get(user_id)
+        if record is None:
+            return None
+        if record.parked is not None:
+            parked, record.parked = record.parked, None
+            self.timers.cancel("resume", user_id)
+            return parked
+        previous = record.connection
+        if previous is None:
+            return None
+        token, record.resume_token = record.resume_token, None
+        await self.close_connection(user_id, previous)
+        if record.connection is previous:
+            record.connection = None
+        return ParkedPlayer(token, previous.undelivered(), config.REPLAY_BUFFER_SIZE)
+
+    def session_message(self, user_id: int, record: PlayerRecord, resumed: ParkedPlayer = None):
+        """The first message on every socket. After a resume it also says which match is in progress and
+        how many older messages did not fit in the replay buffer."""
+        message = {"action": "session", "resume_token": record.resume_token, "resumed": resumed is not None}
+        if resumed is not None:
+            if record.match is not None:
+                message["session_id"] = record.match.session_id
+                message["opponent_id"] = str(record.match.opponent_of(user_id))
+            message["missed"] = resumed.dropped
+        return message
+
+    def record_pong(self, user_id: int, ts):
+        record = self.players.get(user_id)
+        if record is None:
+            return
+        try:
+            record.rtt = (time.monotonic() - float(ts)) * 1000
+        except (TypeError, ValueError):
+            pass
+
+    async def disconnect(self, user_id: int, websocket: WebSocket = None, resumable: bool = False):
+        """Forgets a player's socket. A `resumable` disconnect keeps their match and buffers the messages sent
+        to them for RESUME_GRACE_PERIOD seconds; `websocket` guards against dropping a newer socket."""
+        record = self.players.get(user_id)
+        connection = record.connection if record is not None else None
+        if connection is None or (websocket is not None and connection.websocket is not websocket):
+            return
+        if user_id in self.closing:
+            # Whoever is closing it detaches it too.
+            return
+        record.rtt = None
+        token, record.resume_token = record.resume_token, None
+        self.timers.cancel("search", user_id)
+        await self.close_connection(user_id, connection)
+        if record.connection is not connection:
+            # The player reconnected while the old socket was closing.
+            return
+        record.connection = None
+        if resumable and token is not None and config.RESUME_GRACE_PERIOD:
+            record.parked = ParkedPlayer(token, connection.undelivered(), config.REPLAY_BUFFER_SIZE)
+            self.timers.schedule("resume", user_id, config.RESUME_GRACE_PERIOD)
+            # Stays registered, so messages for the player keep coming here, but stops being matched.
+            await self.bus.cancel_search(user_id)
+        else:
+            await self.bus.unregister(user_id)
+            self.forget(user_id)
+
+    async def close_connection(self, user_id: int, connection: Connection):
+        """Closes a socket that stays attached until the caller detaches it, so messages sent while it closes
+        queue on it and reach `undelivered`."""
+        self.closing.add(user_id)
+        try:
+            await connection.close()
+        except RuntimeError as e:
+            logger.warning("Error closing websocket", extra={"user_id": user_id, "error": str(e)})
+        finally:
+            self.closing.discard(user_id)
+
+    async def expire_parked_players(self, user_ids):
+        for user_id in user_ids:
+            record = self.players.get(user_id)
+            if record is None or record.parked is None:
+                continue
+            record.parked = None
+            await self.bus.unregister(user_id)
+            # The opponent is not left waiting for a player who is not coming back.
+            await self.timeout_game(user_id)
+            self.forget(user_id)
+
+    async def register_match(self, session_id: int, player1_id: int, player2_id: int, best_of: int = 1):
+        match = Match(session_id, player1_id, player2_id, best_of)
+        for player_id in (player1_id, player2_id):
+            previous = self.player_match(player_id)
+            if previous is not None:
+                await self.forfeit(previous, player_id)
+        self.matches[session_id] = match
+        self.record(player1_id).match = match
+        self.record(player2_id).match = match
+        await self.bus.set_match_worker((player1_id, player2_id))
+        if config.MOVE_TIMEOUT:
+            self.timers.schedule("move", session_id, config.MOVE_TIMEOUT)
+        return match
+
+    async def forfeit(self, match: Match, user_id: int):
+        """Ends a live match that `user_id` left for a new one, as if they had exited it."""
+        if await self.close_match(match, 'completed'):
+            await self.send(match.opponent_of(user_id), protocol.GAME_OVER)
+        else:
+            # Something earlier in its mailbox ended it, but the player may still point at it.
+            await self.release_match(match)
+
+    def detach_match(self, match: Match):
+        """Drops the match from this worker's memory. Returns the players it released, for the bus."""
+        self.matches.pop(match.session_id, None)
+        self.timers.cancel("move", match.session_id)
+        released = []
+        for player_id in (match.player1_id, match.player2_id):
+            record = self.players.get(player_id)
+            if record is not None and record.match is match:
+                record.match = None
+                self.forget(player_id)
+                released.append(player_id)
+        return released
+
+    async def release_match(self, match: Match):
+        await self.bus.clear_match_worker(self.detach_match(match))
+
+    async def create_session(self, player1_id: int, player2_id: int, db: AsyncSession, best_of: int = 1):
         new_game_session = GameSession(
-            player1_id=user_id,
-            player2_id=opponent_id,
+            player1_id=player1_id,
+            player2_id=player2_id,
+            best_of=best_of,
             status='waiting'
         )
         db.add(new_game_session)
-        db.commit()
+        await db.commit()
+        series = {"best_of": best_of} if best_of > 1 else {}
+        self.record_event("matched", session_id=new_game_session.session_id,
+                          player1_id=player1_id, player2_id=player2_id, **series)
+        return await self.register_match(new_game_session.session_id, player1_id, player2_id, best_of)
+
+    async def win_rate(self, user_id: int, db: AsyncSession):
+        if not config.MATCHMAKING_SKILL_BUCKETS:
+            return None
+        stats = await caching.get_user_stats(db, user_id=user_id)
+        if stats is None:
+            return None
+        games = stats.wins + stats.losses + stats.draws
+        return stats.wins / games if games else None
+
+    async def start_game(self, user_id: int, websocket: WebSocket, db: AsyncSession, best_of=1):
+        """Queues the player for a single game or, with an odd `best_of` above 1, a series against someone who
+        asked for the same length."""
+        if not isinstance(best_of, int) or isinstance(best_of, bool) or best_of < 1 or best_of % 2 == 0 \
+                or best_of > config.MAX_SERIES_LENGTH:
+            await self.send(user_id, protocol.INVALID_SERIES)
+            return
+        win_rate = await self.win_rate(user_id, db)
+        record = self.players.get(user_id)
+        opponent_id = await self.bus.match(user_id, win_rate, record.rtt if record is not None else None, best_of)
+        if opponent_id is None:
+            self.record_event("queued", user_id=user_id)
+            if config.SEARCH_TIMEOUT:
+                self.timers.schedule("search", user_id, config.SEARCH_TIMEOUT)
+            if widening_buckets():
+                self.timers.schedule("widen", user_id, config.MATCHMAKING_WIDEN_AFTER)
+        else:
+            await self.begin_match(user_id, opponent_id, db, best_of)
+
+    async def begin_match(self, user_id: int, opponent_id: int, db: AsyncSession, best_of: int = 1):
+        for player_id in (user_id, opponent_id):
+            self.timers.cancel("search", player_id)
+            self.timers.cancel("widen", player_id)
+        match = await self.create_session(user_id, opponent_id, db, best_of)
+
+        series = {"best_of": best_of} if best_of > 1 else {}
+        await self.send_many([
+            (opponent_id, {"message": f"Game started with {user_id}", "session_id": match.session_id, **series}),
+            (user_id, {"message": f"Game started with {opponent_id}", "session_id": match.session_id, **series}),
+        ])
+
+    async def widen_searches(self, user_ids):
+        """Runs every MATCHMAKING_WIDEN_AFTER seconds a player waits: pairs everyone whose buckets have widened
+        enough to overlap, not only players who just arrived, and keeps widening for those still waiting."""
+        pairs, waiting = await self.bus.pair_waiting(user_ids)
+        for user_id in waiting:
+            self.timers.schedule("widen", user_id, config.MATCHMAKING_WIDEN_AFTER)
+        if pairs:
+            async with self.session_factory() as db:
+                for player_id, opponent_id, best_of in pairs:
+                    await self.begin_match(player_id, opponent_id, db, best_of)
+
+    async def cancel_search(self, user_id: int, websocket: WebSocket):
+        await self.bus.cancel_search(user_id)
+        self.timers.cancel("search", user_id)
+        self.timers.cancel("widen", user_id)
+        await self.send(user_id, protocol.SEARCH_CANCELLED)
+
+    async def make_move(self, user_id: int, move: str, db: AsyncSession):
+        started = time.perf_counter()
+        match = self.player_match(user_id)
+        if match is None:
+            if await self.forward_to_match_owner(user_id, "make_move", move=move):
+                return
+            await self.send(user_id, protocol.NO_ACTIVE_SESSION)
+            return
+        if move not in MOVES:
+            await self.send(user_id, protocol.INVALID_MOVE)
+            return
+        resolved = await self.actors.call(match.session_id, self.apply_move, match, user_id, move)
+        if resolved is None:
+            # The match ended while this move waited in its mailbox.
+            await self.send(user_id, protocol.NO_ACTIVE_SESSION)
+            return
+        result, event, released = resolved
+        if result is None:
+            return
+        if event is None:
+            await self.notify_players_round(match.player1_id, match.player2_id, result)
+            return
+        await self.bus.clear_match_worker(released)
+        await self.record_result(match, result, event)
+
+        await self.notify_players_result(match.player1_id, match.player2_id, result)
+        metrics.MOVE_TO_RESULT.observe(time.perf_counter() - started)
+
+    def is_live(self, match: Match):
+        return self.matches.get(match.session_id) is match
+
+    async def apply_move(self, match: Match, user_id: int, move: str):
+        """Runs in the match's mailbox, so it only changes memory and the event log. Returns None if the match
+        has already ended, and otherwise (result, event, released players): all None or empty until both moves
+        are in. Waiting for fsync, notifying players and telling the bus happen outside the mailbox, so a shard
+        never idles on I/O.
+
+        A round of a series that does not decide it stays in memory: the moves are reset, the move deadline
+        restarts and the round's result is returned without an event. The decided series is logged as one
+        result carrying every round."""
+        if not self.is_live(match):
+            return None
+        match.set_move(user_id, move)
+        self.record_event("move", session_id=match.session_id, user_id=user_id, move=move)
+        watched = bool(self.broadcasts.channels)
+        if not match.is_complete():
+            if watched:
+                self.publish(match, {"player1_moved" if user_id == match.player1_id else "player2_moved": True})
+            return None, None, ()
+
+        result = self.determine_winner(match.player1_id, match.player1_move, match.player2_id, match.player2_move)
+        series = {}
+        if match.best_of > 1:
+            if not match.end_round(result['winner']):
+                return self.next_round(match, result, watched), None, ()
+            result = {'winner': match.series_winner(), 'result': "Series"}
+            series = {"rounds": [list(moves) for moves in match.rounds]}
+        match.status = 'completed'
+        if watched:
+            self.publish(match, {"player1_moved": True, "player2_moved": True, "status": 'completed',
+                                 "player1_move": match.player1_move, "player2_move": match.player2_move,
+                                 "winner": str(result['winner']) if result['winner'] else None,
+                                 **self.series_state(match)})
+        released = self.detach_match(match)
+        event = self.record_event("result", session_id=match.session_id,
+                                  player1_id=match.player1_id, player1_move=match.player1_move,
+                                  player2_id=match.player2_id, player2_move=match.player2_move, **series)
+        # Flushes that run while it waits for fsync must not checkpoint past it.
+        self.stats.expect(event["seq"])
+        return result, event, released
+
+    def next_round(self, match: Match, result: dict, watched: bool):
+        """Clears the moves of a round that left the series open. Returns what the players are told about it."""
+        round_result = {'winner': result['winner'], 'round': len(match.rounds), 'score': tuple(match.wins)}
+        match.player1_move = match.player2_move = None
+        if config.MOVE_TIMEOUT:
+            self.timers.schedule("move", match.session_id, config.MOVE_TIMEOUT)
+        if watched:
+            self.publish(match, {"player1_moved": False, "player2_moved": False, **self.series_state(match)})
+        return round_result
+
+    async def record_result(self, match: Match, result: dict, event: dict):
+        # The logged result is the durable record, so it is on disk before anyone hears about it.
+        try:
+            await self.events.sync()
+        except BaseException:
+            self.stats.forget(event["seq"])
+            raise
+        metrics.MATCHES.labels('completed').inc()
+
+        winner_id = result['winner']
+        if self.stats.add(match.session_id, match.player1_id, match.player2_id, winner_id,
+                          moves=(match.player1_move, match.player2_move), seq=event["seq"],
+                          rounds=match.rounds):
+            await self.update_leaderboard(result_deltas(match.player1_id, match.player2_id, winner_id))
+
+    def close_session(self, match: Match, status: str, event_type: str = "exit"):
+        """Ends the match in memory and the event log. Returns the players it released."""
+        match.status = status
+        self.publish(match, {"status": status})
+        released = self.detach_match(match)
+        event = self.record_event(event_type, session_id=match.session_id,
+                                  player1_id=match.player1_id, player2_id=match.player2_id)
+        self.stats.update_session(match.session_id, status, seq=event["seq"])
+        metrics.MATCHES.labels(status).inc()
+        return released
+
+    async def end_match(self, match: Match, status: str, event_type: str = "exit"):
+        """Runs in the match's mailbox. Closes the match unless something earlier in the mailbox already ended
+        it, and returns the players it released, or None."""
+        if not self.is_live(match):
+            return None
+        return self.close_session(match, status, event_type)
+
+    async def close_match(self, match: Match, status: str, event_type: str = "exit"):
+        """Ends the match through its mailbox, then frees its players on the bus. Returns whether it ended it."""
+        released = await self.actors.call(match.session_id, self.end_match, match, status, event_type)
+        if released is None:
+            return False
+        await self.bus.clear_match_worker(released)
+        return True
+
+    def match_state(self, match: Match):
+        """What spectators see of a match. Moves are only shown once both are in."""
+        complete = match.is_complete()
+        winner = None
+        if complete and match.best_of > 1:
+            winner = match.series_winner()
+        elif complete:
+            winner = self.determine_winner(match.player1_id, match.player1_move,
+                                           match.player2_id, match.player2_move)['winner']
+        return {
+            "session_id": match.session_id,
+            "player1_id": str(match.player1_id),
+            "player2_id": str(match.player2_id),
+            "player1_moved": match.player1_move is not None,
+            "player2_moved": match.player2_move is not None,
+            "status": match.status,
+            "player1_move": match.player1_move if complete else None,
+            "player2_move": match.player2_move if complete else None,
+            "winner": str(winner) if winner else None,
+            **self.series_state(match),
+        }
+
+    def series_state(self, match: Match):
+        if match.best_of == 1:
+            return {}
+        return {"best_of": match.best_of, "score": list(match.wins),
+                "rounds": [list(moves) for moves in match.rounds]}
+
+    def channel_snapshot(self, channel: str):
+        if channel.startswith("match-"):
+            try:
+                match = self.matches.get(int(channel[len("match-"):]))
+            except ValueError:
+                return None
+            return self.match_state(match) if match is not None else None
+        match = self.featured.get(channel)
+        return self.match_state(match) if match is not None else {}
+
+    def publish(self, match: Match, delta: dict):
+        self.broadcasts.publish(f"match-{match.session_id}", delta)
+        for channel in match.channels:
+            self.broadcasts.publish(channel, delta)
+
+    def feature(self, channel: str, session_id: int):
+        """Shows a live match on a named channel, e.g. a tournament final, replacing what it showed before."""
+        match = self.matches.get(session_id)
+        if match is None:
+            return False
+        previous = self.featured.get(channel)
+        if previous is not None:
+            previous.channels = tuple(name for name in previous.channels if name != channel)
+        self.featured[channel] = match
+        match.channels = match.channels + (channel,)
+        self.broadcasts.publish(channel, self.match_state(match))
+        return True
+
+    def last_opponent(self, user_id: int, status: str = None):
+        """The opponent in the player's latest session logged by this worker, or None if it is not known here."""
+        last_session = self.projection.last_sessions.get(user_id)
+        if last_session is None or (status is not None and last_session[2] != status):
+            return None
+        return last_session[1]
+
+    async def timeout_game(self, user_id: int, db: AsyncSession = None):
+        match = self.player_match(user_id)
+        if match is None and await self.forward_to_match_owner(user_id, "timeout"):
+            return
 
-    async def handle_play_again(self, user_id: str, db: Session):
-        last_game_session = db.query(GameSession).filter(
-            (GameSession.player1_id == user_id) | (GameSession.player2_id == user_id),
-            GameSession.status == 'completed'
-        ).order_by(GameSession.session_id.desc()).first()
+        if match and await self.close_match(match, 'timeout', "timeout"):
+            await self.notify_players_timeout(match.player1_id, match.player2_id, user_id)
 
-        if last_game_session:
-            opponent_id = last_game_session.player2_id if last_game_session.player1_id == user_id else last_game_session.player1_id
-            user = crud.get_user(db, user_id=int(user_id))
+    async def exit_game(self, user_id: int, db: AsyncSession):
+        match = self.player_match(user_id)
+        if match is None and await self.forward_to_match_owner(user_id, "exit_game"):
+            return
+        if match:
+            await self.close_match(match, 'completed')
+            opponent_id = match.opponent_of(user_id)
+        else:
+            opponent_id = self.last_opponent(user_id)
+        if opponent_id is None:
+            last_session = await crud.get_latest_game_session(db, user_id)
+            if last_session is None:
+                return
+            opponent_id = last_session.player1_id
+            if last_session.player1_id == user_id:
+                opponent_id = last_session.player2_id
+
+        await self.send(opponent_id, protocol.GAME_OVER)
+
+    async def notify_players_timeout(self, player1_id: int, player2_id: int, timed_out_user_id: int):
+        # Encoded at most once per codec and shared by both players.
+        timeout_message = protocol.Constant({
+            "action": "timeout",
+            "timed_out_user_id": str(timed_out_user_id) if timed_out_user_id is not None else None
+        })
 
-            self.play_again_requests[str(opponent_id)] = str(user_id)
+        await self.send_many([(player1_id, timeout_message), (player2_id, timeout_message)])
 
-            if str(opponent_id) in self.active_websockets:
-                await self.active_websockets[str(opponent_id)].send_text(json.dumps({
-                    "action": "play_again_request",
-                    "data": user_id,
-                    "user_info": user.nickname,
-                }))
+    async def play_again(self, user_id: int, opponent_id: int, db: AsyncSession):
+        await self.create_session(user_id, opponent_id, db)
 
-    async def handle_play_again_response(self, user_id: str, db: Session):
-        opponent_id = self.play_again_requests.get(str(user_id))
+    async def put_play_again_offer(self, user_id: int, requester_id: int):
+        """Keeps the offer in the player's record when they are connected here, and on the bus otherwise."""
+        record = self.players.get(user_id)
+        if record is not None and record.is_here():
+            record.play_again_from = requester_id
+        else:
+            await self.bus.put(f"play_again:{user_id}", requester_id)
+
+    async def take_play_again_offer(self, user_id: int):
+        record = self.players.get(user_id)
+        if record is not None and record.play_again_from is not None:
+            requester_id, record.play_again_from = record.play_again_from, None
+            self.forget(user_id)
+            return requester_id
+        return await self.bus.pop(f"play_again:{user_id}")
+
+    async def handle_play_again(self, user_id: int, db: AsyncSession):
+        opponent_id = self.last_opponent(user_id, status='completed')
+        if opponent_id is None:
+            last_game_session = await crud.get_latest_game_session(db, user_id, status='completed')
+            if last_game_session:
+                opponent_id = last_game_session.player1_id
+                if last_game_session.player1_id == user_id:
+                    opponent_id = last_game_session.player2_id
+
+        if opponent_id is not None:
+            user = await caching.get_user(db, user_id=user_id)
+
+            await self.put_play_again_offer(opponent_id, user_id)
+            if config.PLAY_AGAIN_TIMEOUT:
+                self.timers.schedule("play_again", opponent_id, config.PLAY_AGAIN_TIMEOUT)
+
+            await self.send(opponent_id, {
+                "action": "play_again_request",
+                "data": str(user_id),
+                "user_info": user.nickname,
+            })
+
+    async def handle_play_again_response(self, user_id: int, db: AsyncSession):
+        opponent_id = await self.take_play_again_offer(user_id)
 
         if opponent_id:
-            await self.active_websockets[str(opponent_id)].send_text(json.dumps({
-                "action": "play_again_accepted",
-            }))
-            self.play_again_requests.pop(str(user_id))
-            self.play_again(user_id, opponent_id, db)
-
-    def determine_winner(self, player1_id: str, player1_move: str, player2_id: str, player2_move: str):
+            pair = frozenset((user_id, opponent_id))
+            # Crossed offers can both be accepted; only the first acceptance for a pair starts a match. The
+            # claim is taken without awaiting, so it needs no mailbox and no shard waits on the insert.
+            if pair not in self.rematches and not self.share_live_match(user_id, opponent_id):
+                self.rematches.add(pair)
+                try:
+                    # Register the match first so the requester can move as soon as it hears of the acceptance.
+                    await self.play_again(user_id, opponent_id, db)
+                finally:
+                    self.rematches.discard(pair)
+            await self.send(opponent_id, protocol.PLAY_AGAIN_ACCEPTED)
+
+    def share_live_match(self, user_id: int, opponent_id: int):
+        match = self.player_match(user_id)
+        return match is not None and match.opponent_of(user_id) == opponent_id
+
+    async def expire_matches(self, session_ids):
+        expired = [self.matches[session_id] for session_id in session_ids if session_id in self.matches]
+        if not expired:
+            return
+        ended = await asyncio.gather(*[
+            self.close_match(match, 'timeout', "timeout") for match in expired
+        ])
+        expired = [match for match, closed in zip(expired, ended) if closed]
+        notifications = []
+        for match in expired:
+            missing = [player_id for player_id, move in ((match.player1_id, match.player1_move),
+                                                         (match.player2_id, match.player2_move)) if move is None]
+            timed_out_user_id = missing[0] if len(missing) == 1 else None
+            notifications.append(self.notify_players_timeout(match.player1_id, match.player2_id, timed_out_user_id))
+        await asyncio.gather(*notifications)
+
+    async def expire_searches(self, user_ids):
+        for user_id in user_ids:
+            if await self.bus.cancel_search(user_id):
+                await self.send(user_id, protocol.SEARCH_TIMEOUT)
+
+    async def expire_play_again_offers(self, user_ids):
+        for user_id in user_ids:
+            requester_id = await self.take_play_again_offer(user_id)
+            if requester_id:
+                await self.send(requester_id, protocol.PLAY_AGAIN_EXPIRED)
+
+    @staticmethod
+    def determine_winner(player1_id: int, player1_move: str, player2_id: int, player2_move: str):
         result = {}
         # Rules: 'rock' > 'scissors', 'scissors' > 'paper', 'paper' > 'rock'
         if player1_move == player2_move:
@@ -207,26 +848,37 @@ class GameManager:
             result['result'] = "Player 2 wins"
         return result
 
-    async def notify_players_result(self, player1_id, player2_id, result):
-        winner_id_str = str(result['winner']) if result['winner'] else "None"
-        if winner_id_str == "None":
-            player1_message = player2_message = "Draw"
+    async def notify_players_result(self, player1_id: int, player2_id: int, result):
+        winner_id = result['winner']
+        if winner_id is None:
+            player1_message = player2_message = protocol.DRAW_RESULT
         else:
-            player1_message = "You won!" if winner_id_str == player1_id else "You lost"
-            player2_message = "You won!" if winner_id_str == player2_id else "You lost"
-
-        if str(player1_id) in self.active_websockets:
-            print("notify_players_result notify result", player1_id)
-
-            await self.active_websockets[str(player1_id)].send_text(json.dumps({
+            player1_message = {
                 "action": "game_result",
-                "winner": winner_id_str,
-                "result": player1_message
-            }))
-        if str(player2_id) in self.active_websockets:
-            print("notify_players_result notify result", player2_id)
-            await self.active_websockets[str(player2_id)].send_text(json.dumps({
+                "winner": str(winner_id),
+                "result": "You won!" if winner_id == player1_id else "You lost"
+            }
+            player2_message = {
                 "action": "game_result",
-                "winner": winner_id_str,
-                "result": player2_message
+                "winner": str(winner_id),
+                "result": "You won!" if winner_id == player2_id else "You lost"
+            }
+
+        logger.debug("Notifying match result",
+                     extra={"player1_id": player1_id, "player2_id": player2_id, "winner": winner_id})
+        await self.send_many([(player1_id, player1_message), (player2_id, player2_message)])
+
+    async def notify_players_round(self, player1_id: int, player2_id: int, round_result):
+        """Tells both players how a round of their series went; the series result follows as a game_result."""
+        winner_id = round_result['winner']
+        messages = []
+        for player_id, (own, other) in ((player1_id, round_result['score']),
+                                        (player2_id, round_result['score'][::-1])):
+            messages.append((player_id, {
+                "action": "round_result",
+                "round": round_result['round'],
+                "winner": str(winner_id),
+                "result": "Draw" if winner_id is None else "You won!" if winner_id == player_id else "You lost",
+                "score": [own, other],
             }))
+        await self.send_many(messages)
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bcrypt
+
+import config
+import metrics
+
+
+class HashingPoolSaturated(Exception):
+    pass
+
+
+def _hash_password(password: bytes, rounds: int):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(password: bytes, stored_password: bytes):
+    return bcrypt.checkpw(password, stored_password)
+
+
+def hash_rounds(stored_password: str):
+    # bcrypt hashes look like $2b$12$<salt+digest>; the second field is the cost factor.
+    try:
+        return int(stored_password.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    def __init__(self, rounds: int, workers: int, queue_size: int, kind: str = "thread"):
+        executor_class = ProcessPoolExecutor if kind == "process" else ThreadPoolExecutor
+        self.executor = executor_class(max_workers=workers)
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = workers + queue_size
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    async def _submit(self, operation: str, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HashingPoolSaturated()
+        self.pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.pending -= 1
+            self.completed += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            metrics.BCRYPT.labels(operation).observe(elapsed)
+
+    async def hash(self, password: str):
+        hashed_password = await self._submit('hash', _hash_password, password.encode('utf-8'), self.rounds)
+        return hashed_password.decode('utf-8')
+
+    async def verify(self, password: str, stored_password: str):
+        return await self._submit('verify', _check_password, password.encode('utf-8'), stored_password.encode('utf-8'))
+
+    def needs_rehash(self, stored_password: str):
+        return hash_rounds(stored_password) != self.rounds
+
+    def metrics(self):
+        return {
+            "in_flight": self.pending,
+            "queue_depth": max(0, self.pending - self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_latency_ms": self.total_seconds / self.completed * 1000 if self.completed else 0.0,
+            "max_latency_ms": self.max_seconds * 1000,
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+hasher = PasswordHasher(
+    rounds=config.BCRYPT_ROUNDS,
+    workers=config.HASH_POOL_WORKERS,
+    queue_size=config.HASH_POOL_QUEUE_SIZE,
+    kind=config.HASH_POOL_KIND,
+)
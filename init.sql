@@ -10,7 +10,6 @@ CREATE TABLE IF NOT EXISTS game_stats (
     wins INT DEFAULT 0,
     losses INT DEFAULT 0,
     draws INT DEFAULT 0,
-    last_game_session_id INT,
     FOREIGN KEY (user_id) REFERENCES users (user_id)
 );
 
@@ -21,6 +20,13 @@ CREATE TABLE IF NOT EXISTS game_sessions (
     player1_move ENUM('rock', 'paper', 'scissors'),
     player2_move ENUM('rock', 'paper', 'scissors'),
     status ENUM('waiting', 'completed', 'timeout') DEFAULT 'waiting',
+    stats_applied BOOLEAN NOT NULL DEFAULT FALSE,
+    best_of INT NOT NULL DEFAULT 1,
+    rounds TEXT NULL,
+    finished_at DATETIME NULL,
+    INDEX ix_game_sessions_player1_status (player1_id, status, session_id),
+    INDEX ix_game_sessions_player2_status (player2_id, status, session_id),
+    INDEX ix_game_sessions_finished_at (finished_at),
     FOREIGN KEY (player1_id) REFERENCES users (user_id),
     FOREIGN KEY (player2_id) REFERENCES users (user_id)
 );
@@ -0,0 +1,190 @@
+import random
+
+from sqlalchemy import select
+
+from models import GameStat
+
+# Ranking points for a win and a draw; tournament standings use the same scale.
+WIN_POINTS = 3
+DRAW_POINTS = 1
+
+
+def points(wins: int, draws: int):
+    return wins * WIN_POINTS + draws * DRAW_POINTS
+
+
+def rank_key(user_id: int, wins: int, losses: int, draws: int):
+    """Sort key: more points first, then more wins, fewer losses and the lower user id."""
+    return -points(wins, draws), -wins, losses, user_id
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        # width[level] is how many positions next[level] is ahead of this node.
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """A skip list of unique keys that also answers "what is the i-th key" and "what index is this key" in
+    O(log n), by storing on every link the number of positions it skips."""
+
+    MAX_LEVELS = 32
+
+    def __init__(self, rng=None):
+        self.head = _Node(None, self.MAX_LEVELS)
+        self.levels = 1
+        self.size = 0
+        self._random = (rng or random.Random()).random
+
+    def __len__(self):
+        return self.size
+
+    def _random_levels(self):
+        levels = 1
+        while levels < self.MAX_LEVELS and self._random() < 0.5:
+            levels += 1
+        return levels
+
+    def _predecessors(self, key):
+        chain = [self.head] * self.MAX_LEVELS
+        steps = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps = self._predecessors(key)
+        levels = self._random_levels()
+        if levels > self.levels:
+            for level in range(self.levels, levels):
+                self.head.width[level] = self.size + 1
+            self.levels = levels
+        node = _Node(key, levels)
+        distance = 0
+        for level in range(levels):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - distance
+            previous.width[level] = distance + 1
+            distance += steps[level]
+        for level in range(levels, self.levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._predecessors(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, key):
+        node = self.head
+        position = 0
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        if node.next[0] is None or node.next[0].key != key:
+            raise KeyError(key)
+        return position
+
+    def iter_from(self, index: int):
+        if index < 0 or index >= self.size:
+            return
+        node = self.head
+        remaining = index + 1
+        for level in reversed(range(self.levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def __getitem__(self, index: int):
+        for key in self.iter_from(index):
+            return key
+        raise IndexError(index)
+
+
+class Leaderboard:
+    """All players ordered by rank_key, kept up to date as results come in instead of sorting game_stats."""
+
+    def __init__(self):
+        self.entries = {}
+        self.index = IndexableSkipList()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, user_id: int, wins: int, losses: int, draws: int):
+        previous = self.entries.get(user_id)
+        if previous is not None:
+            self.index.remove(rank_key(user_id, *previous))
+        self.entries[user_id] = (wins, losses, draws)
+        self.index.insert(rank_key(user_id, wins, losses, draws))
+
+    def apply(self, deltas):
+        """Adds {user_id: [wins, losses, draws]} deltas, as produced by stats.result_deltas."""
+        for user_id, (wins, losses, draws) in deltas.items():
+            current_wins, current_losses, current_draws = self.entries.get(user_id, (0, 0, 0))
+            self.set(user_id, current_wins + wins, current_losses + losses, current_draws + draws)
+
+    def entry(self, user_id: int, rank: int):
+        wins, losses, draws = self.entries[user_id]
+        return {
+            "rank": rank,
+            "user_id": user_id,
+            "wins": wins,
+            "losses": losses,
+            "draws": draws,
+            "points": points(wins, draws),
+        }
+
+    def rank(self, user_id: int):
+        """Returns the player's entry with their 1-based rank, or None if they are not ranked."""
+        if user_id not in self.entries:
+            return None
+        return self.entry(user_id, self.index.index(rank_key(user_id, *self.entries[user_id])) + 1)
+
+    def page(self, limit: int, offset: int = 0):
+        rows = []
+        for rank, key in enumerate(self.index.iter_from(offset), start=offset + 1):
+            if len(rows) >= limit:
+                break
+            rows.append(self.entry(key[-1], rank))
+        return rows
+
+    async def load(self, session_factory, chunk_size: int = 1000):
+        """Rebuilds the ranking from game_stats, reading it in user_id order one chunk at a time."""
+        self.entries = {}
+        self.index = IndexableSkipList()
+        last_user_id = None
+        async with session_factory() as db:
+            while True:
+                query = select(GameStat.user_id, GameStat.wins, GameStat.losses, GameStat.draws)
+                if last_user_id is not None:
+                    query = query.where(GameStat.user_id > last_user_id)
+                result = await db.execute(query.order_by(GameStat.user_id).limit(chunk_size))
+                rows = result.all()
+                for user_id, wins, losses, draws in rows:
+                    self.set(user_id, wins, losses, draws)
+                if len(rows) < chunk_size:
+                    return len(self.entries)
+                last_user_id = rows[-1].user_id
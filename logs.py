@@ -0,0 +1,53 @@
+"""Structured logging through a queue, so log calls on the event loop never wait on stdout.
+
+Records are put on an in-memory queue by a QueueHandler and written as JSON lines by a QueueListener thread.
+Fields passed with `extra=` end up as keys of the JSON object.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+
+import config
+
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class QueueLogging:
+    def __init__(self, level: str = "INFO", handler: logging.Handler = None):
+        self.queue = queue.SimpleQueue()
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.handler = handler or logging.StreamHandler()
+        self.handler.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, self.handler, respect_handler_level=True)
+        self.level = level
+
+    def start(self):
+        root = logging.getLogger()
+        if self.queue_handler not in root.handlers:
+            root.addHandler(self.queue_handler)
+            root.setLevel(self.level)
+            self.listener.start()
+
+    def stop(self):
+        root = logging.getLogger()
+        if self.queue_handler in root.handlers:
+            root.removeHandler(self.queue_handler)
+            self.listener.stop()
+
+
+queue_logging = QueueLogging(config.LOG_LEVEL)
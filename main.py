@@ -1,18 +1,75 @@
+import asyncio
 import json
+from contextlib import asynccontextmanager
+from typing import List
 
-from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.middleware.cors import CORSMiddleware
 
+import archive
+import caching
+import config
 import crud
-import models
+import database
+import metrics
+import protocol
 import schemas
+import startup
 from database import SessionLocal, engine
+from connection import Connection
 from game import GameManager
+from hashing import HashingPoolSaturated, hasher
+from logs import queue_logging
+from profiler import SamplingProfiler
+from ratelimit import AdmissionController, AdmissionRejected, RateLimiter
 
-models.Base.metadata.create_all(bind=engine)
+readiness = startup.Readiness()
 
-app = FastAPI()
+
+async def warm_up():
+    """Everything a worker needs before it takes players; /readyz reports ready once it has run."""
+    await startup.wait_for_database(engine, config.DB_CONNECT_TIMEOUT)
+    await startup.check_schema(engine, config.SCHEMA_CHECK)
+    await startup.prewarm_pool(engine, config.DB_POOL_PREWARM)
+    game_manager.replay_events()
+    await game_manager.stats.recover(game_manager.determine_winner)
+    # Apply recovered results first so the leaderboard is built from up-to-date stats.
+    await game_manager.stats.flush()
+    await game_manager.leaderboard.load(SessionLocal, chunk_size=config.LEADERBOARD_LOAD_CHUNK)
+    if config.CACHE_PRELOAD:
+        async with SessionLocal() as db:
+            await caching.preload(db, game_manager.leaderboard.page(config.CACHE_PRELOAD))
+    await game_manager.start()
+    archiver.start()
+    readiness.mark_ready()
+
+
+def warm_up_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        readiness.mark_failed(task.exception())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The server listens while warming up, so /healthz answers at once and /readyz says when to send players.
+    queue_logging.start()
+    warming = asyncio.create_task(warm_up())
+    warming.add_done_callback(warm_up_done)
+    try:
+        yield
+    finally:
+        readiness.stopping = True
+        warming.cancel()
+        await asyncio.gather(warming, return_exceptions=True)
+        await archiver.stop()
+        await game_manager.stop()
+        await engine.dispose()
+        queue_logging.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,26 +80,54 @@ app.add_middleware(
 )
 
 
+@app.exception_handler(HashingPoolSaturated)
+async def hashing_pool_saturated_handler(request: Request, exc: HashingPoolSaturated):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, try again later"},
+        headers={"Retry-After": str(config.HASH_RETRY_AFTER)},
+    )
+
+
+connection_limiter = RateLimiter(config.ACTION_RATE, config.ACTION_BURST)
+ip_limiter = RateLimiter(config.IP_ACTION_RATE, config.IP_ACTION_BURST)
+auth_limiter = RateLimiter(config.AUTH_RATE, config.AUTH_BURST)
+admission = AdmissionController(config.MAX_INFLIGHT_ACTIONS, config.MAX_QUEUED_ACTIONS)
+
+
+def client_host(connection):
+    return connection.client.host if connection.client else None
+
+
+async def limit_auth(request: Request):
+    """Each /login/ and /users/ call costs a bcrypt run, so they are rate limited per client IP."""
+    host = client_host(request)
+    if not auth_limiter.allow(host):
+        raise HTTPException(status_code=429, detail="Too many requests",
+                            headers={"Retry-After": str(auth_limiter.retry_after(host))})
+
+
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-@app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_nickname(db, nickname=user.nickname)
+@app.post("/users/", response_model=schemas.User, dependencies=[Depends(limit_auth)])
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user_by_nickname(db, nickname=user.nickname)
     if db_user:
         raise HTTPException(status_code=400, detail="Nickname already registered")
-    return crud.create_user(db=db, user=user)
+    db_user = await crud.create_user(db=db, user=user)
+    await caching.invalidate_user(db_user.user_id, db_user.nickname)
+    # Ranked from the start, on every worker.
+    await game_manager.update_leaderboard({db_user.user_id: [0, 0, 0]})
+    return db_user
 
 
 @app.get("/users/{user_id}", response_model=schemas.UserResponse)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud.get_user(db, user_id=user_id)
+async def get_user(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_user = await caching.get_user(db, user_id=user_id)
     if db_user is None:
         return schemas.UserResponse(success=False, message="User not found")
     return schemas.UserResponse(
@@ -54,53 +139,225 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/stats/{user_id}", response_model=schemas.UserStatsResponse)
-async def get_user_stats(user_id: int, db: Session = Depends(get_db)):
-    db_user_stats = crud.get_user_stats(db, user_id=user_id)
+async def get_user_stats(user_id: int, db: AsyncSession = Depends(get_db)):
+    db_user_stats = await caching.get_user_stats(db, user_id=user_id)
     if db_user_stats is None:
         raise HTTPException(status_code=404, detail="User stats not found")
     return db_user_stats
 
 
-@app.post("/login/", response_model=schemas.UserResponse)
-async def login(login_data: schemas.Login, db: Session = Depends(get_db)):
-    user = crud.get_user_by_nickname(db, nickname=login_data.nickname)
+@app.get("/leaderboard", response_model=List[schemas.LeaderboardEntry])
+async def get_leaderboard(limit: int = Query(10, ge=1, le=config.LEADERBOARD_MAX_LIMIT), offset: int = Query(0, ge=0)):
+    return game_manager.leaderboard.page(limit, offset)
+
+
+@app.get("/leaderboard/rank/{user_id}", response_model=schemas.LeaderboardEntry)
+async def get_leaderboard_rank(user_id: int):
+    entry = game_manager.leaderboard.rank(user_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="User is not ranked")
+    return entry
+
+
+@app.get("/history/{user_id}")
+async def get_history(user_id: int, after: int = Query(0, ge=0)):
+    """Streams the player's archived sessions with session_id > `after` as JSON lines, oldest first."""
+    sessions = archive.iter_sessions(config.ARCHIVE_DIR, player_id=user_id, after_session_id=after)
+    return StreamingResponse((json.dumps(session) + "\n" for session in sessions), media_type="application/x-ndjson")
+
+
+@app.post("/login/", response_model=schemas.UserResponse, dependencies=[Depends(limit_auth)])
+async def login(login_data: schemas.Login, db: AsyncSession = Depends(get_db)):
+    user = await crud.get_user_by_nickname(db, nickname=login_data.nickname)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    if not crud.check_password(login_data.password, user.password):
+    if not await crud.check_password(login_data.password, user.password):
         raise HTTPException(status_code=403, detail="Incorrect password")
+    await crud.rehash_password_if_needed(db, user, login_data.password)
 
     return schemas.UserResponse(success=True, user_id=user.user_id, nickname=user.nickname, message="Login successful")
 
 
 game_manager = GameManager()
+archiver = archive.Archiver(SessionLocal, config.ARCHIVE_DIR, older_than=config.ARCHIVE_AFTER,
+                            chunk_size=config.ARCHIVE_CHUNK_SIZE, interval=config.ARCHIVE_INTERVAL)
+profiler = SamplingProfiler(interval=config.PROFILER_INTERVAL, focus="websocket_endpoint")
+
+metrics.Gauge("rps_active_sockets", "WebSocket connections held by this worker.",
+              lambda: len(game_manager.connections()))
+metrics.Gauge("rps_matchmaking_queue_length", "Players waiting for an opponent.",
+              lambda: game_manager.bus.queue_length())
+metrics.Gauge("rps_send_queue_frames", "Outbound frames queued on this worker's sockets.",
+              lambda: sum(len(connection.pending) for connection in game_manager.connections()))
+metrics.Gauge("rps_socket_frames", "Frames sent, dropped or coalesced by this worker's open sockets.",
+              lambda: {(result,): count for result, count in game_manager.connection_metrics()["frames"].items()},
+              ["result"])
+metrics.Gauge("rps_socket_send_latency_seconds", "Mean and worst queue-to-socket latency of the open sockets.",
+              lambda: {(stat,): value for stat, value in game_manager.connection_metrics()["send_latency"].items()},
+              ["stat"])
+metrics.Gauge("rps_socket_idle_seconds_max", "Longest a connected player has gone without sending anything.",
+              lambda: game_manager.connection_metrics()["max_idle"])
+metrics.Gauge("rps_parked_players", "Dropped players who can still resume.", lambda: game_manager.parked_count())
+metrics.Gauge("rps_active_matches", "Matches in progress on this worker.", lambda: len(game_manager.matches))
+metrics.Gauge("rps_spectators", "Spectator sockets subscribed to a channel.",
+              lambda: game_manager.broadcasts.subscribers())
+metrics.CallbackCounter("rps_spectator_updates_total", "Batched channel updates sent to spectators.",
+                        lambda: game_manager.broadcasts.updates)
+metrics.Gauge("rps_match_mailboxes", "Matches with messages waiting in their mailbox.",
+              lambda: len(game_manager.actors))
+metrics.Gauge("rps_stats_pending_games", "Finished games whose stats are not flushed yet.",
+              lambda: len(game_manager.stats.pending))
+metrics.Gauge("rps_hash_pool_in_flight", "Password hashing jobs running or queued.", lambda: hasher.pending)
+metrics.Gauge("rps_hash_pool_queue_depth", "Password hashing jobs waiting for a free worker.",
+              lambda: hasher.metrics()["queue_depth"])
+metrics.Gauge("rps_db_pool_connections", "Database pool connections by state.",
+              lambda: {(state,): database.pool_status()[state] for state in ("size", "overflow", "in_use", "waiting")},
+              ["state"])
+metrics.CallbackCounter("rps_db_pool_checkouts_total", "Connections checked out of the pool.",
+                        lambda: database.pool_metrics.checkouts)
+metrics.CallbackCounter("rps_db_pool_checkout_wait_seconds_total", "Time spent waiting for a pooled connection.",
+                        lambda: database.pool_metrics.total_wait)
+metrics.Gauge("rps_actions_in_flight", "WebSocket actions running or waiting for admission.",
+              lambda: {("running",): admission.in_flight, ("waiting",): admission.waiting}, ["state"])
+metrics.CallbackCounter("rps_actions_rejected_total", "WebSocket actions refused by admission control.",
+                        lambda: admission.rejected)
+metrics.CallbackCounter("rps_rate_limited_total", "Requests refused by a rate limit, by limit.",
+                        lambda: {("connection",): connection_limiter.limited, ("ip",): ip_limiter.limited,
+                                 ("auth",): auth_limiter.limited}, ["limit"])
+metrics.CallbackCounter("rps_archived_sessions_total", "Finished sessions moved to the archive.",
+                        lambda: archiver.archived)
+metrics.Gauge("rps_ready", "1 once this worker has warmed up and is not shutting down.",
+              lambda: int(readiness.status() == "ready"))
+metrics.CallbackCounter("rps_cache_requests_total", "Read-through cache lookups by result.",
+                        lambda: {(result,): count for result, count in caching.cache.metrics().items()}, ["result"])
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is serving and its warm-up has not failed."""
+    if readiness.error is not None:
+        return JSONResponse(status_code=503, content={"status": "failed", "error": readiness.error})
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: warmed up and not shutting down, so players may be routed here."""
+    status = readiness.status()
+    if status != "ready":
+        return JSONResponse(status_code=503, content={"status": status})
+    return {"status": status, "warm_up_seconds": readiness.warm_up_seconds}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/debug/profiler/start")
+async def start_profiler():
+    if not config.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    profiler.start()
+    return {"running": True, "interval": profiler.interval}
+
+
+@app.post("/debug/profiler/stop", response_class=PlainTextResponse)
+async def stop_profiler():
+    """Stops sampling and returns the collapsed stacks of the websocket_endpoint loop, ready for flamegraph.pl."""
+    if not config.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    folded = profiler.stop()
+    profiler.stacks.clear()
+    return PlainTextResponse(folded)
+
+
+@app.post("/channels/{channel}/feature/{session_id}")
+async def feature_match(channel: str, session_id: int):
+    if not config.CHANNEL_ADMIN_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if channel.startswith("match-"):
+        raise HTTPException(status_code=400, detail="Channel names starting with match- are reserved")
+    if not game_manager.feature(channel, session_id):
+        raise HTTPException(status_code=404, detail="No live match with that session_id on this worker")
+    return {"channel": channel, "session_id": session_id}
+
+
+actions = {
+    'start_game': lambda user_id, websocket, message, db: game_manager.start_game(user_id, websocket, db,
+                                                                                  message.get('best_of', 1)),
+    'cancel_search': lambda user_id, websocket, message, db: game_manager.cancel_search(user_id, websocket),
+    'make_move': lambda user_id, websocket, message, db: game_manager.make_move(user_id, message.get('move'), db),
+    'timeout': lambda user_id, websocket, message, db: game_manager.timeout_game(user_id, db),
+    'play_again': lambda user_id, websocket, message, db: game_manager.handle_play_again(user_id, db),
+    'accepted_play_again': lambda user_id, websocket, message, db: game_manager.handle_play_again_response(user_id, db),
+    'exit_game': lambda user_id, websocket, message, db: game_manager.exit_game(user_id, db),
+}
+# Actions that may query or write the database go through admission control; moves, timeouts and cancelled
+# searches are resolved in memory and are only rate limited.
+db_actions = {'start_game', 'play_again', 'accepted_play_again', 'exit_game'}
+
+
+async def run_action(handler, user_id, websocket, message):
+    # One short unit of work per action, so idle sockets never hold a pooled connection.
+    async with SessionLocal() as db:
+        await handler(user_id, websocket, message, db)
 
 
 @app.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str, db: Session = Depends(get_db)):
-    await game_manager.connect(websocket, user_id)
+async def websocket_endpoint(websocket: WebSocket, user_id: int):
+    if readiness.status() != "ready":
+        # 1013 Try Again Later: the client reconnects, by then to a ready worker.
+        await websocket.close(code=1013)
+        return
+    codec = await game_manager.connect(websocket, user_id, websocket.query_params.get("resume_token"))
+    resumable = True
+    host = client_host(websocket)
     try:
         while True:
-            data = await websocket.receive_text()
-            data_json = json.loads(data)
-
-            if data_json.get('action') == 'start_game':
-                await game_manager.start_game(user_id, websocket, db)
-            elif data_json.get('action') == 'cancel_search':
-                await game_manager.cancel_search(user_id, websocket)
-            elif data_json.get('action') == 'make_move':
-                move = data_json.get('move')
-                await game_manager.make_move(user_id, move, db)
-            elif data_json.get('action') == 'timeout':
-                await game_manager.timeout_game(user_id, db)
-            elif data_json.get('action') == 'play_again':
-                await game_manager.handle_play_again(user_id, db)
-            elif data_json.get('action') == 'accepted_play_again':
-                await game_manager.handle_play_again_response(user_id, db)
-            elif data_json.get('action') == 'exit_game':
-                await game_manager.exit_game(user_id, db)
-            elif data_json.get('action') == 'logout':
+            message = await protocol.receive(websocket, codec)
+            action = message.get('action')
+            game_manager.touch(user_id)
+
+            handler = actions.get(action)
+            if handler is not None:
+                if not (connection_limiter.allow(user_id) and ip_limiter.allow(host)):
+                    await game_manager.send(user_id, protocol.RATE_LIMITED)
+                    continue
+                if action not in db_actions:
+                    await run_action(handler, user_id, websocket, message)
+                    continue
+                try:
+                    await admission.run(run_action, handler, user_id, websocket, message)
+                except AdmissionRejected:
+                    await game_manager.send(user_id, protocol.SERVER_BUSY)
+            elif action == 'pong':
+                game_manager.record_pong(user_id, message.get('ts'))
+            elif action == 'logout':
+                resumable = False
                 break
     except WebSocketDisconnect:
-        await game_manager.disconnect(user_id)
+        pass
+    finally:
+        await game_manager.disconnect(user_id, websocket, resumable=resumable)
+
+
+@app.websocket("/ws/spectate/{channel}")
+async def spectate_endpoint(websocket: WebSocket, channel: str):
+    codec = await protocol.accept(websocket)
+    # A spectator that falls behind is disconnected rather than sent gaps; reconnecting gets a fresh snapshot.
+    connection = Connection(websocket, codec, max_pending=config.SPECTATOR_QUEUE_SIZE, policy='disconnect')
+    if not game_manager.broadcasts.subscribe(channel, connection):
+        connection.send(protocol.UNKNOWN_CHANNEL)
+        await connection.drain()
+        await connection.close(code=1008)
+        return
+    try:
+        while True:
+            # Spectators have nothing to say; reading only notices when they leave.
+            await protocol.receive(websocket, codec)
+    except WebSocketDisconnect:
+        pass
     finally:
-        await game_manager.disconnect(user_id)
+        game_manager.broadcasts.unsubscribe(channel, connection)
+        await connection.close()
@@ -0,0 +1,143 @@
+import math
+import time
+from collections import OrderedDict
+
+MAX_RTT_BUCKETS = 8
+
+
+class Ticket:
+    __slots__ = ('user_id', 'bucket', 'enqueued_at')
+
+    def __init__(self, user_id: int, bucket: tuple, enqueued_at: float):
+        self.user_id = user_id
+        self.bucket = bucket
+        self.enqueued_at = enqueued_at
+
+
+class MatchmakingQueue:
+    """FIFO matchmaking queue with O(1) enqueue, dequeue and cancel.
+
+    Waiting players are grouped into (win rate, RTT, series length) buckets, each an insertion-ordered dict,
+    and indexed by user_id. A player only matches within their own bucket at first; the accepted win rate and
+    RTT distance grows by one every `widen_after` seconds of waiting, while the series length must always be
+    the same. With bucketing disabled there is one FIFO bucket per series length.
+    """
+
+    def __init__(self, skill_buckets: int = 0, rtt_bucket_ms: int = 0, widen_after: float = 5.0,
+                 clock=time.monotonic):
+        self.skill_buckets = skill_buckets
+        self.rtt_bucket_ms = rtt_bucket_ms
+        self.widen_after = widen_after
+        self.clock = clock
+        self.buckets = {}
+        self.tickets = {}
+
+    def __len__(self):
+        return len(self.tickets)
+
+    def __contains__(self, user_id):
+        return user_id in self.tickets
+
+    def bucket_for(self, win_rate=None, rtt_ms=None, best_of: int = 1):
+        skill = 0
+        if self.skill_buckets:
+            if win_rate is None:
+                win_rate = 0.5
+            skill = min(int(win_rate * self.skill_buckets), self.skill_buckets - 1)
+        rtt = 0
+        if self.rtt_bucket_ms and rtt_ms is not None:
+            rtt = min(int(rtt_ms // self.rtt_bucket_ms), MAX_RTT_BUCKETS - 1)
+        return skill, rtt, best_of
+
+    def radius(self, ticket: Ticket, now: float):
+        if not self.widen_after:
+            return 0
+        return int((now - ticket.enqueued_at) // self.widen_after)
+
+    @staticmethod
+    def distance(bucket, other):
+        if bucket[2] != other[2]:
+            return math.inf
+        return max(abs(bucket[0] - other[0]), abs(bucket[1] - other[1]))
+
+    def enqueue(self, user_id: int, win_rate=None, rtt_ms=None, best_of: int = 1):
+        if user_id in self.tickets:
+            return False
+        bucket = self.bucket_for(win_rate, rtt_ms, best_of)
+        ticket = Ticket(user_id, bucket, self.clock())
+        self.tickets[user_id] = ticket
+        self.buckets.setdefault(bucket, OrderedDict())[user_id] = ticket
+        return True
+
+    def cancel(self, user_id: int):
+        ticket = self.tickets.pop(user_id, None)
+        if ticket is None:
+            return False
+        waiting = self.buckets[ticket.bucket]
+        del waiting[user_id]
+        if not waiting:
+            del self.buckets[ticket.bucket]
+        return True
+
+    def dequeue(self):
+        if not self.tickets:
+            return None
+        oldest = min((waiting[next(iter(waiting))] for waiting in self.buckets.values()),
+                     key=lambda ticket: ticket.enqueued_at)
+        self.cancel(oldest.user_id)
+        return oldest.user_id
+
+    def find_opponent(self, user_id: int, win_rate=None, rtt_ms=None, best_of: int = 1):
+        """Pops and returns the best waiting opponent for user_id, or None if nobody is acceptable.
+
+        Only the head (longest waiting ticket) of each bucket is considered, so the cost depends on the
+        number of buckets and not on the number of queued players.
+        """
+        bucket = self.bucket_for(win_rate, rtt_ms, best_of)
+        now = self.clock()
+        best = None
+        for other_bucket, waiting in self.buckets.items():
+            ticket = waiting[next(iter(waiting))]
+            if ticket.user_id == user_id:
+                continue
+            if self.distance(bucket, other_bucket) > self.radius(ticket, now):
+                continue
+            if best is None or ticket.enqueued_at < best.enqueued_at:
+                best = ticket
+        if best is None:
+            return None
+        self.cancel(best.user_id)
+        return best.user_id
+
+    def match(self, user_id: int, win_rate=None, rtt_ms=None, best_of: int = 1):
+        """Returns an opponent for user_id, or queues user_id and returns None."""
+        if user_id in self.tickets:
+            return None
+        opponent_id = self.find_opponent(user_id, win_rate, rtt_ms, best_of)
+        if opponent_id is None:
+            self.enqueue(user_id, win_rate, rtt_ms, best_of)
+        return opponent_id
+
+    def pair_waiting(self):
+        """Pairs players whose widened bucket constraints now overlap. Returns a list of
+        (user_id, user_id, best_of)."""
+        now = self.clock()
+        pairs = []
+        heads = True
+        while heads:
+            heads = sorted((waiting[next(iter(waiting))] for waiting in self.buckets.values()),
+                           key=lambda ticket: ticket.enqueued_at)
+            pair = None
+            for index, ticket in enumerate(heads):
+                for other in heads[index + 1:]:
+                    if self.distance(ticket.bucket, other.bucket) <= self.radius(ticket, now):
+                        pair = ticket, other
+                        break
+                if pair:
+                    break
+            if pair is None:
+                break
+            self.cancel(pair[0].user_id)
+            self.cancel(pair[1].user_id)
+            pairs.append((pair[0].user_id, pair[1].user_id, pair[0].bucket[2]))
+        return pairs
@@ -0,0 +1,7 @@
+-- Write-behind GameStat updates: per-session idempotency replaces game_stats.last_game_session_id.
+ALTER TABLE game_sessions ADD COLUMN stats_applied BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Results finished before this migration were already counted by the per-game path.
+UPDATE game_sessions SET stats_applied = TRUE WHERE status = 'completed';
+
+ALTER TABLE game_stats DROP COLUMN last_game_session_id;
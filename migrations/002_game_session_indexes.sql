@@ -0,0 +1,3 @@
+-- Per-player session lookups: WHERE playerN_id = ? AND status = ? ORDER BY session_id DESC LIMIT 1.
+CREATE INDEX ix_game_sessions_player1_status ON game_sessions (player1_id, status, session_id);
+CREATE INDEX ix_game_sessions_player2_status ON game_sessions (player2_id, status, session_id);
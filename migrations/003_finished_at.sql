@@ -0,0 +1,7 @@
+-- Archiving: sessions finished more than ARCHIVE_AFTER seconds ago are moved out of game_sessions.
+ALTER TABLE game_sessions ADD COLUMN finished_at DATETIME NULL;
+
+-- Sessions that finished before this migration count as finished now.
+UPDATE game_sessions SET finished_at = UTC_TIMESTAMP() WHERE status IN ('completed', 'timeout');
+
+CREATE INDEX ix_game_sessions_finished_at ON game_sessions (finished_at);
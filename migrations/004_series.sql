@@ -0,0 +1,3 @@
+-- Best-of-N series: one session per series, with its rounds written when it ends.
+ALTER TABLE game_sessions ADD COLUMN best_of INT NOT NULL DEFAULT 1;
+ALTER TABLE game_sessions ADD COLUMN rounds VARCHAR(255) NULL;
@@ -0,0 +1,2 @@
+-- A round is stored as "move1:move2," (up to 18 characters), so VARCHAR(255) only held 14 rounds of a series.
+ALTER TABLE game_sessions MODIFY rounds TEXT NULL;
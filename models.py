@@ -1,8 +1,7 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Enum
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import Boolean, Column, DateTime, Integer, String, Text, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 
-Base = declarative_base()
+from database import Base
 
 
 class User(Base):
@@ -25,6 +24,18 @@ class GameSession(Base):
     player1_move = Column(Enum('rock', 'paper', 'scissors'))
     player2_move = Column(Enum('rock', 'paper', 'scissors'))
     status = Column(Enum('waiting', 'completed', 'timeout', name='game_statuses'), default='waiting')
+    stats_applied = Column(Boolean, nullable=False, default=False)
+    # A best-of-N series is one session; its rounds are stored as "move1:move2,..." when it ends.
+    best_of = Column(Integer, nullable=False, default=1)
+    rounds = Column(Text)
+    # UTC; set when the session is completed or times out, and used to archive it later.
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        Index('ix_game_sessions_player1_status', 'player1_id', 'status', 'session_id'),
+        Index('ix_game_sessions_player2_status', 'player2_id', 'status', 'session_id'),
+        Index('ix_game_sessions_finished_at', 'finished_at'),
+    )
 
 
 class GameStat(Base):
@@ -33,7 +44,6 @@ class GameStat(Base):
     wins: int = Column(Integer, default=0)
     losses: int = Column(Integer, default=0)
     draws: int = Column(Integer, default=0)
-    last_game_session_id: int = Column(Integer, nullable=True)
 
     user = relationship('User', back_populates='stats')
 
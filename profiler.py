@@ -0,0 +1,67 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """Samples the stack of one thread (the event loop) from a background thread.
+
+    Stacks are counted in the collapsed "frame;frame;frame count" format read by flamegraph.pl and speedscope.
+    With `focus`, only samples passing through a frame of that function are kept, trimmed to start there.
+    """
+
+    def __init__(self, interval: float = 0.005, focus: str = None):
+        self.interval = interval
+        self.focus = focus
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._sampler = None
+
+    @property
+    def running(self):
+        return self._sampler is not None
+
+    def start(self, thread_id: int = None):
+        if self.running:
+            return
+        self._thread_id = thread_id or threading.get_ident()
+        self._stop.clear()
+        self.started_at = time.monotonic()
+        self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        if self.running:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        return self.folded()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.sample(frame)
+
+    def sample(self, frame):
+        self.samples += 1
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            if self.focus is not None and code.co_name == self.focus:
+                break
+            frame = frame.f_back
+        else:
+            if self.focus is not None:
+                return
+        stack.reverse()
+        self.stacks[";".join(stack)] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
@@ -0,0 +1,102 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; without it only the JSON protocol is offered.
+    msgpack = None
+
+
+class Constant:
+    """A message that never changes. Each codec encodes it once and reuses the frame."""
+    __slots__ = ('message', 'frames')
+
+    def __init__(self, message):
+        self.message = message
+        self.frames = {}
+
+
+class JsonCodec:
+    name = "rps.json"
+    binary = False
+
+    def encode(self, message):
+        if isinstance(message, Constant):
+            frame = message.frames.get(self.name)
+            if frame is None:
+                frame = message.frames[self.name] = self.encode_message(message.message)
+            return frame
+        return self.encode_message(message)
+
+    def encode_message(self, message):
+        # Plain strings have always been sent as-is, e.g. "Search cancelled".
+        if isinstance(message, str):
+            return message
+        return json.dumps(message)
+
+    def decode(self, frame):
+        return json.loads(frame)
+
+
+class MsgpackCodec(JsonCodec):
+    name = "rps.msgpack"
+    binary = True
+
+    def encode_message(self, message):
+        return msgpack.packb(message)
+
+    def decode(self, frame):
+        return msgpack.unpackb(frame)
+
+
+JSON = JsonCodec()
+CODECS = {JSON.name: JSON}
+if msgpack is not None:
+    CODECS[MsgpackCodec.name] = MsgpackCodec()
+
+
+def negotiate(requested_subprotocols):
+    """Returns the first codec the client offered that we support, falling back to JSON."""
+    for subprotocol in requested_subprotocols:
+        codec = CODECS.get(subprotocol)
+        if codec is not None:
+            return codec
+    return JSON
+
+
+async def accept(websocket):
+    """Accepts the socket with the codec it negotiated and returns the codec."""
+    requested = websocket.scope.get("subprotocols", [])
+    codec = negotiate(requested)
+    await websocket.accept(subprotocol=codec.name if codec.name in requested else None)
+    return codec
+
+
+def raw(message):
+    return message.message if isinstance(message, Constant) else message
+
+
+async def send_frame(websocket, codec, frame):
+    if codec.binary:
+        await websocket.send_bytes(frame)
+    else:
+        await websocket.send_text(frame)
+
+
+async def receive(websocket, codec):
+    if codec.binary:
+        return codec.decode(await websocket.receive_bytes())
+    return codec.decode(await websocket.receive_text())
+
+
+SEARCH_CANCELLED = Constant("Search cancelled")
+SEARCH_TIMEOUT = Constant({"action": "search_timeout"})
+GAME_OVER = Constant({"action": "game_over"})
+PLAY_AGAIN_ACCEPTED = Constant({"action": "play_again_accepted"})
+PLAY_AGAIN_EXPIRED = Constant({"action": "play_again_expired"})
+NO_ACTIVE_SESSION = Constant({"error": "No active game session"})
+INVALID_MOVE = Constant({"error": "Invalid move"})
+INVALID_SERIES = Constant({"error": "Invalid series length"})
+DRAW_RESULT = Constant({"action": "game_result", "winner": "None", "result": "Draw"})
+RATE_LIMITED = Constant({"error": "Too many requests"})
+SERVER_BUSY = Constant({"error": "Server is busy, try again later"})
+UNKNOWN_CHANNEL = Constant({"error": "Unknown channel"})
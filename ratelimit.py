@@ -0,0 +1,98 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """Token buckets of `burst` tokens refilled at `rate` per second, one per key (a user_id or a client IP).
+
+    A bucket is two floats and is only refilled when it is checked, so there is no timer per key. The least
+    recently used buckets are evicted beyond `max_keys`; by then they are usually full again, which is the
+    same as having no bucket. A rate of 0 disables the limiter.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self.buckets = OrderedDict()
+        self.allowed = 0
+        self.limited = 0
+
+    def _refill(self, key, now: float):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.burst, now)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        return bucket
+
+    def allow(self, key, cost: float = 1.0):
+        if not self.rate:
+            return True
+        bucket = self._refill(key, self.clock())
+        if bucket.tokens < cost:
+            self.limited += 1
+            return False
+        bucket.tokens -= cost
+        self.allowed += 1
+        return True
+
+    def retry_after(self, key, cost: float = 1.0):
+        """Whole seconds until `key` has `cost` tokens again."""
+        if not self.rate:
+            return 0
+        bucket = self._refill(key, self.clock())
+        return max(0, math.ceil((cost - bucket.tokens) / self.rate))
+
+
+class AdmissionController:
+    """Caps how many actions run at once. Up to `max_waiting` more wait for a slot; beyond that `run`
+    raises AdmissionRejected straight away, so overload is answered with an error rather than growing
+    queues in front of the connection pool. A `max_in_flight` of 0 admits everything."""
+
+    def __init__(self, max_in_flight: int, max_waiting: int):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+
+    async def run(self, func, *args):
+        if self._semaphore is None:
+            return await func(*args)
+        if self.in_flight + self.waiting >= self.max_in_flight + self.max_waiting:
+            self.rejected += 1
+            raise AdmissionRejected()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            return await func(*args)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
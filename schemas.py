@@ -41,6 +41,15 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class LeaderboardEntry(BaseModel):
+    rank: int
+    user_id: int
+    wins: int
+    losses: int
+    draws: int
+    points: int
+
+
 class UserStatsResponse(BaseModel):
     user_id: int
     wins: int
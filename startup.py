@@ -0,0 +1,106 @@
+"""Boot steps for main's lifespan: waiting for the database, warming its pool and checking the schema.
+
+The server starts listening at once and serves /healthz; /readyz only reports ready once these steps and the
+state loading in main have finished, so a load balancer never routes a player to a cold worker.
+"""
+import asyncio
+import logging
+import time
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CHECKS = ("off", "verify", "create")
+
+
+class Readiness:
+    """What /healthz and /readyz report. Not ready until warm-up is done, and not again once shutdown starts."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started_at = clock()
+        self.ready = False
+        self.stopping = False
+        self.error = None
+        self.warm_up_seconds = None
+
+    def mark_ready(self):
+        self.warm_up_seconds = self.clock() - self.started_at
+        self.ready = True
+        logger.info("Ready", extra={"warm_up_seconds": round(self.warm_up_seconds, 3)})
+
+    def mark_failed(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+        logger.error("Warm-up failed", exc_info=error)
+
+    def status(self):
+        if self.error is not None:
+            return "failed"
+        if self.stopping:
+            return "stopping"
+        return "ready" if self.ready else "starting"
+
+
+async def wait_for_database(engine, timeout: float, interval: float = 0.5):
+    """Retries `SELECT 1` until the database answers, raising the last error once `timeout` seconds have passed."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return
+        except (OSError, DBAPIError) as exc:
+            if time.monotonic() >= deadline:
+                raise
+            logger.info("Waiting for the database", extra={"error": str(exc)})
+            await asyncio.sleep(interval)
+
+
+async def prewarm_pool(engine, connections: int):
+    """Opens up to `connections` pooled connections at once and checks them back in, so the first requests do not
+    pay for connecting. Returns the number opened."""
+    pool = engine.pool
+    if hasattr(pool, "size"):
+        connections = min(connections, pool.size())
+    else:
+        # Single-connection pools, e.g. in-memory SQLite.
+        connections = min(connections, 1)
+    if connections <= 0:
+        return 0
+    opened = [engine.connect() for _ in range(connections)]
+    try:
+        await asyncio.gather(*(conn.start() for conn in opened))
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in opened))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in opened), return_exceptions=True)
+    return connections
+
+
+def missing_schema(connection):
+    """Tables and columns of the models that the database does not have."""
+    inspector = inspect(connection)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.append(table.name)
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        missing.extend(f"{table.name}.{column.name}" for column in table.columns if column.name not in columns)
+    return missing
+
+
+async def check_schema(engine, mode: str):
+    if mode not in SCHEMA_CHECKS:
+        raise ValueError(f"SCHEMA_CHECK must be one of {', '.join(SCHEMA_CHECKS)}, not {mode!r}")
+    if mode == "off":
+        return
+    async with engine.begin() as conn:
+        if mode == "create":
+            await conn.run_sync(Base.metadata.create_all)
+        missing = await conn.run_sync(missing_schema)
+    if missing:
+        raise RuntimeError(f"Database schema is missing {', '.join(missing)}; apply init.sql and migrations/")
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from sqlalchemy import bindparam, select, update
+
+from models import GameSession, GameStat
+
+logger = logging.getLogger(__name__)
+
+game_stats = GameStat.__table__
+game_sessions = GameSession.__table__
+
+increment_stats = update(game_stats).where(game_stats.c.user_id == bindparam('b_user_id')).values(
+    wins=game_stats.c.wins + bindparam('b_wins'),
+    losses=game_stats.c.losses + bindparam('b_losses'),
+    draws=game_stats.c.draws + bindparam('b_draws'),
+)
+
+complete_session = update(game_sessions).where(
+    game_sessions.c.session_id == bindparam('b_session_id'),
+    game_sessions.c.stats_applied.is_(False),
+).values(
+    player1_move=bindparam('b_player1_move'),
+    player2_move=bindparam('b_player2_move'),
+    rounds=bindparam('b_rounds'),
+    status='completed',
+    finished_at=bindparam('b_finished_at'),
+)
+set_session_status = update(game_sessions).where(game_sessions.c.session_id == bindparam('b_session_id')).values(
+    status=bindparam('b_status'), finished_at=bindparam('b_finished_at')
+)
+
+
+def result_deltas(player1_id: int, player2_id: int, winner_id):
+    """Returns {user_id: [wins, losses, draws]} for one finished game."""
+    if winner_id is None:
+        return {player1_id: [0, 0, 1], player2_id: [0, 0, 1]}
+    loser_id = player2_id if winner_id == player1_id else player1_id
+    return {winner_id: [1, 0, 0], loser_id: [0, 1, 0]}
+
+
+def encode_rounds(rounds):
+    """A series' rounds as stored in game_sessions.rounds, e.g. "rock:paper,paper:paper"."""
+    return ",".join(f"{move1}:{move2}" for move1, move2 in rounds) if rounds else None
+
+
+def decode_rounds(rounds: str):
+    return [tuple(moves.split(":")) for moves in rounds.split(",")] if rounds else []
+
+
+def series_winner(determine_winner, player1_id, player2_id, rounds):
+    """The player who won more of the rounds, or None for a tied series."""
+    score = {player1_id: 0, player2_id: 0, None: 0}
+    for move1, move2 in rounds:
+        score[determine_winner(player1_id, move1, player2_id, move2)['winner']] += 1
+    if score[player1_id] == score[player2_id]:
+        return None
+    return player1_id if score[player1_id] > score[player2_id] else player2_id
+
+
+class StatsAggregator:
+    """Write-behind projection of match events onto game_sessions and game_stats.
+
+    The match event log is the durable record of a result; it is appended before players are notified. Final
+    moves and statuses are buffered per session_id, together with GameStat deltas, and flushed as one
+    transaction: batched session updates, then one `wins = wins + :d` update per player and setting
+    stats_applied. Sessions already applied are skipped, so applying a session twice is a no-op. After a crash
+    the buffer is rebuilt by replaying the event log past the last flushed sequence number (reported through
+    `on_flushed`), and `recover` picks up completed sessions that were written directly to the database.
+    Results logged but not buffered yet, while they wait for fsync, are marked with `expect`, and no flush
+    reports a sequence number at or past one of them.
+    """
+
+    def __init__(self, session_factory, flush_interval: float = 1.0, max_pending: int = 500, on_applied=None,
+                 on_flushed=None):
+        self.session_factory = session_factory
+        self.on_applied = on_applied
+        self.on_flushed = on_flushed
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = {}
+        self.session_updates = {}
+        self.pending_seq = 0
+        self.expected = set()
+        self.flushed_games = 0
+        self.flushes = 0
+        self._flush_requested = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def add(self, session_id: int, player1_id: int, player2_id: int, winner_id, moves=None, seq: int = None,
+            rounds=None):
+        """Buffers a finished game. `moves` are the final (player1_move, player2_move) still to be written and
+        `rounds` every round of a series; a series counts as one game for its winner."""
+        self.expected.discard(seq)
+        if session_id in self.pending:
+            return False
+        self.pending[session_id] = result_deltas(player1_id, player2_id, winner_id)
+        if moves is not None:
+            self.session_updates[session_id] = {'b_player1_move': moves[0], 'b_player2_move': moves[1],
+                                                'b_rounds': encode_rounds(rounds)}
+        self._track(seq)
+        return True
+
+    def expect(self, seq: int):
+        """Marks the logged result `seq` as on its way to `add`."""
+        self.expected.add(seq)
+
+    def forget(self, seq: int):
+        """Drops a result marked with `expect` that will not be added after all."""
+        self.expected.discard(seq)
+
+    def update_session(self, session_id: int, status: str, seq: int = None):
+        """Buffers a status change for a session that ended without a result, e.g. a timeout."""
+        self.session_updates[session_id] = {'b_status': status}
+        self._track(seq)
+
+    def _track(self, seq):
+        if seq is not None:
+            self.pending_seq = max(self.pending_seq, seq)
+        if len(self.pending) + len(self.session_updates) >= self.max_pending:
+            self._flush_requested.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending and not self.session_updates:
+                return 0
+            batch, self.pending = self.pending, {}
+            updates, self.session_updates = self.session_updates, {}
+            seq = self.pending_seq
+            if self.expected:
+                seq = min(seq, min(self.expected) - 1)
+            try:
+                applied = await self._apply(batch, updates)
+            except Exception:
+                batch.update(self.pending)
+                self.pending = batch
+                updates.update(self.session_updates)
+                self.session_updates = updates
+                raise
+            self.flushed_games += applied
+            self.flushes += 1
+        if self.on_flushed is not None and seq:
+            await self.on_flushed(seq)
+        return applied
+
+    async def _apply(self, batch: dict, updates: dict):
+        async with self.session_factory() as db:
+            # Naive UTC, like the archiver's cutoff.
+            finished_at = datetime.now(timezone.utc).replace(tzinfo=None)
+            completed = [{'b_session_id': session_id, 'b_finished_at': finished_at, **values}
+                         for session_id, values in updates.items() if 'b_status' not in values]
+            ended = [{'b_session_id': session_id, 'b_finished_at': finished_at, **values}
+                     for session_id, values in updates.items() if 'b_status' in values]
+            if completed:
+                await db.execute(complete_session, completed)
+            if ended:
+                await db.execute(set_session_status, ended)
+            if not batch:
+                await db.commit()
+                return 0
+            result = await db.execute(select(GameSession.session_id).where(
+                GameSession.session_id.in_(batch),
+                GameSession.stats_applied.is_(False),
+            ).with_for_update())
+            session_ids = result.scalars().all()
+            if not session_ids:
+                await db.commit()
+                return 0
+
+            totals = {}
+            for session_id in session_ids:
+                for user_id, deltas in batch[session_id].items():
+                    total = totals.setdefault(user_id, [0, 0, 0])
+                    for index, delta in enumerate(deltas):
+                        total[index] += delta
+
+            await db.execute(increment_stats, [
+                {'b_user_id': user_id, 'b_wins': wins, 'b_losses': losses, 'b_draws': draws}
+                for user_id, (wins, losses, draws) in totals.items()
+            ])
+            await db.execute(update(GameSession).where(GameSession.session_id.in_(session_ids)).values(
+                stats_applied=True
+            ))
+            await db.commit()
+
+        if self.on_applied is not None:
+            await self.on_applied(totals.keys())
+        return len(session_ids)
+
+    async def recover(self, determine_winner):
+        async with self.session_factory() as db:
+            result = await db.execute(select(GameSession).where(
+                GameSession.status == 'completed',
+                GameSession.stats_applied.is_(False),
+                GameSession.player1_move.is_not(None),
+                GameSession.player2_move.is_not(None),
+            ))
+            for session in result.scalars():
+                if session.rounds:
+                    winner_id = series_winner(determine_winner, session.player1_id, session.player2_id,
+                                              decode_rounds(session.rounds))
+                else:
+                    winner_id = determine_winner(session.player1_id, session.player1_move,
+                                                 session.player2_id, session.player2_move)['winner']
+                self.add(session.session_id, session.player1_id, session.player2_id, winner_id)
+        return len(self.pending)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error flushing game stats", extra={"pending": len(self.pending)})
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+import pytest
+import pytest_asyncio
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+# Run the suite against a local SQLite file unless a real database is configured.
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///./test.db")
+os.environ.setdefault("EVENT_LOG_DIR", tempfile.mkdtemp(prefix="rps-events-"))
+os.environ.setdefault("ARCHIVE_DIR", tempfile.mkdtemp(prefix="rps-archive-"))
+os.environ.setdefault("SCHEMA_CHECK", "create")
+
+import models  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest_asyncio.fixture
+async def session_factory():
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+    _session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with _session_factory() as session:
+        for nickname in ("player1", "player2"):
+            user = models.User(nickname=nickname, password="password")
+            session.add(user)
+            await session.commit()
+            session.add(models.GameStat(user_id=user.user_id, wins=0, losses=0, draws=0))
+        await session.commit()
+    yield _session_factory
+    await engine.dispose()
+
+
+@pytest_asyncio.fixture
+async def db_session(session_factory):
+    async with session_factory() as session:
+        yield session
@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock
+
+from actors import ActorPool
+from connection import Connection
+from game import GameManager
+
+
+@pytest.mark.asyncio
+async def test_messages_for_a_key_run_in_order_and_keys_run_concurrently():
+    pool = ActorPool(shards=4)
+    pool.start()
+    log = []
+    second_ran = asyncio.Event()
+
+    async def step(key, value):
+        log.append((key, value))
+        if key == 2:
+            second_ran.set()
+        elif value == 0:
+            # Holds match 1's mailbox until match 2 has run on another shard.
+            await asyncio.wait_for(second_ran.wait(), 1)
+        log.append((key, value, "done"))
+        return value
+
+    results = await asyncio.gather(pool.call(1, step, 1, 0), pool.call(1, step, 1, 1), pool.call(2, step, 2, 0))
+    await pool.stop()
+
+    assert results == [0, 1, 0]
+    assert [entry for entry in log if entry[0] == 1] == [(1, 0), (1, 0, "done"), (1, 1), (1, 1, "done")]
+    assert log.index((2, 0, "done")) < log.index((1, 0, "done"))
+    assert len(pool) == 0
+    assert pool.processed == 3
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_the_caller_and_the_mailbox_keeps_going():
+    pool = ActorPool(shards=1)
+    pool.start()
+
+    async def fail():
+        raise ValueError("bad move")
+
+    async def ok():
+        return "ok"
+
+    with pytest.raises(ValueError):
+        await pool.call(1, fail)
+    assert await pool.call(1, ok) == "ok"
+    await pool.stop()
+    # Stopped pools run messages directly.
+    assert await pool.call(1, ok) == "ok"
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_handler_does_not_stop_its_shard():
+    pool = ActorPool(shards=1)
+    pool.start()
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    async def ok():
+        return "ok"
+
+    with pytest.raises(asyncio.CancelledError):
+        await pool.call(1, cancelled)
+    assert await asyncio.wait_for(pool.call(2, ok), 1) == "ok"
+    await pool.stop()
+
+
+@pytest.mark.asyncio
+async def test_mailbox_handlers_leave_bus_calls_to_the_caller(session_factory, db_session):
+    manager = GameManager(session_factory)
+    manager.attach(1, Connection(AsyncMock()))
+    manager.attach(2, Connection(AsyncMock()))
+    manager.actors.start()
+    match = await manager.create_session(1, 2, db_session)
+    manager.bus = AsyncMock(wraps=manager.bus)
+
+    assert await manager.actors.call(match.session_id, manager.end_match, match, 'completed') == [1, 2]
+    manager.bus.clear_match_worker.assert_not_called()
+    assert await manager.actors.call(match.session_id, manager.end_match, match, 'completed') is None
+    await manager.actors.stop()
+    for connection in manager.connections():
+        await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_moves_and_exit_end_a_match_once(session_factory, db_session):
+    manager = GameManager(session_factory)
+    manager.attach(1, Connection(AsyncMock()))
+    manager.attach(2, Connection(AsyncMock()))
+    manager.actors.start()
+    match = await manager.create_session(1, 2, db_session)
+
+    await asyncio.gather(manager.make_move(1, "rock", db_session), manager.exit_game(2, db_session),
+                         manager.make_move(2, "paper", db_session))
+    await manager.actors.stop()
+
+    endings = [event["type"] for event in manager.events.pending if event["type"] in ("result", "exit")]
+    assert endings == ["exit"]
+    assert match.player2_move is None
+    assert manager.matches == {}
+    for connection in manager.connections():
+        await connection.close()
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import models
+from archive import Archiver, archive_files, iter_sessions
+from stats import StatsAggregator
+
+
+async def add_sessions(db_session, sessions):
+    for values in sessions:
+        db_session.add(models.GameSession(player1_id=1, player2_id=2, **values))
+    await db_session.commit()
+
+
+@pytest.mark.asyncio
+async def test_old_finished_sessions_are_moved_in_chunks(tmp_path, session_factory, db_session):
+    old = datetime.utcnow() - timedelta(days=2)
+    await add_sessions(db_session, [
+        {"status": "completed", "player1_move": "rock", "player2_move": "paper", "stats_applied": True,
+         "finished_at": old},
+        {"status": "timeout", "finished_at": old},
+        {"status": "completed", "finished_at": old},
+        # Not counted in game_stats yet.
+        {"status": "completed", "player1_move": "rock", "player2_move": "rock", "finished_at": old},
+        {"status": "timeout", "finished_at": datetime.utcnow()},
+        {"status": "waiting"},
+    ])
+    archiver = Archiver(session_factory, str(tmp_path), older_than=86400, chunk_size=2, pause=0)
+
+    assert await archiver.archive_once() == 3
+    assert len(archive_files(str(tmp_path))) == 2
+    remaining = await db_session.execute(select(models.GameSession.session_id).order_by(models.GameSession.session_id))
+    assert remaining.scalars().all() == [4, 5, 6]
+
+    archived = list(iter_sessions(str(tmp_path)))
+    assert [session["session_id"] for session in archived] == [1, 2, 3]
+    assert archived[0]["player1_move"] == "rock"
+    assert archived[0]["finished_at"] == old.isoformat()
+    assert [session["session_id"] for session in iter_sessions(str(tmp_path), after_session_id=2)] == [3]
+    assert list(iter_sessions(str(tmp_path), player_id=3)) == []
+    assert await archiver.archive_once() == 0
+
+
+@pytest.mark.asyncio
+async def test_flushed_sessions_get_a_finish_time(session_factory, db_session):
+    await add_sessions(db_session, [{"status": "waiting"}, {"status": "waiting"}])
+    stats = StatsAggregator(session_factory)
+    stats.add(1, 1, 2, 1, moves=("rock", "scissors"))
+    stats.update_session(2, "timeout")
+
+    assert await stats.flush() == 1
+
+    db_session.expire_all()
+    finished = await db_session.execute(select(models.GameSession.finished_at))
+    assert all(datetime.utcnow() - finished_at < timedelta(minutes=1) for finished_at in finished.scalars())
+
+
+@pytest.mark.asyncio
+async def test_sessions_archived_out_of_id_order_stream_in_order(tmp_path, session_factory, db_session):
+    old = datetime.utcnow() - timedelta(days=2)
+    await add_sessions(db_session, [{"status": "timeout", "finished_at": old} for _ in range(6)])
+    await db_session.execute(models.GameSession.__table__.update().where(
+        models.GameSession.session_id == 4).values(finished_at=datetime.utcnow()))
+    await db_session.commit()
+    archiver = Archiver(session_factory, str(tmp_path), older_than=86400, pause=0)
+    assert await archiver.archive_once() == 5
+    await db_session.execute(models.GameSession.__table__.update().values(finished_at=old))
+    await db_session.commit()
+    assert await archiver.archive_once() == 1
+
+    assert [(first, last) for first, last, _ in archive_files(str(tmp_path))] == [(1, 6), (4, 4)]
+    assert [session["session_id"] for session in iter_sessions(str(tmp_path))] == [1, 2, 3, 4, 5, 6]
+    assert [session["session_id"] for session in iter_sessions(str(tmp_path), after_session_id=4)] == [5, 6]
+    assert [session["session_id"] for session in iter_sessions(str(tmp_path), after_session_id=3)] == [4, 5, 6]
@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+
+import protocol
+from broadcast import BroadcastHub
+from connection import Connection
+from game import GameManager
+
+
+class Viewer:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, frame):
+        self.frames.append(frame)
+
+    async def close(self, code=1000):
+        pass
+
+
+async def received(connection):
+    await connection.drain()
+    return [json.loads(frame) for frame in connection.websocket.frames]
+
+
+@pytest.mark.asyncio
+async def test_updates_are_batched_per_tick_and_encoded_once(monkeypatch):
+    encoded = []
+    encode_message = protocol.JSON.encode_message
+    monkeypatch.setattr(protocol.JSON, "encode_message",
+                        lambda message: encoded.append(message) or encode_message(message))
+    hub = BroadcastHub()
+    viewers = [Connection(Viewer()) for _ in range(1000)]
+    for viewer in viewers:
+        assert hub.subscribe("final", viewer)
+    assert len(encoded) == 1
+
+    hub.publish("final", {"player1_moved": True})
+    hub.publish("final", {"player2_moved": True})
+    await asyncio.sleep(0)
+
+    assert len(encoded) == 2
+    assert hub.updates == 1
+    assert await received(viewers[-1]) == [
+        {"action": "spectate_snapshot", "channel": "final", "version": 0, "state": {}},
+        {"action": "spectate_update", "channel": "final", "version": 1,
+         "deltas": [{"player1_moved": True}, {"player2_moved": True}]},
+    ]
+    for viewer in viewers:
+        hub.unsubscribe("final", viewer)
+        await viewer.close()
+    assert hub.channels == {}
+
+
+@pytest.mark.asyncio
+async def test_late_joiner_gets_snapshot_then_deltas():
+    hub = BroadcastHub()
+    early, late = Connection(Viewer()), Connection(Viewer())
+    hub.subscribe("final", early)
+    hub.publish("final", {"status": "playing"})
+    # Joins before the batch goes out, so its snapshot must not contain it yet.
+    hub.subscribe("final", late)
+    await asyncio.sleep(0)
+    hub.publish("final", {"player1_moved": True})
+    await asyncio.sleep(0)
+
+    messages = await received(late)
+    assert messages[0]["state"] == {} and messages[0]["version"] == 0
+    assert [message["version"] for message in messages[1:]] == [1, 2]
+    state = dict(messages[0]["state"])
+    for message in messages[1:]:
+        for delta in message["deltas"]:
+            state.update(delta)
+    assert state == hub.channels["final"].state == {"status": "playing", "player1_moved": True}
+    await early.close()
+    await late.close()
+
+
+@pytest.mark.asyncio
+async def test_spectators_follow_a_match_without_seeing_early_moves(session_factory, db_session):
+    manager = GameManager(session_factory)
+    match = await manager.create_session(1, 2, db_session)
+    viewer, final = Connection(Viewer()), Connection(Viewer())
+    assert not manager.broadcasts.subscribe("match-999", viewer)
+    assert manager.broadcasts.subscribe(f"match-{match.session_id}", viewer)
+    assert manager.feature("final", match.session_id)
+    assert manager.broadcasts.subscribe("final", final)
+
+    await manager.make_move(1, "rock", db_session)
+    await asyncio.sleep(0)
+    snapshot, moved = await received(viewer)
+    assert snapshot["state"]["status"] == "playing"
+    assert moved["deltas"] == [{"player1_moved": True}]
+
+    await manager.make_move(2, "scissors", db_session)
+    await asyncio.sleep(0)
+    result = (await received(viewer))[-1]["deltas"][-1]
+    assert (result["status"], result["player1_move"], result["winner"]) == ("completed", "rock", "1")
+    assert (await received(final))[-1] == (await received(viewer))[-1] | {"channel": "final"}
+    await viewer.close()
+    await final.close()
@@ -0,0 +1,101 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from unittest.mock import AsyncMock
+
+import broker
+from bus import UnixSocketBus
+from game import GameManager
+
+
+@pytest_asyncio.fixture
+async def broker_path(tmp_path):
+    path = str(tmp_path / "bus.sock")
+    server = await broker.serve(path)
+    yield path
+    server.close()
+    await server.wait_closed()
+
+
+@pytest_asyncio.fixture
+async def managers(broker_path, session_factory):
+    _managers = [GameManager(session_factory, bus=UnixSocketBus(broker_path, worker_id=f"worker{i}"))
+                 for i in (1, 2)]
+    for manager in _managers:
+        await manager.bus.start(manager.handle_bus_message)
+    yield _managers
+    for manager in _managers:
+        for user_id in [user_id for user_id, record in manager.players.items() if record.connection is not None]:
+            await manager.disconnect(user_id)
+        await manager.bus.stop()
+
+
+def sent_messages(websocket):
+    return [json.loads(call.args[0]) for call in websocket.send_text.call_args_list]
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_match_across_workers(managers, db_session):
+    worker1, worker2 = managers
+    websocket1, websocket2 = AsyncMock(scope={}), AsyncMock(scope={})
+    await worker1.connect(websocket1, 1)
+    await worker2.connect(websocket2, 2)
+
+    await worker1.start_game(1, websocket1, db_session)
+    await worker2.start_game(2, websocket2, db_session)
+    await settle()
+    assert sent_messages(websocket1)[-1]["message"] == "Game started with 2"
+    assert worker2.player_match(2) is not None
+
+    await worker1.make_move(1, "paper", db_session)
+    await worker2.make_move(2, "rock", db_session)
+    await settle()
+
+    assert sent_messages(websocket1)[-1] == {"action": "game_result", "winner": "1", "result": "You won!"}
+    assert sent_messages(websocket2)[-1] == {"action": "game_result", "winner": "1", "result": "You lost"}
+    assert worker2.matches == {}
+
+
+@pytest.mark.asyncio
+async def test_disconnect_leaves_shared_queue(managers, db_session):
+    worker1, worker2 = managers
+    websocket1, websocket2 = AsyncMock(scope={}), AsyncMock(scope={})
+    await worker1.connect(websocket1, 1)
+    await worker2.connect(websocket2, 2)
+
+    await worker1.start_game(1, websocket1, db_session)
+    await worker1.disconnect(1)
+    await worker2.start_game(2, websocket2, db_session)
+    await settle()
+
+    assert [message["action"] for message in sent_messages(websocket2)] == ["session"]
+    assert await worker2.bus.cancel_search(2) is True
+
+
+@pytest.mark.asyncio
+async def test_leaderboard_updates_reach_every_worker(managers, db_session):
+    worker1, worker2 = managers
+    websocket1, websocket2 = AsyncMock(scope={}), AsyncMock(scope={})
+    await worker1.connect(websocket1, 1)
+    await worker2.connect(websocket2, 2)
+    await worker1.update_leaderboard({3: [0, 0, 0]})
+
+    await worker1.start_game(1, websocket1, db_session)
+    await worker2.start_game(2, websocket2, db_session)
+    await settle()
+    await worker1.make_move(1, "paper", db_session)
+    await worker2.make_move(2, "rock", db_session)
+    await settle()
+
+    for worker in managers:
+        assert worker.leaderboard.rank(1)["wins"] == 1
+        assert worker.leaderboard.rank(2)["losses"] == 1
+        assert worker.leaderboard.rank(3) == {"rank": 2, "user_id": 3, "wins": 0, "losses": 0, "draws": 0,
+                                              "points": 0}
@@ -0,0 +1,79 @@
+import pytest
+
+import caching
+import models
+from caching import Cache, InProcessBackend, RedisBackend
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8')
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+@pytest.mark.asyncio
+async def test_in_process_backend_lru_and_ttl(clock):
+    backend = InProcessBackend(max_size=2, clock=clock)
+    await backend.set("a", 1, ttl=10)
+    await backend.set("b", 2, ttl=10)
+    assert await backend.get("a") == 1
+
+    await backend.set("c", 3, ttl=10)
+    assert await backend.get("b") is None
+    assert await backend.get("a") == 1
+
+    clock.now = 10
+    assert await backend.get("a") is None
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", [lambda: InProcessBackend(10), lambda: RedisBackend(FakeRedis())])
+async def test_cache_counts_hits_and_invalidates(backend):
+    cache = Cache(backend(), ttl=10)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return {"wins": len(loads)}
+
+    assert await cache.get_or_load("stats:1", loader) == {"wins": 1}
+    assert await cache.get_or_load("stats:1", loader) == {"wins": 1}
+    await cache.invalidate("stats:1")
+    assert await cache.get_or_load("stats:1", loader) == {"wins": 2}
+    assert cache.metrics() == {"hits": 1, "misses": 2}
+
+
+@pytest.mark.asyncio
+async def test_cached_stats_invalidated_after_flush(db_session, monkeypatch):
+    monkeypatch.setattr(caching, "cache", Cache(InProcessBackend(10), ttl=60))
+    assert (await caching.get_user_stats(db_session, 1)).wins == 0
+
+    await db_session.execute(models.GameStat.__table__.update().values(wins=5))
+    await db_session.commit()
+    assert (await caching.get_user_stats(db_session, 1)).wins == 0
+
+    await caching.invalidate_stats([1])
+    assert (await caching.get_user_stats(db_session, 1)).wins == 5
+    assert (await caching.get_user(db_session, 1)).nickname == "player1"
+    assert await caching.get_user(db_session, 99) is None
+
+
+@pytest.mark.asyncio
+async def test_preload_caches_leaderboard_players(db_session, monkeypatch):
+    monkeypatch.setattr(caching, "cache", Cache(InProcessBackend(10), ttl=60))
+    entries = [{"rank": 1, "user_id": 2, "wins": 3, "losses": 0, "draws": 1, "points": 10}]
+    assert await caching.preload(db_session, entries) == 1
+
+    assert (await caching.get_user_stats(db_session, 2)).wins == 3
+    user = await caching.get_user_by_nickname(db_session, "player2")
+    assert (user.user_id, user.password) == (2, None)
+    assert caching.cache.metrics() == {"hits": 2, "misses": 0}
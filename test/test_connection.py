@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import pytest
+from unittest.mock import AsyncMock
+
+import protocol
+from connection import Connection
+
+
+class SlowWebSocket:
+    def __init__(self):
+        self.frames = []
+        self.release = asyncio.Event()
+        self.close = AsyncMock()
+
+    async def send_text(self, frame):
+        await self.release.wait()
+        self.frames.append(json.loads(frame))
+
+
+@pytest.mark.asyncio
+async def test_send_does_not_wait_for_the_socket():
+    websocket = SlowWebSocket()
+    connection = Connection(websocket)
+
+    assert connection.send({"action": "a"})
+    assert connection.send(protocol.GAME_OVER)
+    assert websocket.frames == []
+
+    websocket.release.set()
+    await connection.drain()
+    assert websocket.frames == [{"action": "a"}, {"action": "game_over"}]
+    assert connection.metrics()["sent"] == 2
+    # An idle connection keeps neither a queue nor a writer task.
+    assert connection.pending == () and connection._writer is None
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_drop_policy_discards_new_frames():
+    websocket = SlowWebSocket()
+    connection = Connection(websocket, max_pending=2, policy='drop')
+    await asyncio.sleep(0)
+
+    for index in range(4):
+        connection.send({"action": "tick", "n": index})
+    websocket.release.set()
+    await connection.drain()
+
+    assert [frame["n"] for frame in websocket.frames] == [0, 1]
+    assert connection.dropped == 2
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_coalesce_policy_replaces_pending_frame_with_same_action():
+    websocket = SlowWebSocket()
+    connection = Connection(websocket, max_pending=2, policy='coalesce')
+    connection.send({"action": "first"})
+    await asyncio.sleep(0)
+
+    connection.send({"action": "tick", "n": 1})
+    connection.send({"action": "other"})
+    connection.send({"action": "tick", "n": 2})
+    websocket.release.set()
+    await connection.drain()
+
+    assert websocket.frames == [{"action": "first"}, {"action": "tick", "n": 2}, {"action": "other"}]
+    assert connection.coalesced == 1
+    await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_slow_consumer():
+    websocket = SlowWebSocket()
+    connection = Connection(websocket, max_pending=1, policy='disconnect')
+    connection.send({"action": "first"})
+    await asyncio.sleep(0)
+
+    connection.send({"action": "second"})
+    assert connection.send({"action": "third"}) is False
+    assert connection.closed
+    assert connection.send({"action": "fourth"}) is False
+
+    await asyncio.sleep(0.01)
+    websocket.close.assert_awaited_once_with(code=1008)
+    await connection.close()
+    websocket.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_frames_stay_undelivered_when_the_socket_fails():
+    websocket = AsyncMock()
+    websocket.send_text.side_effect = RuntimeError("socket closed")
+    connection = Connection(websocket)
+
+    connection.send({"action": "game_result"})
+    connection.send(protocol.GAME_OVER)
+    await connection.drain()
+
+    assert connection.closed
+    assert connection.send({"action": "play_again_request"}) is False
+    assert connection.undelivered() == [{"action": "game_result"}, protocol.GAME_OVER,
+                                        {"action": "play_again_request"}]
+    await connection.close()
+    websocket.close.assert_awaited_once_with(code=1000)
@@ -1,7 +1,7 @@
 import bcrypt
 import pytest
 from unittest.mock import Mock, patch
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 import models
 import schemas
@@ -10,18 +10,20 @@ import crud
 
 @pytest.fixture
 def test_db_session():
-    session = Mock(spec=Session)
+    session = Mock(spec=AsyncSession)
+    session.execute.return_value = Mock()
     return session
 
 
-def test_create_user(test_db_session):
+@pytest.mark.asyncio
+async def test_create_user(test_db_session):
     user_data = schemas.UserCreate(nickname="test_user", password="test_password")
 
     with patch('bcrypt.gensalt', return_value=b"salt"), \
             patch('bcrypt.hashpw', return_value=b"hashed_password"), \
             patch.object(test_db_session, 'commit'), \
             patch.object(test_db_session, 'refresh'):
-        created_user = crud.create_user(test_db_session, user_data)
+        created_user = await crud.create_user(test_db_session, user_data)
 
         assert created_user.nickname == user_data.nickname
         assert created_user.password == "hashed_password"
@@ -29,51 +31,83 @@ def test_create_user(test_db_session):
         assert test_db_session.refresh.called
 
 
-def test_check_password():
+@pytest.mark.asyncio
+async def test_check_password():
     user_password = "test_password"
     stored_password = bcrypt.hashpw(user_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-    assert crud.check_password(user_password, stored_password) is True
-    assert crud.check_password("wrong_password", stored_password) is False
+    assert await crud.check_password(user_password, stored_password) is True
+    assert await crud.check_password("wrong_password", stored_password) is False
 
 
-def test_get_user_by_nickname(test_db_session):
+@pytest.mark.asyncio
+async def test_rehash_password_if_needed(test_db_session):
+    stored_password = bcrypt.hashpw(b"test_password", bcrypt.gensalt(4)).decode('utf-8')
+    user = models.User(nickname="test_user", password=stored_password)
+
+    with patch.object(crud.hasher, 'rounds', 5):
+        await crud.rehash_password_if_needed(test_db_session, user, "test_password")
+
+    assert user.password.startswith("$2b$05$")
+    assert bcrypt.checkpw(b"test_password", user.password.encode('utf-8'))
+    assert test_db_session.commit.called
+
+
+@pytest.mark.asyncio
+async def test_get_user_by_nickname(test_db_session):
     test_nickname = "example_user"
     mock_user = models.User(nickname=test_nickname)
-    test_db_session.query.return_value.filter.return_value.first.return_value = mock_user
+    test_db_session.execute.return_value.scalars.return_value.first.return_value = mock_user
 
-    result = crud.get_user_by_nickname(test_db_session, test_nickname)
+    result = await crud.get_user_by_nickname(test_db_session, test_nickname)
 
-    test_db_session.query.assert_called_with(models.User)
-    test_db_session.query.return_value.filter.assert_called_once()
+    statement = test_db_session.execute.call_args.args[0]
+    test_db_session.execute.assert_called_once()
+    assert statement.column_descriptions[0]['entity'] is models.User
     assert result == mock_user
     assert result.nickname == test_nickname
 
 
-def test_get_user(test_db_session):
+@pytest.mark.asyncio
+async def test_get_user(test_db_session):
     test_user_id = 1
     mock_user = models.User(user_id=test_user_id, nickname="example_user")
-    test_db_session.query.return_value.filter.return_value.first.return_value = mock_user
+    test_db_session.execute.return_value.scalars.return_value.first.return_value = mock_user
 
-    result = crud.get_user(test_db_session, test_user_id)
+    result = await crud.get_user(test_db_session, test_user_id)
 
-    test_db_session.query.assert_called_with(models.User)
-    test_db_session.query.return_value.filter.assert_called_once()
+    statement = test_db_session.execute.call_args.args[0]
+    test_db_session.execute.assert_called_once()
+    assert statement.column_descriptions[0]['entity'] is models.User
     assert result == mock_user
     assert result.user_id == test_user_id
 
 
-def test_get_user_stats(test_db_session):
+@pytest.mark.asyncio
+async def test_get_user_stats(test_db_session):
     test_user_id = 1
     mock_stats = models.GameStat(user_id=test_user_id, wins=5, losses=3, draws=2)
-    test_db_session.query.return_value.filter.return_value.first.return_value = mock_stats
+    test_db_session.execute.return_value.scalars.return_value.first.return_value = mock_stats
 
-    result = crud.get_user_stats(test_db_session, test_user_id)
+    result = await crud.get_user_stats(test_db_session, test_user_id)
 
-    test_db_session.query.assert_called_with(models.GameStat)
-    test_db_session.query.return_value.filter.assert_called_once()
+    statement = test_db_session.execute.call_args.args[0]
+    test_db_session.execute.assert_called_once()
+    assert statement.column_descriptions[0]['entity'] is models.GameStat
     assert result == mock_stats
     assert result.user_id == test_user_id
     assert result.wins == 5
     assert result.losses == 3
     assert result.draws == 2
+
+
+@pytest.mark.asyncio
+async def test_get_latest_game_session(db_session):
+    for player1_id, player2_id, status in [(1, 2, 'completed'), (2, 1, 'completed'), (1, 2, 'timeout')]:
+        db_session.add(models.GameSession(player1_id=player1_id, player2_id=player2_id, status=status))
+    await db_session.commit()
+
+    assert (await crud.get_latest_game_session(db_session, 1)).session_id == 3
+    assert (await crud.get_latest_game_session(db_session, 1, status='completed')).session_id == 2
+    assert (await crud.get_latest_game_session(db_session, 2, status='waiting')) is None
+    assert (await crud.get_latest_game_session(db_session, 99)) is None
@@ -0,0 +1,285 @@
+import asyncio
+import os
+import threading
+
+import pytest
+
+import models
+import tournament
+from events import EventLog, MatchProjection, rebuild, seed
+from game import GameManager
+
+
+determine_winner = GameManager.determine_winner
+
+
+def segments(log):
+    return sorted(name for name in os.listdir(log.directory) if name.startswith("events-"))
+
+
+@pytest.mark.asyncio
+async def test_events_are_written_in_batches_and_survive_reopening(tmp_path):
+    log = EventLog(str(tmp_path), segment_bytes=100)
+    log.open()
+    for user_id in range(5):
+        log.append("queued", user_id=str(user_id))
+    assert await log.flush() == 5
+    log.append("queued", user_id="5")
+    await log.flush()
+    await log.stop()
+
+    assert log.batches == 2
+    reopened = EventLog(str(tmp_path))
+    reopened.open()
+    assert len(segments(reopened)) == 2
+    assert [event["seq"] for event in reopened.read()] == [1, 2, 3, 4, 5, 6]
+    # Logs written before user ids were ints carry them as strings.
+    assert [event["user_id"] for event in reopened.read(after_seq=4)] == [4, 5]
+    assert reopened.append("queued", user_id="6")["seq"] == 7
+    await reopened.stop()
+
+
+@pytest.mark.asyncio
+async def test_torn_batch_is_ignored(tmp_path):
+    log = EventLog(str(tmp_path))
+    log.open()
+    log.append("queued", user_id="1")
+    await log.flush()
+    with open(os.path.join(log.directory, segments(log)[0]), "a") as segment:
+        segment.write('{"seq": 2, "ty')
+    await log.stop()
+
+    reopened = EventLog(str(tmp_path))
+    reopened.open()
+    assert [event["seq"] for event in reopened.read()] == [1]
+    assert reopened.append("queued", user_id="2")["seq"] == 2
+    await reopened.stop()
+
+
+@pytest.mark.asyncio
+async def test_each_open_log_gets_its_own_shard(tmp_path):
+    first, second = EventLog(str(tmp_path)), EventLog(str(tmp_path))
+    first.open()
+    second.open()
+
+    assert os.path.basename(first.directory) == "shard-0"
+    assert os.path.basename(second.directory) == "shard-1"
+    await first.stop()
+    await second.stop()
+
+
+@pytest.mark.asyncio
+async def test_segments_are_compacted_once_snapshotted_and_checkpointed(tmp_path):
+    log = EventLog(str(tmp_path), segment_bytes=1, snapshot_every=3)
+    log.open()
+    projection = MatchProjection(determine_winner)
+    for event_type, fields in [
+        ("matched", {"session_id": 1, "player1_id": 1, "player2_id": 2}),
+        ("move", {"session_id": 1, "user_id": 1, "move": "rock"}),
+        ("result", {"session_id": 1, "player1_id": 1, "player1_move": "rock",
+                    "player2_id": 2, "player2_move": "scissors"}),
+    ]:
+        projection.apply(log.append(event_type, **fields))
+        await log.flush()
+    assert log.needs_snapshot()
+    log.request_snapshot(projection.state())
+    log.append("queued", user_id=1)
+    await log.flush()
+    assert len(segments(log)) == 4
+
+    await log.checkpoint(3)
+    await log.flush()
+
+    assert len(segments(log)) == 1
+    snapshot_seq, state = log.latest_snapshot()
+    assert snapshot_seq == 3
+    assert state["stats"] == {"1": [1, 0, 0], "2": [0, 1, 0]}
+    assert state["last_sessions"]["2"] == [1, 1, "completed"]
+    assert [event["seq"] for event in log.read(after_seq=snapshot_seq)] == [4]
+    await log.stop()
+
+
+async def play(manager, db_session, move1, move2):
+    match = await manager.create_session(1, 2, db_session)
+    await manager.make_move(1, move1, db_session)
+    await manager.make_move(2, move2, db_session)
+    return match
+
+
+@pytest.mark.asyncio
+async def test_unflushed_results_are_replayed_after_a_restart(tmp_path, monkeypatch, session_factory, db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    manager = GameManager(session_factory)
+    manager.events.start()
+    match = await play(manager, db_session, "rock", "scissors")
+    # The process dies before the stats are flushed.
+    await manager.events.stop()
+
+    restarted = GameManager(session_factory)
+    assert restarted.replay_events() == 4
+    assert restarted.last_opponent(2, status='completed') == 1
+    assert await restarted.stats.flush() == 1
+    await restarted.events.stop()
+
+    db_session.expire_all()
+    session = await db_session.get(models.GameSession, match.session_id)
+    assert (session.status, session.player1_move, session.player2_move) == ('completed', 'rock', 'scissors')
+    assert (await db_session.get(models.GameStat, 1)).wins == 1
+
+    again = GameManager(session_factory)
+    assert again.replay_events() == 0
+    await again.events.stop()
+
+
+@pytest.mark.asyncio
+async def test_matches_in_play_at_a_crash_time_out_on_replay(tmp_path, monkeypatch, session_factory, db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    manager = GameManager(session_factory)
+    manager.events.start()
+    finished = await play(manager, db_session, "rock", "scissors")
+    match = await manager.create_session(1, 2, db_session)
+    await manager.stats.flush()
+    # The process dies mid-match, before its move deadline.
+    await manager.events.stop()
+
+    restarted = GameManager(session_factory)
+    restarted.replay_events()
+    assert restarted.projection.open_sessions() == {}
+    assert restarted.last_opponent(1, status='timeout') == 2
+    await restarted.stats.flush()
+    await restarted.events.stop()
+
+    db_session.expire_all()
+    assert (await db_session.get(models.GameSession, match.session_id)).status == 'timeout'
+    assert (await db_session.get(models.GameSession, finished.session_id)).status == 'completed'
+    again = GameManager(session_factory)
+    assert again.replay_events() == 0
+    await again.events.stop()
+
+
+@pytest.mark.asyncio
+async def test_results_between_checkpoint_and_snapshot_are_replayed(tmp_path, monkeypatch, session_factory,
+                                                                     db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    manager = GameManager(session_factory)
+    manager.events.start()
+    match = await play(manager, db_session, "rock", "scissors")
+    # A snapshot is taken before the stats are flushed, so the checkpoint stays behind it.
+    manager.events.request_snapshot(manager.projection.state())
+    await manager.events.stop()
+
+    restarted = GameManager(session_factory)
+    assert restarted.replay_events() == 4
+    assert restarted.events.latest_snapshot()[0] == 4 and restarted.events.checkpoint_seq == 0
+    assert list(restarted.stats.pending) == [match.session_id]
+    assert restarted.projection.stats[1] == [1, 0, 0]
+    assert await restarted.stats.flush() == 1
+    await restarted.events.stop()
+    assert (await db_session.get(models.GameStat, 1)).wins == 1
+
+
+@pytest.mark.asyncio
+async def test_flush_does_not_checkpoint_past_a_result_waiting_for_fsync(tmp_path, monkeypatch, session_factory,
+                                                                          db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    for nickname in ("player3", "player4"):
+        db_session.add(models.User(nickname=nickname, password="password"))
+    await db_session.commit()
+    manager = GameManager(session_factory)
+    manager.events.start()
+    match = await manager.create_session(1, 2, db_session)
+    other = await manager.create_session(3, 4, db_session)
+    await manager.events.flush()
+
+    written = threading.Event()
+    write = manager.events._write
+    monkeypatch.setattr(manager.events, "_write", lambda *args: (written.wait(5), write(*args)))
+    await manager.make_move(1, "rock", db_session)
+    deciding = asyncio.create_task(manager.make_move(2, "scissors", db_session))
+    while not manager.events._waiters:
+        await asyncio.sleep(0.01)
+    result_seq = manager.events.seq
+    # Another match ends and the stats are flushed while the result is still being written.
+    await manager.close_match(other, 'completed')
+    await manager.stats.flush()
+    assert manager.events.checkpoint_seq == result_seq - 1
+
+    written.set()
+    await deciding
+    # The process dies before the result's stats are flushed.
+    await manager.events.stop()
+
+    restarted = GameManager(session_factory)
+    restarted.replay_events()
+    assert list(restarted.stats.pending) == [match.session_id]
+    assert await restarted.stats.flush() == 1
+    await restarted.events.stop()
+    assert (await db_session.get(models.GameStat, 1)).wins == 1
+
+
+@pytest.mark.asyncio
+async def test_replayed_series_counts_once_and_keeps_its_rounds(tmp_path, monkeypatch, session_factory, db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    manager = GameManager(session_factory)
+    manager.events.start()
+    match = await manager.create_session(1, 2, db_session, best_of=3)
+    for move1, move2 in (("paper", "rock"), ("rock", "rock"), ("scissors", "paper")):
+        await manager.make_move(1, move1, db_session)
+        await manager.make_move(2, move2, db_session)
+    await manager.events.stop()
+
+    restarted = GameManager(session_factory)
+    restarted.replay_events()
+    assert restarted.projection.stats[1] == [1, 0, 0]
+    assert await restarted.stats.flush() == 1
+    await restarted.events.stop()
+
+    db_session.expire_all()
+    session = await db_session.get(models.GameSession, match.session_id)
+    assert (session.player1_move, session.player2_move) == ('scissors', 'paper')
+    assert session.rounds == "paper:rock,rock:rock,scissors:paper"
+    player1 = await db_session.get(models.GameStat, 1)
+    assert (player1.wins, player1.losses, player1.draws) == (1, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_replays_results_with_fixed_rules(tmp_path, monkeypatch, session_factory, db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    assert await seed(session_factory, str(tmp_path)) == 2
+    manager = GameManager(session_factory)
+    manager.events.start()
+    await play(manager, db_session, "rock", "scissors")
+    await play(manager, db_session, "paper", "paper")
+    await manager.stop()
+
+    assert await rebuild(session_factory, str(tmp_path), determine_winner) == (2, 2)
+    db_session.expire_all()
+    player1 = await db_session.get(models.GameStat, 1)
+    assert (player1.wins, player1.losses, player1.draws) == (1, 0, 1)
+
+    def scissors_beat_rock(player1_id, player1_move, player2_id, player2_move):
+        if {player1_move, player2_move} == {"rock", "scissors"}:
+            return {'winner': player1_id if player1_move == "scissors" else player2_id}
+        return determine_winner(player1_id, player1_move, player2_id, player2_move)
+
+    await rebuild(session_factory, str(tmp_path), scissors_beat_rock)
+    db_session.expire_all()
+    player1 = await db_session.get(models.GameStat, 1)
+    assert (player1.wins, player1.losses, player1.draws) == (0, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_keeps_tournament_results(tmp_path, monkeypatch, session_factory, db_session):
+    monkeypatch.setattr("config.EVENT_LOG_DIR", str(tmp_path))
+    await seed(session_factory, str(tmp_path))
+    manager = GameManager(session_factory)
+    manager.events.start()
+    await play(manager, db_session, "rock", "scissors")
+    assert await tournament.apply_results(db_session, {1: [3, 1, 0], 2: [1, 3, 0]}, manager) == 2
+    assert manager.leaderboard.rank(1)["wins"] == 4
+    await manager.stop()
+
+    await rebuild(session_factory, str(tmp_path), determine_winner)
+    db_session.expire_all()
+    player1 = await db_session.get(models.GameStat, 1)
+    assert (player1.wins, player1.losses, player1.draws) == (4, 1, 0)
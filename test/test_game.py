@@ -0,0 +1,324 @@
+import asyncio
+import json
+
+import pytest
+import pytest_asyncio
+from unittest.mock import AsyncMock
+
+import models
+from bus import InProcessBus
+from connection import Connection
+from game import GameManager
+from matchmaking import MatchmakingQueue
+
+
+@pytest_asyncio.fixture
+async def game_manager(session_factory):
+    manager = GameManager(session_factory)
+    manager.attach(1, Connection(AsyncMock()))
+    manager.attach(2, Connection(AsyncMock()))
+    yield manager
+    for connection in manager.connections():
+        await connection.close()
+
+
+async def sent_messages(connection):
+    await connection.drain()
+    return [json.loads(call.args[0]) for call in connection.websocket.send_text.call_args_list]
+
+
+@pytest.mark.asyncio
+async def test_make_move_resolves_in_memory(game_manager, db_session):
+    await game_manager.start_game(1, game_manager.players[1].connection, db_session)
+    await game_manager.start_game(2, game_manager.players[2].connection, db_session)
+    match = game_manager.player_match(1)
+
+    await game_manager.make_move(1, "rock", db_session)
+    session = await db_session.get(models.GameSession, match.session_id)
+    assert session.player1_move is None
+    assert session.status == 'waiting'
+
+    await game_manager.make_move(2, "scissors", db_session)
+    assert game_manager.matches == {}
+    assert game_manager.player_match(1) is None and game_manager.player_match(2) is None
+    assert [event["type"] for event in game_manager.events.pending] == [
+        "queued", "matched", "move", "move", "result"]
+
+    winner = (await sent_messages(game_manager.players[1].connection))[-1]
+    assert winner == {"action": "game_result", "winner": "1", "result": "You won!"}
+    assert game_manager.leaderboard.rank(1)["rank"] == 1
+    db_session.expire_all()
+    assert (await db_session.get(models.GameSession, match.session_id)).status == 'waiting'
+    assert (await db_session.get(models.GameStat, 1)).wins == 0
+
+    assert await game_manager.stats.flush() == 1
+    db_session.expire_all()
+    session = await db_session.get(models.GameSession, match.session_id)
+    assert session.status == 'completed'
+    assert (session.player1_id, session.player1_move) == (2, 'scissors')
+    assert (session.player2_id, session.player2_move) == (1, 'rock')
+    assert (await db_session.get(models.GameStat, 1)).wins == 1
+    assert (await db_session.get(models.GameStat, 2)).losses == 1
+
+
+@pytest.mark.asyncio
+async def test_series_rounds_stay_in_memory_until_decided(game_manager, db_session):
+    await game_manager.start_game(1, game_manager.players[1].connection, db_session, best_of=2)
+    await game_manager.start_game(1, game_manager.players[1].connection, db_session, best_of=3)
+    await game_manager.start_game(2, game_manager.players[2].connection, db_session, best_of=3)
+    match = game_manager.player_match(1)
+    assert (match.player1_id, match.best_of) == (2, 3)
+
+    for move1, move2 in (("rock", "rock"), ("rock", "scissors")):
+        await game_manager.make_move(1, move1, db_session)
+        await game_manager.make_move(2, move2, db_session)
+    assert game_manager.player_match(1) is match
+    messages = await sent_messages(game_manager.players[1].connection)
+    assert messages[0] == {"error": "Invalid series length"}
+    assert messages[-1] == {"action": "round_result", "round": 2, "winner": "1", "result": "You won!",
+                            "score": [1, 0]}
+    assert game_manager.stats.pending == {}
+
+    await game_manager.make_move(1, "paper", db_session)
+    await game_manager.make_move(2, "rock", db_session)
+    assert game_manager.matches == {}
+    assert [event["type"] for event in game_manager.events.pending].count("result") == 1
+    assert (await sent_messages(game_manager.players[2].connection))[-1] == {
+        "action": "game_result", "winner": "1", "result": "You lost"}
+
+    assert await game_manager.stats.flush() == 1
+    db_session.expire_all()
+    session = await db_session.get(models.GameSession, match.session_id)
+    assert (session.status, session.best_of) == ('completed', 3)
+    assert session.rounds == "rock:rock,scissors:rock,rock:paper"
+    assert (await db_session.get(models.GameStat, 1)).wins == 1
+    assert (await db_session.get(models.GameStat, 2)).losses == 1
+
+
+@pytest.mark.asyncio
+async def test_waiting_players_are_paired_as_their_buckets_widen(session_factory, db_session, monkeypatch, clock):
+    monkeypatch.setattr("config.MATCHMAKING_SKILL_BUCKETS", 10)
+    monkeypatch.setattr("config.MATCHMAKING_WIDEN_AFTER", 5)
+    manager = GameManager(session_factory, bus=InProcessBus(MatchmakingQueue(skill_buckets=10, widen_after=5,
+                                                                             clock=clock)))
+    manager.attach(1, Connection(AsyncMock()))
+    manager.attach(2, Connection(AsyncMock()))
+    monkeypatch.setattr(manager, "win_rate", AsyncMock(side_effect=[0.9, 0.75]))
+    await manager.start_game(1, manager.players[1].connection, db_session)
+    await manager.start_game(2, manager.players[2].connection, db_session)
+    assert manager.player_match(1) is None
+    assert {key for kind, key in manager.timers.timers if kind == "widen"} == {1, 2}
+
+    clock.now = 5
+    await manager.widen_searches([1])
+    assert manager.player_match(1) is None
+    assert ("widen", 1) in manager.timers.timers
+
+    clock.now = 10
+    await manager.widen_searches([1, 2])
+    assert manager.player_match(1) is manager.player_match(2) is not None
+    assert not manager.timers.timers.keys() & {("widen", 1), ("widen", 2), ("search", 1), ("search", 2)}
+    assert (await sent_messages(manager.players[2].connection))[-1]["message"] == "Game started with 1"
+    for connection in manager.connections():
+        await connection.close()
+
+
+@pytest.mark.asyncio
+async def test_connection_metrics_sum_over_open_sockets(game_manager, db_session):
+    await game_manager.begin_match(1, 2, db_session)
+    for connection in game_manager.connections():
+        await connection.drain()
+
+    summary = game_manager.connection_metrics()
+
+    assert summary["frames"] == {"sent": 2, "dropped": 0, "coalesced": 0}
+    assert 0 <= summary["send_latency"]["mean"] <= summary["send_latency"]["max"]
+    assert summary["max_idle"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_make_move_without_match(game_manager, db_session):
+    await game_manager.make_move(1, "rock", db_session)
+
+    assert await sent_messages(game_manager.players[1].connection) == [{"error": "No active game session"}]
+
+
+@pytest.mark.asyncio
+async def test_timeout_game_releases_match(game_manager, db_session):
+    match = await game_manager.create_session(1, 2, db_session)
+
+    await game_manager.timeout_game(2, db_session)
+    await game_manager.stats.flush()
+
+    db_session.expire_all()
+    assert (await db_session.get(models.GameSession, match.session_id)).status == 'timeout'
+    assert match.session_id not in game_manager.matches
+    assert await sent_messages(game_manager.players[1].connection) == [{"action": "timeout", "timed_out_user_id": "2"}]
+
+
+@pytest.mark.asyncio
+async def test_stop_times_out_matches_in_play(game_manager, db_session):
+    match = await game_manager.create_session(1, 2, db_session)
+    await game_manager.make_move(1, "rock", db_session)
+
+    await game_manager.stop()
+
+    assert game_manager.matches == {}
+    assert (await sent_messages(game_manager.players[1].connection))[-1] == {"action": "timeout",
+                                                                            "timed_out_user_id": "2"}
+    db_session.expire_all()
+    assert (await db_session.get(models.GameSession, match.session_id)).status == 'timeout'
+
+
+@pytest.mark.asyncio
+async def test_expired_matches_time_out_in_batch(game_manager, db_session):
+    first = await game_manager.create_session(1, 2, db_session)
+    await game_manager.make_move(1, "rock", db_session)
+    assert len(game_manager.timers) == 1
+
+    await game_manager.expire_matches([first.session_id])
+    await game_manager.stats.flush()
+
+    db_session.expire_all()
+    assert (await db_session.get(models.GameSession, first.session_id)).status == 'timeout'
+    assert game_manager.matches == {}
+    assert len(game_manager.timers) == 0
+    assert await sent_messages(game_manager.players[2].connection) == [{"action": "timeout", "timed_out_user_id": "2"}]
+
+
+@pytest.mark.asyncio
+async def test_play_again_registers_match_before_accepting(game_manager, db_session):
+    await game_manager.create_session(1, 2, db_session)
+    await game_manager.make_move(1, "rock", db_session)
+    await game_manager.make_move(2, "rock", db_session)
+
+    await game_manager.handle_play_again(1, db_session)
+    await game_manager.handle_play_again_response(2, db_session)
+
+    assert game_manager.player_match(1) is game_manager.player_match(2)
+    assert (await sent_messages(game_manager.players[1].connection))[-1] == {"action": "play_again_accepted"}
+
+
+@pytest.mark.asyncio
+async def test_new_match_ends_the_live_match_it_replaces(game_manager, db_session):
+    old = await game_manager.create_session(1, 2, db_session)
+    await game_manager.start_game(1, game_manager.players[1].connection, db_session)
+    new = await game_manager.create_session(1, 3, db_session)
+
+    assert game_manager.player_match(1) is new and game_manager.player_match(2) is None
+    assert list(game_manager.matches) == [new.session_id]
+    assert ("move", old.session_id) not in game_manager.timers.timers
+    assert [event["type"] for event in game_manager.events.pending] == ["matched", "queued", "matched", "exit"]
+    assert (await sent_messages(game_manager.players[2].connection))[-1] == {"action": "game_over"}
+    await game_manager.stats.flush()
+    db_session.expire_all()
+    assert (await db_session.get(models.GameSession, old.session_id)).status == 'completed'
+
+
+@pytest.mark.asyncio
+async def test_dropped_player_resumes_with_buffered_messages(game_manager, db_session):
+    websocket = AsyncMock(scope={})
+    await game_manager.connect(websocket, 1)
+    token = game_manager.players[1].resume_token
+    match = await game_manager.create_session(1, 2, db_session)
+    await game_manager.disconnect(1, websocket, resumable=True)
+
+    await game_manager.make_move(2, "rock", db_session)
+    await game_manager.send(1, {"action": "ping", "ts": 1})
+    assert game_manager.players[1].parked is not None
+
+    await game_manager.connect(AsyncMock(scope={}), 1, resume_token=token)
+    session, ping = await sent_messages(game_manager.players[1].connection)
+    assert session == {"action": "session", "resume_token": game_manager.players[1].resume_token, "resumed": True,
+                       "session_id": match.session_id, "opponent_id": "2", "missed": 0}
+    assert ping == {"action": "ping", "ts": 1}
+    assert game_manager.parked_count() == 0
+    await game_manager.make_move(1, "paper", db_session)
+    assert (await sent_messages(game_manager.players[1].connection))[-1]["result"] == "You won!"
+
+
+@pytest.mark.asyncio
+async def test_result_sent_after_a_failed_write_is_replayed_on_resume(game_manager, db_session):
+    websocket = AsyncMock(scope={})
+    await game_manager.connect(websocket, 1)
+    token = game_manager.players[1].resume_token
+    await game_manager.create_session(1, 2, db_session)
+    websocket.send_text.side_effect = RuntimeError("socket closed")
+    await game_manager.send(1, {"action": "ping", "ts": 1})
+    await game_manager.players[1].connection.drain()
+
+    # The player is still attached when the result goes out; the endpoint only notices the socket is gone later.
+    await game_manager.make_move(1, "rock", db_session)
+    await game_manager.make_move(2, "scissors", db_session)
+    await game_manager.disconnect(1, websocket, resumable=True)
+    websocket.close.assert_awaited_once()
+
+    await game_manager.connect(AsyncMock(scope={}), 1, resume_token=token)
+    session, ping, result = await sent_messages(game_manager.players[1].connection)
+    assert session["resumed"] is True
+    assert ping == {"action": "ping", "ts": 1}
+    assert result == {"action": "game_result", "winner": "1", "result": "You won!"}
+
+
+@pytest.mark.asyncio
+async def test_messages_sent_while_the_socket_closes_are_parked(game_manager, db_session):
+    websocket = AsyncMock(scope={})
+    closed = asyncio.Event()
+
+    async def close(code):
+        await closed.wait()
+
+    websocket.close.side_effect = close
+    await game_manager.connect(websocket, 1)
+    token = game_manager.players[1].resume_token
+
+    disconnecting = asyncio.create_task(game_manager.disconnect(1, websocket, resumable=True))
+    await asyncio.sleep(0)
+    await game_manager.send(1, {"action": "ping", "ts": 1})
+    closed.set()
+    await disconnecting
+
+    await game_manager.connect(AsyncMock(scope={}), 1, resume_token=token)
+    assert (await sent_messages(game_manager.players[1].connection))[1:] == [{"action": "ping", "ts": 1}]
+
+
+@pytest.mark.asyncio
+async def test_wrong_resume_token_starts_a_new_session(game_manager, db_session):
+    websocket = AsyncMock(scope={})
+    await game_manager.connect(websocket, 1)
+    await game_manager.disconnect(1, websocket, resumable=True)
+    await game_manager.send(1, {"action": "ping", "ts": 1})
+
+    await game_manager.connect(AsyncMock(scope={}), 1, resume_token="guess")
+
+    assert [message["resumed"] for message in await sent_messages(game_manager.players[1].connection)] == [False]
+
+
+@pytest.mark.asyncio
+async def test_match_times_out_when_grace_period_ends(game_manager, db_session):
+    websocket = AsyncMock(scope={})
+    await game_manager.connect(websocket, 1)
+    match = await game_manager.create_session(1, 2, db_session)
+    await game_manager.disconnect(1, websocket, resumable=True)
+    assert match.session_id in game_manager.matches
+
+    await game_manager.expire_parked_players([1])
+
+    assert game_manager.parked_count() == 0
+    assert match.session_id not in game_manager.matches
+    assert await sent_messages(game_manager.players[2].connection) == [{"action": "timeout", "timed_out_user_id": "1"}]
+
+
+@pytest.mark.asyncio
+async def test_player_records_are_dropped_once_unused(game_manager, db_session):
+    websocket = AsyncMock(scope={})
+    await game_manager.connect(websocket, 3)
+    match = await game_manager.create_session(3, 4, db_session)
+    assert game_manager.players[4].match is match and game_manager.players[4].connection is None
+
+    await game_manager.disconnect(3, websocket)
+    assert game_manager.players[3].match is match
+    await game_manager.timeout_game(3)
+
+    assert 3 not in game_manager.players and 4 not in game_manager.players
+    assert sorted(game_manager.players) == [1, 2]
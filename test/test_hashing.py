@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+
+from hashing import HashingPoolSaturated, PasswordHasher, hash_rounds
+
+
+@pytest.fixture
+def hasher():
+    _hasher = PasswordHasher(rounds=4, workers=1, queue_size=1)
+    yield _hasher
+    _hasher.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify(hasher):
+    stored_password = await hasher.hash("secret")
+
+    assert hash_rounds(stored_password) == 4
+    assert not hasher.needs_rehash(stored_password)
+    assert await hasher.verify("secret", stored_password) is True
+    assert await hasher.verify("wrong", stored_password) is False
+    assert hasher.metrics()["completed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_saturated_pool_rejects(hasher):
+    hasher.rounds = 10
+    pending = [asyncio.ensure_future(hasher.hash("secret")) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(HashingPoolSaturated):
+        await hasher.hash("secret")
+
+    assert hasher.metrics()["queue_depth"] == 1
+    assert hasher.metrics()["rejected"] == 1
+    await asyncio.gather(*pending)
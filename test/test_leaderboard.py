@@ -0,0 +1,58 @@
+import bisect
+import random
+
+import pytest
+
+import models
+from leaderboard import IndexableSkipList, Leaderboard
+
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(7)
+    skip_list, expected = IndexableSkipList(random.Random(1)), []
+    for _ in range(3000):
+        key = rng.randrange(500)
+        position = bisect.bisect_left(expected, key)
+        if position < len(expected) and expected[position] == key:
+            skip_list.remove(key)
+            expected.pop(position)
+        else:
+            skip_list.insert(key)
+            expected.insert(position, key)
+
+    assert len(skip_list) == len(expected)
+    assert [skip_list.index(key) for key in expected] == list(range(len(expected)))
+    assert list(skip_list.iter_from(10)) == expected[10:]
+    assert skip_list[0] == expected[0]
+    with pytest.raises(KeyError):
+        skip_list.index(-1)
+
+
+def test_leaderboard_ranks_by_points():
+    leaderboard = Leaderboard()
+    leaderboard.set(1, 2, 0, 0)
+    leaderboard.set(2, 1, 0, 4)
+    leaderboard.set(3, 0, 5, 0)
+
+    assert [entry["user_id"] for entry in leaderboard.page(10)] == [2, 1, 3]
+
+    leaderboard.apply({1: [1, 0, 0], 3: [0, 1, 0]})
+
+    assert leaderboard.rank(1) == {"rank": 1, "user_id": 1, "wins": 3, "losses": 0, "draws": 0, "points": 9}
+    assert leaderboard.page(1, offset=1) == [leaderboard.rank(2)]
+    assert leaderboard.rank(3)["rank"] == 3
+    assert leaderboard.rank(4) is None
+
+
+@pytest.mark.asyncio
+async def test_load_reads_game_stats_in_chunks(session_factory, db_session):
+    for user_id in range(3, 8):
+        db_session.add(models.User(user_id=user_id, nickname=f"player{user_id}", password="password"))
+        db_session.add(models.GameStat(user_id=user_id, wins=user_id, losses=0, draws=0))
+    await db_session.commit()
+
+    leaderboard = Leaderboard()
+    assert await leaderboard.load(session_factory, chunk_size=2) == 7
+
+    assert [entry["user_id"] for entry in leaderboard.page(3)] == [7, 6, 5]
+    assert leaderboard.rank(1)["rank"] == 6
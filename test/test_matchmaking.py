@@ -0,0 +1,54 @@
+from matchmaking import MatchmakingQueue
+
+
+def test_fifo_match_and_dedup():
+    queue = MatchmakingQueue()
+
+    assert queue.match("1") is None
+    assert queue.match("1") is None
+    assert queue.match("2") == "1"
+    assert len(queue) == 0
+
+    queue.enqueue("3")
+    queue.enqueue("4")
+    assert queue.dequeue() == "3"
+    assert queue.match("5") == "4"
+
+
+def test_cancel():
+    queue = MatchmakingQueue()
+    queue.enqueue("1")
+    queue.enqueue("2")
+
+    assert queue.cancel("1") is True
+    assert queue.cancel("1") is False
+    assert queue.match("3") == "2"
+    assert queue.buckets == {}
+
+
+def test_series_only_match_the_same_length(clock):
+    queue = MatchmakingQueue(widen_after=1.0, clock=clock)
+    queue.match("1", best_of=3)
+
+    assert queue.match("2") is None
+    assert queue.pair_waiting() == []
+    assert queue.match("3", best_of=3) == "1"
+
+
+def test_buckets_widen_with_wait(clock):
+    queue = MatchmakingQueue(skill_buckets=10, rtt_bucket_ms=50, widen_after=5, clock=clock)
+
+    assert queue.match("strong", win_rate=0.9, rtt_ms=20) is None
+    assert queue.match("weak", win_rate=0.8, rtt_ms=20) is None
+    assert queue.pair_waiting() == []
+
+    clock.now = 5
+    assert queue.pair_waiting() == [("strong", "weak", 1)]
+
+    assert queue.match("far", win_rate=0.1, rtt_ms=300) is None
+    clock.now = 14
+    assert queue.match("near", win_rate=0.2, rtt_ms=150) is None
+    clock.now = 20
+    assert queue.match("late", win_rate=0.2, rtt_ms=180) == "far"
+    assert queue.match("fast", win_rate=0.1, rtt_ms=20) is None
+    assert len(queue) == 2
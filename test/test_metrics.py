@@ -0,0 +1,60 @@
+import json
+import logging
+import sys
+
+import metrics
+from logs import JsonFormatter
+from profiler import SamplingProfiler
+
+
+def test_render_prometheus_text():
+    registry = []
+    matches = metrics.Counter("matches_total", "Matches.", ["status"], registry=registry)
+    latency = metrics.Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry)
+    metrics.Gauge("sockets", "Sockets.", lambda: 3, registry=registry)
+    metrics.Gauge("queue", "Queue.", lambda: None, registry=registry)
+
+    matches.labels("completed").inc()
+    matches.labels("completed").inc(2)
+    for value in (0.05, 0.5, 5.0):
+        latency.observe(value)
+
+    lines = metrics.render(registry).splitlines()
+    assert 'matches_total{status="completed"} 3' in lines
+    assert "# TYPE latency_seconds histogram" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_count 3" in lines
+    assert "sockets 3" in lines
+    assert not [line for line in lines if line.startswith("queue ")]
+
+
+def test_json_formatter_includes_extra_fields():
+    record = logging.LogRecord("game", logging.INFO, __file__, 1, "Match %s", ("finished",), None)
+    record.user_id = "1"
+
+    entry = json.loads(JsonFormatter().format(record))
+
+    assert entry["message"] == "Match finished"
+    assert entry["level"] == "INFO"
+    assert entry["user_id"] == "1"
+
+
+def test_profiler_keeps_stacks_below_focus():
+    profiler = SamplingProfiler(focus="handle")
+
+    def work():
+        profiler.sample(sys._getframe())
+
+    def handle():
+        work()
+
+    handle()
+    work()
+
+    stacks = profiler.folded().splitlines()
+    assert len(stacks) == 1
+    assert stacks[0].startswith("handle (test_metrics.py:")
+    assert stacks[0].endswith(" 1")
+    assert profiler.samples == 2
@@ -0,0 +1,57 @@
+import asyncio
+
+import pytest
+
+from ratelimit import AdmissionController, AdmissionRejected, RateLimiter
+
+
+def test_bucket_allows_bursts_and_refills_lazily(clock):
+    limiter = RateLimiter(rate=2, burst=3, clock=clock)
+
+    assert [limiter.allow("a") for _ in range(4)] == [True, True, True, False]
+    assert limiter.allow("b")
+    assert limiter.retry_after("a") == 1
+
+    clock.now = 0.5
+    assert limiter.allow("a")
+    assert not limiter.allow("a")
+    clock.now = 100
+    assert [limiter.allow("a") for _ in range(4)] == [True, True, True, False]
+    assert (limiter.allowed, limiter.limited) == (8, 3)
+
+
+def test_least_recently_used_buckets_are_evicted(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_keys=2, clock=clock)
+    limiter.allow("a")
+    limiter.allow("b")
+    limiter.allow("a")
+    limiter.allow("c")
+
+    assert list(limiter.buckets) == ["a", "c"]
+
+
+def test_zero_rate_disables_the_limit():
+    limiter = RateLimiter(rate=0, burst=0)
+
+    assert all(limiter.allow("a") for _ in range(100))
+    assert limiter.buckets == {}
+
+
+@pytest.mark.asyncio
+async def test_admission_sheds_load_beyond_the_queue():
+    admission = AdmissionController(max_in_flight=1, max_waiting=1)
+    release = asyncio.Event()
+
+    async def action():
+        await release.wait()
+
+    first = asyncio.create_task(admission.run(action))
+    second = asyncio.create_task(admission.run(action))
+    await asyncio.sleep(0)
+    assert (admission.in_flight, admission.waiting) == (1, 1)
+    with pytest.raises(AdmissionRejected):
+        await admission.run(action)
+
+    release.set()
+    await asyncio.gather(first, second)
+    assert (admission.in_flight, admission.waiting, admission.admitted, admission.rejected) == (0, 0, 2, 1)
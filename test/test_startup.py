@@ -0,0 +1,55 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+import startup
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return f"sqlite+aiosqlite:///{tmp_path}/startup.db"
+
+
+@pytest.mark.asyncio
+async def test_schema_is_only_created_when_asked(database_url):
+    engine = create_async_engine(database_url)
+    await startup.check_schema(engine, "off")
+    with pytest.raises(RuntimeError, match="missing users, game_sessions, game_stats"):
+        await startup.check_schema(engine, "verify")
+    with pytest.raises(ValueError):
+        await startup.check_schema(engine, "drop")
+
+    await startup.check_schema(engine, "create")
+    await startup.check_schema(engine, "verify")
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("ALTER TABLE game_sessions DROP COLUMN rounds")
+    with pytest.raises(RuntimeError, match="game_sessions.rounds"):
+        await startup.check_schema(engine, "verify")
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_pool_is_prewarmed(database_url):
+    engine = create_async_engine(database_url, poolclass=AsyncAdaptedQueuePool, pool_size=3, max_overflow=0)
+    assert await startup.prewarm_pool(engine, 5) == 3
+    assert engine.pool.checkedin() == 3
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_waiting_for_an_unreachable_database_gives_up(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/missing/startup.db")
+    with pytest.raises(Exception):
+        await startup.wait_for_database(engine, timeout=0.2, interval=0.05)
+    await engine.dispose()
+
+
+def test_readiness_reports_failure_and_shutdown():
+    readiness = startup.Readiness()
+    assert readiness.status() == "starting"
+    readiness.mark_ready()
+    assert readiness.status() == "ready" and readiness.warm_up_seconds >= 0
+    readiness.stopping = True
+    assert readiness.status() == "stopping"
+    readiness.mark_failed(RuntimeError("no database"))
+    assert (readiness.status(), readiness.error) == ("failed", "RuntimeError: no database")
@@ -0,0 +1,59 @@
+import pytest
+
+import models
+from game import GameManager
+from stats import StatsAggregator
+
+
+async def add_completed_session(db_session, player1_move, player2_move, stats_applied=False):
+    session = models.GameSession(player1_id=1, player2_id=2, player1_move=player1_move,
+                                 player2_move=player2_move, status='completed', stats_applied=stats_applied)
+    db_session.add(session)
+    await db_session.commit()
+    return session.session_id
+
+
+async def get_stats(db_session, user_id):
+    db_session.expire_all()
+    stats = await db_session.get(models.GameStat, user_id)
+    return stats.wins, stats.losses, stats.draws
+
+
+@pytest.mark.asyncio
+async def test_flush_batches_deltas(session_factory, db_session):
+    aggregator = StatsAggregator(session_factory, max_pending=10)
+    first = await add_completed_session(db_session, 'rock', 'scissors')
+    second = await add_completed_session(db_session, 'rock', 'rock')
+
+    assert aggregator.add(first, 1, 2, 1) is True
+    assert aggregator.add(first, 1, 2, 1) is False
+    aggregator.add(second, 1, 2, None)
+
+    assert await aggregator.flush() == 2
+    assert await get_stats(db_session, 1) == (1, 0, 1)
+    assert await get_stats(db_session, 2) == (0, 1, 1)
+    assert aggregator.flushes == 1
+
+
+@pytest.mark.asyncio
+async def test_applied_sessions_are_skipped(session_factory, db_session):
+    aggregator = StatsAggregator(session_factory)
+    session_id = await add_completed_session(db_session, 'paper', 'rock')
+
+    aggregator.add(session_id, 1, 2, 1)
+    await aggregator.flush()
+    aggregator.add(session_id, 1, 2, 1)
+
+    assert await aggregator.flush() == 0
+    assert await get_stats(db_session, 1) == (1, 0, 0)
+
+
+@pytest.mark.asyncio
+async def test_recover_unapplied_sessions(session_factory, db_session):
+    aggregator = StatsAggregator(session_factory)
+    await add_completed_session(db_session, 'rock', 'paper')
+    await add_completed_session(db_session, 'rock', 'scissors', stats_applied=True)
+
+    assert await aggregator.recover(GameManager().determine_winner) == 1
+    await aggregator.flush()
+    assert await get_stats(db_session, 2) == (1, 0, 0)
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from timers import TimerScheduler
+
+
+def test_expire_due_batches_by_kind(clock):
+    scheduler = TimerScheduler({}, clock=clock)
+    scheduler.schedule("move", 1, 10)
+    scheduler.schedule("move", 2, 5)
+    scheduler.schedule("search", "7", 5)
+    scheduler.schedule("move", 3, 20)
+
+    assert scheduler.expire_due(4) == {}
+    assert scheduler.expire_due(10) == {"move": [2, 1], "search": ["7"]}
+    assert len(scheduler) == 1
+
+
+def test_cancel_and_reschedule(clock):
+    scheduler = TimerScheduler({}, clock=clock)
+    scheduler.schedule("move", 1, 5)
+    scheduler.schedule("move", 2, 5)
+
+    assert scheduler.cancel("move", 1) is True
+    assert scheduler.cancel("move", 1) is False
+    scheduler.schedule("move", 2, 30)
+
+    assert scheduler.expire_due(10) == {}
+    assert scheduler.next_deadline() == 30
+    assert scheduler.expire_due(30) == {"move": [2]}
+
+
+def test_cancelled_timers_are_compacted(clock):
+    scheduler = TimerScheduler({}, clock=clock)
+    for key in range(1000):
+        scheduler.schedule("move", key, 5)
+    for key in range(900):
+        scheduler.cancel("move", key)
+
+    assert len(scheduler.heap) < 1000
+    assert len(scheduler.expire_due(5)["move"]) == 100
+
+
+@pytest.mark.asyncio
+async def test_run_calls_handler():
+    expired = []
+
+    async def handler(keys):
+        expired.extend(keys)
+
+    scheduler = TimerScheduler({"move": handler})
+    scheduler.start()
+    scheduler.schedule("move", 1, 0.05)
+    scheduler.schedule("move", 2, 0.01)
+    await asyncio.sleep(0.1)
+    await scheduler.stop()
+
+    assert expired == [2, 1]
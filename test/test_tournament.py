@@ -0,0 +1,62 @@
+import itertools
+
+import pytest
+
+import models
+import tournament
+from game import MOVES, GameManager
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(tournament, "np", None)
+    return request.param
+
+
+def test_resolve_matches_determine_winner(backend):
+    pairs = list(itertools.product(MOVES, repeat=2))
+    outcomes = tournament.resolve(tournament.encode_moves([pair[0] for pair in pairs]),
+                                  tournament.encode_moves([pair[1] for pair in pairs]))
+
+    for (move1, move2), outcome in zip(pairs, outcomes):
+        winner = GameManager.determine_winner(1, move1, 2, move2)['winner']
+        assert outcome == {None: 0, 1: 1, 2: -1}[winner]
+
+
+def test_round_robin_standings(backend):
+    player1_ids, player2_ids = tournament.round_robin([1, 2, 3])
+    moves = {1: 'rock', 2: 'scissors', 3: 'rock'}
+    outcomes = tournament.resolve(tournament.encode_moves(moves[int(i)] for i in player1_ids),
+                                  tournament.encode_moves(moves[int(i)] for i in player2_ids))
+
+    totals = tournament.tally(player1_ids, player2_ids, outcomes)
+
+    assert totals == {1: [1, 0, 1], 2: [0, 2, 0], 3: [1, 0, 1]}
+    assert [row["user_id"] for row in tournament.standings(totals)] == [1, 3, 2]
+    assert tournament.standings(totals)[0]["points"] == 4
+
+
+def test_knockout_plays_until_one_champion(backend):
+    # Each round asks for player 1's moves, then player 2's. 0 is rock, 1 paper, 2 scissors.
+    rounds = iter([[0, 0], [0, 1], [0], [2], [1], [0], [0], [1]])
+
+    champion, totals = tournament.knockout([1, 2, 3, 4, 5], lambda count: next(rounds))
+
+    # 1 v 2 draws and 1 wins the replay, 4 beats 3 and 5 has a bye; 4 beats 1 while 5 has another bye.
+    assert champion == 5
+    assert totals == {1: [1, 1, 1], 2: [0, 1, 1], 3: [0, 1, 0], 4: [2, 1, 0], 5: [1, 0, 0]}
+
+
+@pytest.mark.asyncio
+async def test_apply_results_updates_game_stats_and_logs_them(session_factory, db_session):
+    manager = GameManager(session_factory)
+    assert await tournament.apply_results(db_session, {1: [3, 1, 0], 2: [1, 3, 0]}, manager) == 2
+
+    assert [(event["type"], event["totals"]) for event in manager.events.pending] == [
+        ("tournament", {1: [3, 1, 0], 2: [1, 3, 0]})]
+    assert manager.leaderboard.rank(1)["wins"] == 3
+
+    db_session.expire_all()
+    stats = await db_session.get(models.GameStat, 1)
+    assert (stats.wins, stats.losses, stats.draws) == (3, 1, 0)
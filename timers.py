@@ -0,0 +1,111 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Timer:
+    __slots__ = ('deadline', 'kind', 'key', 'cancelled')
+
+    def __init__(self, deadline: float, kind: str, key):
+        self.deadline = deadline
+        self.kind = kind
+        self.key = key
+        self.cancelled = False
+
+
+class TimerScheduler:
+    """Deadlines for many matches driven by a single asyncio task.
+
+    Timers live in a heap: scheduling is O(log n) and cancelling is O(1) (the entry is marked and skipped
+    when it reaches the top; the heap is rebuilt once cancelled entries outnumber live ones). Expired
+    timers are handed to the handler of their kind in batches of keys.
+    """
+
+    def __init__(self, handlers: dict, clock=time.monotonic, max_batch: int = 1000):
+        self.handlers = handlers
+        self.clock = clock
+        self.max_batch = max_batch
+        self.heap = []
+        self.timers = {}
+        self.cancelled = 0
+        self.counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return len(self.timers)
+
+    def schedule(self, kind: str, key, delay: float):
+        self.cancel(kind, key)
+        timer = Timer(self.clock() + delay, kind, key)
+        self.timers[kind, key] = timer
+        if not self.heap or timer.deadline < self.heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+
+    def cancel(self, kind: str, key):
+        timer = self.timers.pop((kind, key), None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        self.cancelled += 1
+        if self.cancelled > len(self.timers) and self.cancelled > 64:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+        return True
+
+    def expire_due(self, now: float = None):
+        """Pops expired timers and returns {kind: [key, ...]}."""
+        if now is None:
+            now = self.clock()
+        expired = {}
+        count = 0
+        while self.heap and self.heap[0][0] <= now and count < self.max_batch:
+            _, _, timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                self.cancelled -= 1
+                continue
+            del self.timers[timer.kind, timer.key]
+            expired.setdefault(timer.kind, []).append(timer.key)
+            count += 1
+        return expired
+
+    def next_deadline(self):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+            self.cancelled -= 1
+        return self.heap[0][0] if self.heap else None
+
+    async def run(self):
+        while True:
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - self.clock())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            for kind, keys in self.expire_due().items():
+                try:
+                    await self.handlers[kind](keys)
+                except Exception:
+                    logger.exception("Error handling expired timers", extra={"kind": kind, "keys": len(keys)})
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,171 @@
+"""Bulk match resolution for round-robin and knockout tournaments and bot ladders.
+
+Moves are encoded as small integers (their index in MOVES) and a whole round is resolved with one lookup in a
+3x3 payoff table built from GameManager.determine_winner, so both paths always agree on the rules. Tournament
+games are not stored as game sessions; their results are logged as one event and go to game_stats in one batched
+update.
+"""
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; without it rounds are resolved pair by pair from the same table.
+    np = None
+
+import caching
+from game import MOVES, GameManager
+from leaderboard import points, rank_key
+from stats import increment_stats
+
+MOVE_CODES = {move: code for code, move in enumerate(MOVES)}
+
+
+def _payoff_table():
+    # 1: player 1 wins, -1: player 2 wins, 0: draw.
+    table = []
+    for move1 in MOVES:
+        row = []
+        for move2 in MOVES:
+            winner = GameManager.determine_winner(1, move1, 2, move2)['winner']
+            row.append(0 if winner is None else 1 if winner == 1 else -1)
+        table.append(row)
+    return table
+
+
+PAYOFF_TABLE = _payoff_table()
+PAYOFF = np.array(PAYOFF_TABLE, dtype=np.int8) if np is not None else None
+
+
+def encode_moves(moves):
+    if np is not None:
+        return np.fromiter((MOVE_CODES[move] for move in moves), dtype=np.int8)
+    return [MOVE_CODES[move] for move in moves]
+
+
+def resolve(player1_moves, player2_moves):
+    """Returns the outcome (1, -1 or 0) of every pairing from two sequences of move codes."""
+    if np is not None:
+        return PAYOFF[np.asarray(player1_moves, dtype=np.intp), np.asarray(player2_moves, dtype=np.intp)]
+    return [PAYOFF_TABLE[move1][move2] for move1, move2 in zip(player1_moves, player2_moves)]
+
+
+def tally(player1_ids, player2_ids, outcomes):
+    """Returns {user_id: [wins, losses, draws]} for a batch of resolved pairings."""
+    if np is None:
+        totals = {}
+        for player1_id, player2_id, outcome in zip(player1_ids, player2_ids, outcomes):
+            total1 = totals.setdefault(player1_id, [0, 0, 0])
+            total2 = totals.setdefault(player2_id, [0, 0, 0])
+            if outcome == 1:
+                total1[0] += 1
+                total2[1] += 1
+            elif outcome == -1:
+                total1[1] += 1
+                total2[0] += 1
+            else:
+                total1[2] += 1
+                total2[2] += 1
+        return totals
+
+    outcomes = np.asarray(outcomes)
+    user_ids, players = np.unique(np.concatenate([player1_ids, player2_ids]), return_inverse=True)
+    player1_won, player2_won, drawn = outcomes == 1, outcomes == -1, outcomes == 0
+    columns = [
+        np.bincount(players, weights=np.concatenate(flags), minlength=len(user_ids)).astype(np.int64)
+        for flags in ((player1_won, player2_won), (player2_won, player1_won), (drawn, drawn))
+    ]
+    return {
+        int(user_id): [int(wins), int(losses), int(draws)]
+        for user_id, wins, losses, draws in zip(user_ids, *columns)
+    }
+
+
+def merge(totals, deltas):
+    for user_id, (wins, losses, draws) in deltas.items():
+        total = totals.setdefault(user_id, [0, 0, 0])
+        total[0] += wins
+        total[1] += losses
+        total[2] += draws
+    return totals
+
+
+def standings(totals):
+    rows = [
+        {
+            "user_id": user_id,
+            "wins": wins,
+            "losses": losses,
+            "draws": draws,
+            "points": points(wins, draws),
+        }
+        for user_id, (wins, losses, draws) in totals.items()
+    ]
+    rows.sort(key=lambda row: rank_key(row["user_id"], row["wins"], row["losses"], row["draws"]))
+    return rows
+
+
+def round_robin(player_ids):
+    """Returns the (player1_ids, player2_ids) of every pairing in a single round robin."""
+    if np is not None:
+        player_ids = np.asarray(player_ids)
+        first, second = np.triu_indices(len(player_ids), k=1)
+        return player_ids[first], player_ids[second]
+    pairs = [(player1_id, player_id) for index, player1_id in enumerate(player_ids)
+             for player_id in player_ids[index + 1:]]
+    return [pair[0] for pair in pairs], [pair[1] for pair in pairs]
+
+
+def play(player1_ids, player2_ids, choose_moves):
+    """Plays one game per pairing with moves from `choose_moves(count)` and returns the tally."""
+    outcomes = resolve(choose_moves(len(player1_ids)), choose_moves(len(player2_ids)))
+    return tally(player1_ids, player2_ids, outcomes)
+
+
+def knockout(player_ids, choose_moves, max_replays: int = 100):
+    """Runs a single-elimination bracket. Drawn pairings are replayed; an odd player out gets a bye.
+
+    Returns (champion_id, {user_id: [wins, losses, draws]}).
+    """
+    totals = {}
+    remaining = list(player_ids)
+    while len(remaining) > 1:
+        bye = remaining.pop() if len(remaining) % 2 else None
+        pending1, pending2 = remaining[0::2], remaining[1::2]
+        winners = []
+        for _ in range(max_replays):
+            if not pending1:
+                break
+            outcomes = resolve(choose_moves(len(pending1)), choose_moves(len(pending2)))
+            merge(totals, tally(pending1, pending2, outcomes))
+            drawn1, drawn2 = [], []
+            for player1_id, player2_id, outcome in zip(pending1, pending2, outcomes):
+                if outcome == 1:
+                    winners.append(player1_id)
+                elif outcome == -1:
+                    winners.append(player2_id)
+                else:
+                    drawn1.append(player1_id)
+                    drawn2.append(player2_id)
+            pending1, pending2 = drawn1, drawn2
+        # Pairings still drawn after max_replays are decided for the higher seed.
+        winners.extend(pending1)
+        if bye is not None:
+            winners.append(bye)
+        remaining = winners
+    return (remaining[0] if remaining else None), totals
+
+
+async def apply_results(db, totals, manager):
+    """Adds tournament results to game_stats in one batch and to the leaderboards. They are logged first, as
+    one "tournament" event in the GameManager's event log, so an event log rebuild always keeps them."""
+    if not totals:
+        return 0
+    totals = {int(user_id): [int(count) for count in deltas] for user_id, deltas in totals.items()}
+    manager.record_event("tournament", totals=totals)
+    await manager.events.sync()
+    await db.execute(increment_stats, [
+        {'b_user_id': user_id, 'b_wins': wins, 'b_losses': losses, 'b_draws': draws}
+        for user_id, (wins, losses, draws) in totals.items()
+    ])
+    await db.commit()
+    await caching.invalidate_stats(totals.keys())
+    await manager.update_leaderboard(totals)
+    return len(totals)